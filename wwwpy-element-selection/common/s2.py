@@ -1,7 +1,9 @@
 from __future__ import annotations
-from typing import TypeVar, Generic, Protocol, Any, Type, runtime_checkable
+from typing import TypeVar, Generic, Protocol, Any, Type, runtime_checkable, get_origin, get_args
+from array import array
 import json
 import struct
+import sys
 import unittest
 
 T = TypeVar('T')
@@ -14,6 +16,8 @@ class Encoder(Protocol):
     def encode_int(self, value: int) -> None: ...
     def encode_float(self, value: float) -> None: ...
     def encode_str(self, value: str) -> None: ...
+    def encode_int_array(self, values: list[int]) -> None: ...
+    def encode_float_array(self, values: list[float]) -> None: ...
     def begin_list(self, size: int | None = None) -> None: ...
     def end_list(self) -> None: ...
     def begin_object(self) -> None: ...
@@ -27,9 +31,11 @@ class Decoder(Protocol):
     def decode_int(self) -> int: ...
     def decode_float(self) -> float: ...
     def decode_str(self) -> str: ...
+    def decode_int_array(self) -> list[int]: ...
+    def decode_float_array(self) -> list[float]: ...
     def begin_list(self) -> int | None: ...
     def end_list(self) -> None: ...
-    def begin_object(self) -> None: ...
+    def begin_object(self) -> int | None: ...
     def end_object(self) -> None: ...
     def decode_key(self) -> str: ...
 
@@ -52,8 +58,19 @@ class SerializersRegistry:
     def get(self, type_hint: TypeHint) -> Serializer[Any]:
         if type_hint in self._registry:
             return self._registry[type_hint]
+        if get_origin(type_hint) is list and get_args(type_hint) == (int,) and self._packable(int):
+            return self._registry.setdefault(type_hint, IntArraySerializer())
+        if get_origin(type_hint) is list and get_args(type_hint) == (float,) and self._packable(float):
+            return self._registry.setdefault(type_hint, FloatArraySerializer())
+        if get_origin(type_hint) is list and len(get_args(type_hint)) == 1:
+            return self._registry.setdefault(type_hint, ListSerializer(get_args(type_hint)[0], self))
         raise TypeError(f"No serializer registered for type: {type_hint}")
 
+    def _packable(self, item_type: type) -> bool:
+        """Lists of ints or floats are packed in an array, unless a custom serializer is registered for the items."""
+        serializer = self._registry.get(item_type)
+        return serializer is None or item_type is int and type(serializer) is IntSerializer
+
 
 class JsonEncoder:
     def __init__(self):
@@ -75,19 +92,28 @@ class JsonEncoder:
     def encode_str(self, value: str) -> None:
         self._append(value)
 
+    def encode_int_array(self, values: list[int]) -> None:
+        self._append(list(values))
+
+    def encode_float_array(self, values: list[float]) -> None:
+        self._append(list(values))
+
+    # containers are added to their parent when they begin, while the key of the parent is still the current one
     def begin_list(self, size: int | None = None) -> None:
-        self._stack.append([])
+        lst = []
+        self._append(lst)
+        self._stack.append(lst)
 
     def end_list(self) -> None:
-        lst = self._stack.pop()
-        self._append(lst)
+        self._stack.pop()
 
     def begin_object(self) -> None:
-        self._stack.append({})
+        obj = {}
+        self._append(obj)
+        self._stack.append(obj)
 
     def end_object(self) -> None:
-        obj = self._stack.pop()
-        self._append(obj)
+        self._stack.pop()
 
     def encode_key(self, key: str) -> None:
         self._key = key
@@ -110,10 +136,10 @@ class JsonDecoder:
     def __init__(self, data: str):
         self._root = json.loads(data)
         self._stack = [self._root]
-        self._iterator = None
+        self._iterators = []
 
     def decode_none(self) -> None:
-        return None
+        return self._stack.pop()
 
     def decode_bool(self) -> bool:
         return self._stack.pop()
@@ -127,25 +153,31 @@ class JsonDecoder:
     def decode_str(self) -> str:
         return self._stack.pop()
 
+    def decode_int_array(self) -> list[int]:
+        return self._stack.pop()
+
+    def decode_float_array(self) -> list[float]:
+        return self._stack.pop()
+
     def begin_list(self) -> int | None:
+        # the items are pushed in reverse, so the next decode_* pops the first one
         lst = self._stack.pop()
-        self._stack.append(lst)
-        self._iterator = iter(lst)
+        self._stack.extend(reversed(lst))
         return len(lst)
 
     def end_list(self) -> None:
-        self._stack.pop()
+        pass
 
-    def begin_object(self) -> None:
+    def begin_object(self) -> int | None:
         obj = self._stack.pop()
-        self._stack.append(obj)
-        self._iterator = iter(obj.items())
+        self._iterators.append(iter(obj.items()))
+        return len(obj)
 
     def end_object(self) -> None:
-        self._stack.pop()
+        self._iterators.pop()
 
     def decode_key(self) -> str:
-        key, value = next(self._iterator)
+        key, value = next(self._iterators[-1])
         self._stack.append(value)
         return key
 
@@ -166,80 +198,352 @@ class JsonFormat:
         return serializer.deserialize(decoder, type_hint)
 
 
+_INT = struct.Struct('>i')
+_FLOAT = struct.Struct('>d')
+_SWAP = sys.byteorder == 'big'  # arrays are in the native order, the packed arrays of the format are little-endian
+_ITEM_SIZES = {typecode: array(typecode).itemsize for typecode in 'bhiqd'}
+
+_VARINT = 0x01
+"""Header flag: ints, lengths and counts are varints instead of 4-byte ints."""
+_TAGGED = 0x02
+"""
+Header flag of the current format version: every value starts with its type tag. Always set; the data of the
+untagged version, without the flag, cannot be read any more.
+"""
+_LITTLE_ENDIAN = 0x04
+"""
+Header flag: the packed arrays are little-endian, so the usual hosts read them in place. Always set; the arrays
+of the data without the flag are big-endian.
+"""
+
+(_TAG_NONE, _TAG_FALSE, _TAG_TRUE, _TAG_INT, _TAG_FLOAT, _TAG_STR, _TAG_LIST, _TAG_MAP,
+ _TAG_INT_ARRAY, _TAG_FLOAT_ARRAY) = range(10)
+_TAG_NAMES = ['none', 'false', 'true', 'int', 'float', 'str', 'list', 'map', 'int array', 'float array']
+
+_ARRAY_TYPECODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+"""Item size to array typecode of the packed int arrays of the varint encoding; size 0 means one varint per item."""
+
+
 class BinaryEncoder:
-    def __init__(self):
-        self._buffer = bytearray()
+    """
+    Writes a header byte of flags, then the values, each one starting with a type tag, so the data can be
+    decoded without knowing its type (see `BinaryDecoder.decode_value`):
+
+    - none, false, true: the tag alone
+    - int: a zigzag LEB128 varint of any size with `varint` (the default), 4-byte big-endian otherwise
+    - float: 8-byte big-endian; str: the length, then the UTF-8 bytes
+    - list: the count, then the items; map: the count, then key/value pairs
+    - int array, float array: the count, then the items packed little-endian (see `encode_int_array`)
+
+    Lengths and counts are varints too with `varint`, 4-byte otherwise. Keys are written once: the first
+    time as 0 followed by the string, then as the 1-based index in the table of the keys met so far.
+    """
+
+    def __init__(self, varint: bool = True):
+        self._varint = varint
+        self._buffer = bytearray([_TAGGED | _LITTLE_ENDIAN | (_VARINT if varint else 0)])
+        self._keys: dict[str, int] = {}
+        self._maps: list[list[int]] = []  # [offset of the count, count] of each open map
 
     def encode_int(self, value: int) -> None:
-        self._buffer += struct.pack('>i', value)
+        self._buffer.append(_TAG_INT)
+        self._encode_int(value)
 
     def encode_float(self, value: float) -> None:
-        self._buffer += struct.pack('>d', value)
+        self._buffer.append(_TAG_FLOAT)
+        self._buffer += _FLOAT.pack(value)
 
     def encode_bool(self, value: bool) -> None:
-        self._buffer += struct.pack('>?', value)
+        self._buffer.append(_TAG_TRUE if value else _TAG_FALSE)
 
     def encode_none(self) -> None:
-        self._buffer += b'\x00'
+        self._buffer.append(_TAG_NONE)
 
     def encode_str(self, value: str) -> None:
+        self._buffer.append(_TAG_STR)
+        self._encode_text(value)
+
+    # numeric lists are written as the count followed by the packed items, in one call instead of one per item
+    def encode_int_array(self, values: list[int]) -> None:
+        self._buffer.append(_TAG_INT_ARRAY)
+        if not self._varint:
+            self._encode_array(array('i', values))
+            return
+        # the items are packed at the smallest size that fits them all, preceded by that size
+        size = _int_size(min(values), max(values)) if values else 1
+        self._encode_length(len(values))
+        self._buffer.append(size)
+        if size:
+            self._buffer += _packed(array(_ARRAY_TYPECODES[size], values))
+        else:
+            for value in values:
+                self._encode_int(value)
+
+    def encode_float_array(self, values: list[float]) -> None:
+        self._buffer.append(_TAG_FLOAT_ARRAY)
+        self._encode_array(array('d', values))
+
+    def begin_list(self, size: int | None = None) -> None:
+        if size is None:
+            raise ValueError('The binary format needs the size of the lists')
+        self._buffer.append(_TAG_LIST)
+        self._encode_length(size)
+
+    def end_list(self) -> None:
+        pass
+
+    def begin_object(self) -> None:
+        # the count is known at the end only: it is inserted then, after the tag
+        self._buffer.append(_TAG_MAP)
+        self._maps.append([len(self._buffer), 0])
+
+    def end_object(self) -> None:
+        offset, count = self._maps.pop()
+        if self._varint:
+            length = bytearray()
+            _write_uvarint(length, count)
+        else:
+            length = _INT.pack(count)
+        self._buffer[offset:offset] = length
+
+    def encode_key(self, key: str) -> None:
+        self._maps[-1][1] += 1
+        index = self._keys.get(key)
+        if index is None:
+            self._keys[key] = len(self._keys)
+            self._encode_length(0)
+            self._encode_text(key)
+        else:
+            self._encode_length(index + 1)
+
+    def _encode_int(self, value: int) -> None:
+        if self._varint:
+            # zigzag: 0, -1, 1, -2... are written as 0, 1, 2, 3..., so small negative ints stay short
+            _write_uvarint(self._buffer, value << 1 if value >= 0 else (-value << 1) - 1)
+        else:
+            self._buffer += _INT.pack(value)
+
+    def _encode_text(self, value: str) -> None:
         data = value.encode('utf-8')
-        self.encode_int(len(data))
+        self._encode_length(len(data))
         self._buffer += data
 
-    def begin_list(self, size: int | None = None) -> None: pass
-    def end_list(self) -> None: pass
-    def begin_object(self) -> None: pass
-    def end_object(self) -> None: pass
-    def encode_key(self, key: str) -> None: pass
+    def _encode_array(self, items: array) -> None:
+        self._encode_length(len(items))
+        self._buffer += _packed(items)
+
+    def _encode_length(self, length: int) -> None:
+        if self._varint:
+            _write_uvarint(self._buffer, length)
+        else:
+            self._buffer += _INT.pack(length)
 
     def finalize(self) -> bytes:
+        if self._maps:
+            raise ValueError(f'{len(self._maps)} objects were not ended')
         return bytes(self._buffer)
 
 
+def _write_uvarint(buffer: bytearray, value: int) -> None:
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _int_size(low: int, high: int) -> int:
+    for size in _ARRAY_TYPECODES:
+        limit = 1 << (size * 8 - 1)
+        if -limit <= low and high < limit:
+            return size
+    return 0
+
+
+def _packed(items: array) -> array:
+    if _SWAP:
+        items.byteswap()
+    return items
+
+
 class BinaryDecoder:
+    """
+    Reads the data of `BinaryEncoder` in a single pass over a memoryview; only strings and arrays are copied out.
+    Every read is checked against the end of the data: truncated data raises ValueError('truncated data').
+    """
+
     def __init__(self, data: bytes):
         self._buffer = memoryview(data)
+        self._end = len(self._buffer)
         self._offset = 0
-
-    def _read(self, fmt: str) -> Any:
-        size = struct.calcsize(fmt)
-        val = struct.unpack(fmt, self._buffer[self._offset:self._offset + size])[0]
-        self._offset += size
-        return val
+        self._need(1)
+        flags = self._buffer[0]
+        if not flags & _TAGGED:
+            raise ValueError(f'Binary data of the untagged format (header {flags:#04x}) is not supported')
+        self._varint = bool(flags & _VARINT)
+        self._swap = bool(flags & _LITTLE_ENDIAN) == _SWAP
+        self._offset = 1
+        self._keys: list[str] = []
 
     def decode_int(self) -> int:
-        return self._read('>i')
+        self._expect(_TAG_INT)
+        return self._decode_int()
 
     def decode_float(self) -> float:
-        return self._read('>d')
+        self._expect(_TAG_FLOAT)
+        self._need(_FLOAT.size)
+        value = _FLOAT.unpack_from(self._buffer, self._offset)[0]
+        self._offset += _FLOAT.size
+        return value
 
     def decode_bool(self) -> bool:
-        return self._read('>?')
+        tag = self._peek()
+        if tag != _TAG_TRUE and tag != _TAG_FALSE:
+            raise self._unexpected('bool')
+        self._offset += 1
+        return tag == _TAG_TRUE
 
     def decode_none(self) -> None:
-        self._offset += 1
+        self._expect(_TAG_NONE)
         return None
 
     def decode_str(self) -> str:
-        length = self.decode_int()
-        data = self._buffer[self._offset:self._offset + length].tobytes()
-        self._offset += length
-        return data.decode('utf-8')
+        self._expect(_TAG_STR)
+        return self._decode_text()
+
+    def decode_int_array(self) -> list[int]:
+        self._expect(_TAG_INT_ARRAY)
+        if not self._varint:
+            return self._decode_items('i', self._decode_length())
+        count = self._decode_length()
+        self._need(1)
+        size = self._buffer[self._offset]
+        self._offset += 1
+        if size:
+            return self._decode_items(_ARRAY_TYPECODES[size], count)
+        return [self._decode_int() for _ in range(count)]
+
+    def decode_float_array(self) -> list[float]:
+        self._expect(_TAG_FLOAT_ARRAY)
+        return self._decode_items('d', self._decode_length())
+
+    def begin_list(self) -> int | None:
+        self._expect(_TAG_LIST)
+        return self._decode_length()
+
+    def end_list(self) -> None:
+        pass
+
+    def begin_object(self) -> int | None:
+        self._expect(_TAG_MAP)
+        return self._decode_length()
 
-    def begin_list(self) -> int | None: return None
-    def end_list(self) -> None: pass
-    def begin_object(self) -> None: pass
-    def end_object(self) -> None: pass
-    def decode_key(self) -> str: return ""
+    def end_object(self) -> None:
+        pass
+
+    def decode_key(self) -> str:
+        index = self._decode_length()
+        if index:
+            return self._keys[index - 1]
+        key = self._decode_text()
+        self._keys.append(key)
+        return key
+
+    def decode_value(self) -> Any:
+        """The next value whatever its type: lists and arrays as lists, maps as dicts."""
+        tag = self._peek()
+        if tag == _TAG_LIST:
+            return [self.decode_value() for _ in range(self.begin_list())]
+        if tag == _TAG_MAP:
+            return {self.decode_key(): self.decode_value() for _ in range(self.begin_object())}
+        if tag >= len(_TAG_NAMES):
+            raise self._unexpected('a value')
+        return _TAG_DECODERS[tag](self)
+
+    def _peek(self) -> int:
+        self._need(1)
+        return self._buffer[self._offset]
+
+    def _expect(self, tag: int) -> None:
+        if self._peek() != tag:
+            raise self._unexpected(_TAG_NAMES[tag])
+        self._offset += 1
+
+    def _unexpected(self, expected: str) -> ValueError:
+        found = self._buffer[self._offset]
+        name = _TAG_NAMES[found] if found < len(_TAG_NAMES) else f'unknown tag {found}'
+        return ValueError(f'Expected {expected} at offset {self._offset}, found {name}')
+
+    def _decode_int(self) -> int:
+        if self._varint:
+            value = self._decode_uvarint()
+            return (value >> 1) ^ -(value & 1)
+        self._need(_INT.size)
+        value = _INT.unpack_from(self._buffer, self._offset)[0]
+        self._offset += _INT.size
+        return value
+
+    def _decode_text(self) -> str:
+        length = self._decode_length()
+        self._need(length)
+        end = self._offset + length
+        text = str(self._buffer[self._offset:end], 'utf-8')  # decoded straight from the view
+        self._offset = end
+        return text
+
+    def _decode_items(self, typecode: str, count: int) -> list:
+        size = count * _ITEM_SIZES[typecode]
+        self._need(size)
+        end = self._offset + size
+        view = self._buffer[self._offset:end]
+        self._offset = end
+        if not self._swap:
+            return view.cast(typecode).tolist()  # the items are read in place
+        items = array(typecode)
+        items.frombytes(view)  # copied once, to be put in the native order
+        items.byteswap()
+        return items.tolist()
+
+    def _decode_length(self) -> int:
+        if self._varint:
+            return self._decode_uvarint()
+        self._need(_INT.size)
+        value = _INT.unpack_from(self._buffer, self._offset)[0]
+        self._offset += _INT.size
+        return value
+
+    def _decode_uvarint(self) -> int:
+        buffer = self._buffer
+        offset = self._offset
+        result = shift = 0
+        while True:
+            if offset == self._end:
+                raise ValueError('truncated data')
+            byte = buffer[offset]
+            offset += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        self._offset = offset
+        return result
+
+    def _need(self, size: int) -> None:
+        if self._offset + size > self._end:
+            raise ValueError('truncated data')
+
+
+_TAG_DECODERS = [BinaryDecoder.decode_none, BinaryDecoder.decode_bool, BinaryDecoder.decode_bool,
+                 BinaryDecoder.decode_int, BinaryDecoder.decode_float, BinaryDecoder.decode_str, None, None,
+                 BinaryDecoder.decode_int_array, BinaryDecoder.decode_float_array]
 
 
 class BinaryFormat:
-    def __init__(self, registry: SerializersRegistry):
+    def __init__(self, registry: SerializersRegistry, varint: bool = True):
         self.registry = registry
+        self.varint = varint
 
     def dumps(self, value: Any, type_hint: TypeHint = None) -> bytes:
-        encoder = BinaryEncoder()
+        encoder = BinaryEncoder(self.varint)
         serializer = self.registry.get(type_hint or type(value))
         serializer.serialize(encoder, value, type_hint)
         return encoder.finalize()
@@ -258,6 +562,42 @@ class IntSerializer(Serializer[int]):
         return decoder.decode_int()
 
 
+class IntArraySerializer(Serializer[list[int]]):
+    def serialize(self, encoder: Encoder, value: list[int], type_hint: TypeHint = None) -> None:
+        encoder.encode_int_array(value)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> list[int]:
+        return decoder.decode_int_array()
+
+
+class FloatArraySerializer(Serializer[list[float]]):
+    def serialize(self, encoder: Encoder, value: list[float], type_hint: TypeHint = None) -> None:
+        encoder.encode_float_array(value)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> list[float]:
+        return decoder.decode_float_array()
+
+
+class ListSerializer(Serializer[list[Any]]):
+    def __init__(self, elem_type: TypeHint, registry: SerializersRegistry):
+        self.elem_type = elem_type
+        self.registry = registry
+
+    def serialize(self, encoder: Encoder, value: list[Any], type_hint: TypeHint = None) -> None:
+        encoder.begin_list(len(value))
+        serializer = self.registry.get(self.elem_type)
+        for item in value:
+            serializer.serialize(encoder, item, self.elem_type)
+        encoder.end_list()
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> list[Any]:
+        size = decoder.begin_list()
+        serializer = self.registry.get(self.elem_type)
+        result = [serializer.deserialize(decoder, self.elem_type) for _ in range(size)]
+        decoder.end_list()
+        return result
+
+
 class TestJsonFormat(unittest.TestCase):
     def test_int_serialization(self):
         registry = SerializersRegistry()
@@ -270,6 +610,25 @@ class TestJsonFormat(unittest.TestCase):
 
         self.assertEqual(original, restored)
 
+    def test_int_array(self):
+        json_format = JsonFormat(SerializersRegistry())
+
+        json_str = json_format.dumps([1, 2, 3], list[int])
+
+        self.assertEqual('[1, 2, 3]', json_str)
+        self.assertEqual([1, 2, 3], json_format.loads(json_str, list[int]))
+
+    def test_list_of_objects(self):
+        registry = SerializersRegistry()
+        registry.register(complex, ComplexSerializer())
+        json_format = JsonFormat(registry)
+
+        original = [1 + 2j, 3j]
+        json_str = json_format.dumps(original, list[complex])
+
+        self.assertEqual('[{"re": 1.0, "im": 2.0}, {"re": 0.0, "im": 3.0}]', json_str)
+        self.assertEqual(original, json_format.loads(json_str, list[complex]))
+
 
 class TestBinaryFormat(unittest.TestCase):
     def test_int_serialization(self):
@@ -283,6 +642,230 @@ class TestBinaryFormat(unittest.TestCase):
 
         self.assertEqual(original, restored)
 
+    def test_varint(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        binary_format = BinaryFormat(registry)
+
+        for original, size in [(0, 1), (-1, 1), (63, 1), (-64, 1), (64, 2), (2 ** 31, 5), (-2 ** 63, 10),
+                               (2 ** 100, 15)]:
+            data = binary_format.dumps(original, int)
+            self.assertEqual(2 + size, len(data), original)
+            self.assertEqual(original, binary_format.loads(data, int))
+
+    def test_fixed_int(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        binary_format = BinaryFormat(registry, varint=False)
+
+        data = binary_format.dumps(-2, int)
+
+        self.assertEqual(b'\x06\x03' + struct.pack('>i', -2), data)
+        self.assertEqual(-2, binary_format.loads(data, int))
+        # the header tells the decoder which encoding was used
+        self.assertEqual(-2, BinaryFormat(registry).loads(data, int))
+
+    def test_int_array(self):
+        binary_format = BinaryFormat(SerializersRegistry())
+
+        for original, size in [([0, 1, -1, 127, -128], 1), ([300, -2], 2), ([0, 2 ** 31 - 1, -2 ** 31], 4),
+                               ([2 ** 40], 8)]:
+            data = binary_format.dumps(original, list[int])
+            self.assertEqual(bytes([7, 8, len(original), size]), data[:4])
+            self.assertEqual(4 + size * len(original), len(data))
+            self.assertEqual(original, binary_format.loads(data, list[int]))
+
+    def test_big_int_array(self):
+        binary_format = BinaryFormat(SerializersRegistry())
+
+        original = [1, 2 ** 64, -2 ** 80]
+        data = binary_format.dumps(original, list[int])
+
+        self.assertEqual(0, data[3])
+        self.assertEqual(original, binary_format.loads(data, list[int]))
+
+    def test_fixed_int_array(self):
+        binary_format = BinaryFormat(SerializersRegistry(), varint=False)
+
+        original = [0, 1, -1, 2 ** 31 - 1, -2 ** 31]
+        data = binary_format.dumps(original, list[int])
+
+        self.assertEqual(b'\x06\x08' + struct.pack('>i', 5) + struct.pack('<5i', *original), data)
+        self.assertEqual(original, binary_format.loads(data, list[int]))
+
+    def test_float_array(self):
+        binary_format = BinaryFormat(SerializersRegistry())
+
+        original = [0.5, -1.25, 1e300]
+        data = binary_format.dumps(original, list[float])
+
+        self.assertEqual(b'\x07\x09\x03' + struct.pack('<3d', *original), data)
+        self.assertEqual(original, binary_format.loads(data, list[float]))
+
+    def test_big_endian_arrays(self):
+        # the arrays of the data written before the little-endian flag
+        data = bytes([3, 8, 2, 2]) + struct.pack('>2h', 300, -2) + bytes([9, 1]) + struct.pack('>d', 0.5)
+        decoder = BinaryDecoder(data)
+
+        self.assertEqual([300, -2], decoder.decode_int_array())
+        self.assertEqual([0.5], decoder.decode_float_array())
+
+    def test_custom_item_serializers_are_not_packed(self):
+        class CountingIntSerializer(IntSerializer):
+            count = 0
+
+            def serialize(self, encoder: Encoder, value: int, type_hint: TypeHint = None) -> None:
+                CountingIntSerializer.count += 1
+                super().serialize(encoder, value, type_hint)
+
+        registry = SerializersRegistry()
+        registry.register(int, CountingIntSerializer())
+        binary_format = BinaryFormat(registry)
+
+        data = binary_format.dumps([1, 2, 3], list[int])
+
+        self.assertEqual(3, CountingIntSerializer.count)
+        self.assertEqual(6, data[1])  # a list, not an int array
+        self.assertEqual([1, 2, 3], binary_format.loads(data, list[int]))
+
+    def test_default_int_serializer_is_packed(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+
+        self.assertIsInstance(registry.get(list[int]), IntArraySerializer)
+
+    def test_arrays_are_followed_by_other_values(self):
+        encoder = BinaryEncoder()
+        encoder.encode_int_array([])
+        encoder.encode_int_array([2 ** 70, -3])
+        encoder.encode_float_array([2.0])
+        encoder.encode_str('end')
+        encoder.encode_int(-7)
+
+        decoder = BinaryDecoder(encoder.finalize())
+
+        self.assertEqual([], decoder.decode_int_array())
+        self.assertEqual([2 ** 70, -3], decoder.decode_int_array())
+        self.assertEqual([2.0], decoder.decode_float_array())
+        self.assertEqual('end', decoder.decode_str())
+        self.assertEqual(-7, decoder.decode_int())
+
+    def test_nested_lists(self):
+        registry = SerializersRegistry()
+        registry.register(str, StrSerializer())
+        registry.register(int, IntSerializer())
+        for varint in (True, False):
+            binary_format = BinaryFormat(registry, varint)
+
+            original = [['a', 'bc'], [], ['déf']]
+            self.assertEqual(original, binary_format.loads(binary_format.dumps(original, list[list[str]]),
+                                                           list[list[str]]))
+            original = [[1, 2], [], [-3]]
+            self.assertEqual(original, binary_format.loads(binary_format.dumps(original, list[list[int]]),
+                                                           list[list[int]]))
+
+    def test_objects_write_their_keys_once(self):
+        registry = SerializersRegistry()
+        registry.register(complex, ComplexSerializer())
+        binary_format = BinaryFormat(registry)
+
+        original = [1 + 2j, 3j, -1 + 0j]
+        data = binary_format.dumps(original, list[complex])
+
+        self.assertEqual(1, data.count(b're'))
+        self.assertEqual(original, binary_format.loads(data, list[complex]))
+
+    def test_self_describing(self):
+        encoder = BinaryEncoder()
+        encoder.begin_object()
+        encoder.encode_key('ids')
+        encoder.encode_int_array([1, 2])
+        encoder.encode_key('items')
+        encoder.begin_list(3)
+        encoder.encode_none()
+        encoder.encode_bool(True)
+        encoder.begin_object()
+        encoder.encode_key('ids')
+        encoder.encode_float_array([0.5])
+        encoder.end_object()
+        encoder.end_list()
+        encoder.encode_key('name')
+        encoder.encode_str('x')
+        encoder.end_object()
+
+        decoder = BinaryDecoder(encoder.finalize())
+
+        self.assertEqual({'ids': [1, 2], 'items': [None, True, {'ids': [0.5]}], 'name': 'x'}, decoder.decode_value())
+
+    def test_map_counts_are_compact(self):
+        encoder = BinaryEncoder()
+        encoder.begin_object()
+        encoder.encode_key('a')
+        encoder.encode_int(1)
+        encoder.end_object()
+
+        self.assertEqual(bytes([7, 7, 1, 0, 1]) + b'a' + bytes([3, 2]), encoder.finalize())
+
+    def test_unknown_tags(self):
+        with self.assertRaisesRegex(ValueError, 'Expected bool at offset 1, found int'):
+            BinaryDecoder(bytes([3, 3, 0])).decode_bool()
+        with self.assertRaisesRegex(ValueError, 'Expected a value at offset 1, found unknown tag 99'):
+            BinaryDecoder(bytes([3, 99])).decode_value()
+        with self.assertRaisesRegex(ValueError, 'untagged format'):
+            BinaryDecoder(bytes([1, 0]))
+
+    def test_truncated_data(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        registry.register(str, StrSerializer())
+        registry.register(complex, ComplexSerializer())
+        for varint in (True, False):
+            binary_format = BinaryFormat(registry, varint)
+            for value, type_hint in [(2 ** 20, int), ('text', str), ([1, -2, 300], list[int]),
+                                     ([0.5, 2.0], list[float]), (1 + 2j, complex), ([['a'], []], list[list[str]])]:
+                data = binary_format.dumps(value, type_hint)
+                for end in range(len(data)):
+                    with self.subTest(varint=varint, value=value, end=end):
+                        with self.assertRaisesRegex(ValueError, '^truncated data$'):
+                            binary_format.loads(data[:end], type_hint)
+                        with self.assertRaisesRegex(ValueError, '^truncated data$'):
+                            BinaryDecoder(data[:end]).decode_value()
+
+    def test_type_mismatch(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        registry.register(str, StrSerializer())
+        binary_format = BinaryFormat(registry)
+
+        with self.assertRaisesRegex(ValueError, 'Expected int at offset 1, found str'):
+            binary_format.loads(binary_format.dumps('1', str), int)
+
+
+class StrSerializer(Serializer[str]):
+    def serialize(self, encoder: Encoder, value: str, type_hint: TypeHint = None) -> None:
+        encoder.encode_str(value)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> str:
+        return decoder.decode_str()
+
+
+class ComplexSerializer(Serializer[complex]):
+    def serialize(self, encoder: Encoder, value: complex, type_hint: TypeHint = None) -> None:
+        encoder.begin_object()
+        encoder.encode_key('re')
+        encoder.encode_float(value.real)
+        encoder.encode_key('im')
+        encoder.encode_float(value.imag)
+        encoder.end_object()
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> complex:
+        values = {}
+        for _ in range(decoder.begin_object()):
+            key = decoder.decode_key()
+            values[key] = decoder.decode_float()
+        decoder.end_object()
+        return complex(values['re'], values['im'])
+
 
 if __name__ == '__main__':
     unittest.main()
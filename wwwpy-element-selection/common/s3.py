@@ -1,6 +1,9 @@
 from __future__ import annotations
-from typing import TypeVar, Generic, Protocol, Any, Type, runtime_checkable, get_origin, get_args
+from typing import TypeVar, Generic, Protocol, Any, Type, runtime_checkable, get_origin, get_args, Callable, NamedTuple, \
+    Union, get_type_hints
+import dataclasses
 import json
+import types
 import unittest
 
 T = TypeVar('T')
@@ -26,13 +29,29 @@ class Decoder(Protocol):
     def decode_int(self) -> int: ...
     def decode_float(self) -> float: ...
     def decode_str(self) -> str: ...
+    def is_none(self) -> bool: ...
+    def skip_value(self) -> None: ...
     def begin_list(self) -> int | None: ...
     def end_list(self) -> None: ...
-    def begin_object(self) -> None: ...
+    def begin_object(self) -> int | None: ...
     def end_object(self) -> None: ...
     def decode_key(self) -> str: ...
 
 
+class Plan(NamedTuple):
+    """Specialized conversions between values and the representation of one format (e.g. the JSON tree)."""
+    encode: Callable[[Any], Any]
+    decode: Callable[[Any], Any]
+
+
+class PlanCompiler(Protocol):
+    def scalar(self, type_: type) -> Plan: ...
+    def list(self, elem: Plan) -> Plan: ...
+    def optional(self, inner: Plan) -> Plan: ...
+    def object(self, cls: type, fields: list[tuple[str, Plan]]) -> Plan: ...
+    def protocol(self, serializer: Serializer[Any], type_hint: TypeHint) -> Plan: ...
+
+
 class Serializer(Generic[T]):
     def serialize(self, encoder: Encoder, value: T, type_hint: TypeHint = None) -> None:
         raise NotImplementedError
@@ -40,13 +59,40 @@ class Serializer(Generic[T]):
     def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> T:
         raise NotImplementedError
 
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        """The plan of `type_hint` for the format of `compiler`; by default it goes through the Encoder/Decoder calls."""
+        return compiler.protocol(self, type_hint)
+
 
 class SerializersRegistry:
     def __init__(self):
         self._registry: dict[Any, Serializer[Any]] = {}
+        self._plans: dict[tuple[type, TypeHint], Plan] = {}
 
     def register(self, type_: Any, serializer: Serializer[Any]) -> None:
         self._registry[type_] = serializer
+        self._plans.clear()
+
+    def compile(self, type_hint: TypeHint, compiler: PlanCompiler) -> Plan:
+        """The plan of `type_hint`, compiled once per type and per format (the compiler class)."""
+        key = (type(compiler), type_hint)
+        plan = self._plans.get(key)
+        if plan is None:
+            # recursive types (a dataclass with a list of itself) meet their own plan while it is compiled:
+            # they get a forwarder to the plan being compiled
+            compiled = []
+            cached = set(self._plans)
+            self._plans[key] = Plan(lambda value: compiled[0].encode(value), lambda data: compiled[0].decode(data))
+            try:
+                plan = self.get(type_hint).compile(compiler, type_hint)
+            except BaseException:
+                # the plans compiled meanwhile may hold the forwarder, which will never be completed
+                for added in self._plans.keys() - cached:
+                    del self._plans[added]
+                raise
+            compiled.append(plan)
+            self._plans[key] = plan
+        return plan
 
     def get(self, type_hint: TypeHint) -> Serializer[Any]:
         if type_hint in self._registry:
@@ -58,6 +104,15 @@ class SerializersRegistry:
             serializer = ListSerializer(elem_type, self)
             self._registry[type_hint] = serializer
             return serializer
+        if (origin is Union or origin is types.UnionType) and len(args) == 2 and type(None) in args:
+            inner_type = args[0] if args[1] is type(None) else args[1]
+            serializer = OptionalSerializer(inner_type, self)
+            self._registry[type_hint] = serializer
+            return serializer
+        if isinstance(type_hint, type) and dataclasses.is_dataclass(type_hint):
+            serializer = DataclassSerializer(type_hint, self)
+            self._registry[type_hint] = serializer
+            return serializer
         raise TypeError(f"No serializer registered for type: {type_hint}")
 
 
@@ -81,19 +136,22 @@ class JsonEncoder:
     def encode_str(self, value: str) -> None:
         self._append(value)
 
+    # containers are added to their parent when they begin, while the key of the parent is still the current one
     def begin_list(self, size: int | None = None) -> None:
-        self._stack.append([])
+        lst = []
+        self._append(lst)
+        self._stack.append(lst)
 
     def end_list(self) -> None:
-        lst = self._stack.pop()
-        self._append(lst)
+        self._stack.pop()
 
     def begin_object(self) -> None:
-        self._stack.append({})
+        obj = {}
+        self._append(obj)
+        self._stack.append(obj)
 
     def end_object(self) -> None:
-        obj = self._stack.pop()
-        self._append(obj)
+        self._stack.pop()
 
     def encode_key(self, key: str) -> None:
         self._key = key
@@ -116,10 +174,19 @@ class JsonDecoder:
     def __init__(self, data: str):
         self._root = json.loads(data)
         self._stack = [self._root]
-        self._iterator = None
+        self._iterators = []
+
+    @classmethod
+    def of(cls, root: Any) -> JsonDecoder:
+        """A decoder of an already parsed JSON tree."""
+        decoder = cls.__new__(cls)
+        decoder._root = root
+        decoder._stack = [root]
+        decoder._iterators = []
+        return decoder
 
     def decode_none(self) -> None:
-        return None
+        return self._stack.pop()
 
     def decode_bool(self) -> bool:
         return self._stack.pop()
@@ -133,43 +200,103 @@ class JsonDecoder:
     def decode_str(self) -> str:
         return self._stack.pop()
 
+    def is_none(self) -> bool:
+        return self._stack[-1] is None
+
+    def skip_value(self) -> None:
+        self._stack.pop()
+
     def begin_list(self) -> int | None:
+        # the items are pushed in reverse, so the next decode_* pops the first one
         lst = self._stack.pop()
-        self._stack.append(lst)
-        self._iterator = iter(lst)
+        self._stack.extend(reversed(lst))
         return len(lst)
 
     def end_list(self) -> None:
-        self._stack.pop()
+        pass
 
-    def begin_object(self) -> None:
+    def begin_object(self) -> int | None:
         obj = self._stack.pop()
-        self._stack.append(obj)
-        self._iterator = iter(obj.items())
+        self._iterators.append(iter(obj.items()))
+        return len(obj)
 
     def end_object(self) -> None:
-        self._stack.pop()
+        self._iterators.pop()
 
     def decode_key(self) -> str:
-        key, value = next(self._iterator)
+        key, value = next(self._iterators[-1])
         self._stack.append(value)
         return key
 
 
+def _identity(value: Any) -> Any:
+    return value
+
+
+class JsonCompiler:
+    """Compiles type hints to conversions between values and the tree given to json.dumps/returned by json.loads."""
+
+    def scalar(self, type_: type) -> Plan:
+        return Plan(_identity, _identity)
+
+    def list(self, elem: Plan) -> Plan:
+        encode, decode = elem
+        if encode is _identity and decode is _identity:
+            # a list of JSON native values is its own tree: nothing to convert, at any nesting level
+            return Plan(_identity, _identity)
+        return Plan(lambda value: [encode(item) for item in value],
+                    lambda tree: [decode(item) for item in tree])
+
+    def optional(self, inner: Plan) -> Plan:
+        encode, decode = inner
+        if encode is _identity and decode is _identity:
+            return inner
+        return Plan(lambda value: None if value is None else encode(value),
+                    lambda tree: None if tree is None else decode(tree))
+
+    def object(self, cls: type, fields: list[tuple[str, Plan]]) -> Plan:
+        names = [name for name, _ in fields]
+        encoders = [plan.encode for _, plan in fields]
+        decoders = {name: plan.decode for name, plan in fields}
+
+        def encode(value: Any) -> Any:
+            return {name: encode_field(getattr(value, name)) for name, encode_field in zip(names, encoders)}
+
+        def decode(tree: Any) -> Any:
+            # the keys missing from the tree take the field defaults, the unknown ones are ignored
+            kwargs = {}
+            for name, item in tree.items():
+                decode_field = decoders.get(name)
+                if decode_field is not None:
+                    kwargs[name] = decode_field(item)
+            return cls(**kwargs)
+
+        return Plan(encode, decode)
+
+    def protocol(self, serializer: Serializer[Any], type_hint: TypeHint) -> Plan:
+        def encode(value: Any) -> Any:
+            encoder = JsonEncoder()
+            serializer.serialize(encoder, value, type_hint)
+            return encoder._current
+
+        def decode(tree: Any) -> Any:
+            return serializer.deserialize(JsonDecoder.of(tree), type_hint)
+
+        return Plan(encode, decode)
+
+
 class JsonFormat:
     def __init__(self, registry: SerializersRegistry):
         self.registry = registry
+        self._compiler = JsonCompiler()
 
     def dumps(self, value: Any, type_hint: TypeHint = None) -> str:
-        encoder = JsonEncoder()
-        serializer = self.registry.get(type_hint or type(value))
-        serializer.serialize(encoder, value, type_hint)
-        return encoder.finalize()
+        plan = self.registry.compile(type_hint or type(value), self._compiler)
+        return json.dumps(plan.encode(value))
 
     def loads(self, data: str, type_hint: TypeHint) -> Any:
-        decoder = JsonDecoder(data)
-        serializer = self.registry.get(type_hint)
-        return serializer.deserialize(decoder, type_hint)
+        plan = self.registry.compile(type_hint, self._compiler)
+        return plan.decode(json.loads(data))
 
 
 class IntSerializer(Serializer[int]):
@@ -179,6 +306,42 @@ class IntSerializer(Serializer[int]):
     def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> int:
         return decoder.decode_int()
 
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.scalar(int)
+
+
+class FloatSerializer(Serializer[float]):
+    def serialize(self, encoder: Encoder, value: float, type_hint: TypeHint = None) -> None:
+        encoder.encode_float(value)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> float:
+        return decoder.decode_float()
+
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.scalar(float)
+
+
+class StrSerializer(Serializer[str]):
+    def serialize(self, encoder: Encoder, value: str, type_hint: TypeHint = None) -> None:
+        encoder.encode_str(value)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> str:
+        return decoder.decode_str()
+
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.scalar(str)
+
+
+class BoolSerializer(Serializer[bool]):
+    def serialize(self, encoder: Encoder, value: bool, type_hint: TypeHint = None) -> None:
+        encoder.encode_bool(value)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> bool:
+        return decoder.decode_bool()
+
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.scalar(bool)
+
 
 class ListSerializer(Serializer[list[Any]]):
     def __init__(self, elem_type: TypeHint, registry: SerializersRegistry):
@@ -201,6 +364,72 @@ class ListSerializer(Serializer[list[Any]]):
         decoder.end_list()
         return result
 
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.list(self.registry.compile(self.elem_type, compiler))
+
+
+class OptionalSerializer(Serializer[Any]):
+    def __init__(self, inner_type: TypeHint, registry: SerializersRegistry):
+        self.inner_type = inner_type
+        self.registry = registry
+
+    def serialize(self, encoder: Encoder, value: Any, type_hint: TypeHint = None) -> None:
+        if value is None:
+            encoder.encode_none()
+        else:
+            self.registry.get(self.inner_type).serialize(encoder, value, self.inner_type)
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> Any:
+        if decoder.is_none():
+            return decoder.decode_none()
+        return self.registry.get(self.inner_type).deserialize(decoder, self.inner_type)
+
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.optional(self.registry.compile(self.inner_type, compiler))
+
+
+class FieldSchema(NamedTuple):
+    name: str
+    type_hint: TypeHint
+
+
+class DataclassSerializer(Serializer[Any]):
+    """
+    Serializes a dataclass as an object with one key per field. The fields are introspected once, when the
+    serializer is created; the serializers of their types are resolved on first use, so a dataclass can
+    refer to itself.
+    """
+
+    def __init__(self, cls: type, registry: SerializersRegistry):
+        self.cls = cls
+        self.registry = registry
+        hints = get_type_hints(cls)
+        self.schema = [FieldSchema(f.name, hints[f.name]) for f in dataclasses.fields(cls) if f.init]
+        self._by_name = {field.name: field for field in self.schema}
+
+    def serialize(self, encoder: Encoder, value: Any, type_hint: TypeHint = None) -> None:
+        encoder.begin_object()
+        for field in self.schema:
+            encoder.encode_key(field.name)
+            self.registry.get(field.type_hint).serialize(encoder, getattr(value, field.name), field.type_hint)
+        encoder.end_object()
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> Any:
+        # as the compiled plans: the keys missing from the object take the field defaults, the unknown ones are ignored
+        kwargs = {}
+        for _ in range(decoder.begin_object()):
+            field = self._by_name.get(decoder.decode_key())
+            if field is None:
+                decoder.skip_value()
+            else:
+                kwargs[field.name] = self.registry.get(field.type_hint).deserialize(decoder, field.type_hint)
+        decoder.end_object()
+        return self.cls(**kwargs)
+
+    def compile(self, compiler: PlanCompiler, type_hint: TypeHint) -> Plan:
+        return compiler.object(self.cls, [(field.name, self.registry.compile(field.type_hint, compiler))
+                                          for field in self.schema])
+
 
 class TestJsonFormat(unittest.TestCase):
     def test_int_serialization(self):
@@ -225,6 +454,158 @@ class TestJsonFormat(unittest.TestCase):
 
         self.assertEqual(original, restored)
 
+    def test_nested_lists(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        json_format = JsonFormat(registry)
+
+        original = [[1, 2], [], [3]]
+        json_str = json_format.dumps(original, list[list[int]])
+
+        self.assertEqual('[[1, 2], [], [3]]', json_str)
+        self.assertEqual(original, json_format.loads(json_str, list[list[int]]))
+
+    def test_plans_are_compiled_once(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        compiler = JsonCompiler()
+
+        plan = registry.compile(list[int], compiler)
+
+        self.assertIs(plan, registry.compile(list[int], compiler))
+        registry.register(int, IntSerializer())
+        self.assertIsNot(plan, registry.compile(list[int], compiler))
+
+    def test_list_of_protocol_serializers(self):
+        registry = SerializersRegistry()
+        registry.register(int, IntSerializer())
+        registry.register(complex, ComplexSerializer())
+        json_format = JsonFormat(registry)
+
+        original = [1 + 2j, 3j]
+        json_str = json_format.dumps(original, list[complex])
+
+        self.assertEqual('[{"re": 1.0, "im": 2.0}, {"re": 0.0, "im": 3.0}]', json_str)
+        self.assertEqual(original, json_format.loads(json_str, list[complex]))
+
+
+@dataclasses.dataclass
+class Point:
+    x: float
+    y: float
+
+
+@dataclasses.dataclass
+class Shape:
+    name: str
+    points: list[Point]
+    origin: Point | None = None
+    tags: list[str] = dataclasses.field(default_factory=list)
+    visible: bool = True
+
+
+@dataclasses.dataclass
+class TreeNode:
+    value: int
+    children: list[TreeNode] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class Broken:
+    children: list[Broken]
+    value: complex  # no serializer is registered for complex
+
+
+def _dataclass_registry() -> SerializersRegistry:
+    registry = SerializersRegistry()
+    registry.register(int, IntSerializer())
+    registry.register(float, FloatSerializer())
+    registry.register(str, StrSerializer())
+    registry.register(bool, BoolSerializer())
+    return registry
+
+
+class TestDataclassSerializer(unittest.TestCase):
+    def test_nested_dataclasses(self):
+        json_format = JsonFormat(_dataclass_registry())
+
+        original = Shape('triangle', [Point(0.0, 0.0), Point(1.0, 0.0), Point(0.0, 1.0)], Point(0.5, 0.5), ['a'])
+        json_str = json_format.dumps(original)
+
+        self.assertEqual(json.loads(json_str)['origin'], {'x': 0.5, 'y': 0.5})
+        self.assertEqual(original, json_format.loads(json_str, Shape))
+
+    def test_optional_and_defaults(self):
+        json_format = JsonFormat(_dataclass_registry())
+
+        self.assertEqual(Shape('empty', []), json_format.loads(json_format.dumps(Shape('empty', [])), Shape))
+        self.assertEqual(Shape('empty', []), json_format.loads('{"name": "empty", "points": [], "extra": 1}', Shape))
+
+    def test_recursive_dataclass(self):
+        json_format = JsonFormat(_dataclass_registry())
+
+        original = TreeNode(1, [TreeNode(2), TreeNode(3, [TreeNode(4)])])
+
+        self.assertEqual(original, json_format.loads(json_format.dumps(original), TreeNode))
+
+    def test_schema_is_introspected_once(self):
+        registry = _dataclass_registry()
+
+        serializer = registry.get(Shape)
+
+        self.assertIs(serializer, registry.get(Shape))
+        self.assertEqual(['name', 'points', 'origin', 'tags', 'visible'], [f.name for f in serializer.schema])
+
+    def test_protocol_path(self):
+        registry = _dataclass_registry()
+        serializer = registry.get(Shape)
+        original = Shape('line', [Point(0.0, 0.0), Point(2.0, 1.0)], None, ['x', 'y'], False)
+
+        encoder = JsonEncoder()
+        serializer.serialize(encoder, original)
+        restored = serializer.deserialize(JsonDecoder(encoder.finalize()), Shape)
+
+        self.assertEqual(original, restored)
+
+    def test_protocol_path_defaults_and_unknown_keys(self):
+        serializer = _dataclass_registry().get(Shape)
+
+        restored = serializer.deserialize(JsonDecoder('{"extra": [1], "points": [], "name": "empty"}'), Shape)
+
+        self.assertEqual(Shape('empty', []), restored)
+
+    def test_failed_compile_leaves_no_plan_behind(self):
+        registry = _dataclass_registry()
+        compiler = JsonCompiler()
+
+        with self.assertRaises(TypeError):
+            registry.compile(Broken, compiler)
+
+        # list[Broken] was compiled against the forwarder of the failed Broken plan: it must not be cached
+        with self.assertRaises(TypeError):
+            registry.compile(list[Broken], compiler)
+
+
+class ComplexSerializer(Serializer[complex]):
+    """A serializer without a compiled plan of its own, written against the Encoder/Decoder protocols."""
+
+    def serialize(self, encoder: Encoder, value: complex, type_hint: TypeHint = None) -> None:
+        encoder.begin_object()
+        encoder.encode_key('re')
+        encoder.encode_float(value.real)
+        encoder.encode_key('im')
+        encoder.encode_float(value.imag)
+        encoder.end_object()
+
+    def deserialize(self, decoder: Decoder, type_hint: TypeHint) -> complex:
+        decoder.begin_object()
+        values = {}
+        for _ in range(2):
+            key = decoder.decode_key()
+            values[key] = decoder.decode_float()
+        decoder.end_object()
+        return complex(values['re'], values['im'])
+
 
 if __name__ == '__main__':
     unittest.main()
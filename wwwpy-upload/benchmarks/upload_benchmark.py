@@ -0,0 +1,324 @@
+"""
+Upload throughput benchmark.
+
+Drives `upload_file` against the real `server/rpc.py` functions through `LocalRpc`, an in-process
+stand-in for the wwwpy stubs: every call is serialized like a wwwpy RPC request (JSON, `bytes` as
+base64), parsed back and dispatched to the server function, so the whole upload path runs without
+a browser or a web server. Files are synthetic and generated lazily, from 1 KB up to 2 GB.
+
+Every case runs in a fresh process, so peak RSS and the /proc/self/io counters belong to that case.
+For each case the report has:
+  - mb_per_second: file bytes uploaded per wall second (all the concurrent files together)
+  - cpu_user_seconds / cpu_system_seconds: CPU time of the whole process
+  - encode_seconds: CPU time serializing the requests on the client side
+  - transport_seconds: CPU time parsing the requests and round-tripping the responses
+  - write_seconds: wall time spent inside the server functions (decode, hash, disk write)
+  - peak_rss_bytes, read_syscalls, write_syscalls and their count per chunk
+
+Usage, from the project folder:
+    python -m benchmarks.upload_benchmark --sizes 1K 1M 64M --chunk-sizes 256K adaptive --output results.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import dataclasses
+import json
+import logging
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+from common.chunk_sizing import AdaptiveChunkSize
+from common.upload_client import UploadProgress, upload_file
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE = 0
+"""Chunk size of the cases using an AdaptiveChunkSize."""
+
+
+class SyntheticFile:
+    """A lazily generated common.upload_client.UploadSource.
+    The content repeats a 1 MiB pattern: random bytes, or CSV text for the compressible cases."""
+
+    def __init__(self, name: str, size: int, content: str = 'random'):
+        self.name = name
+        self.size = size
+        self.type = 'text/csv' if content == 'text' else 'application/octet-stream'
+        self.last_modified = 0
+        self._pattern = _pattern(content)
+
+    async def read(self, start: int, end: int) -> bytes:
+        start, end = max(0, start), min(end, self.size)
+        pattern = self._pattern
+        result = bytearray()
+        while start < end:
+            index = start % len(pattern)
+            piece = pattern[index:index + end - start]
+            result += piece
+            start += len(piece)
+        return bytes(result)
+
+
+_patterns: dict[str, bytes] = {}
+
+
+def _pattern(content: str) -> bytes:
+    if content not in _patterns:
+        rnd = random.Random(42)
+        # an odd length, so consecutive chunks do not repeat the same bytes
+        size = pow(2, 20) + 7
+        if content == 'text':
+            lines = [f'{i},{rnd.randint(0, 10 ** 6)},sensor-{rnd.randint(0, 99)},{rnd.random():.6f}\n'
+                     for i in range(size // 24)]
+            _patterns[content] = ''.join(lines).encode()[:size]
+        elif content == 'random':
+            _patterns[content] = rnd.randbytes(size)
+        else:
+            raise ValueError(f'Unknown content: {content}')
+    return _patterns[content]
+
+
+@dataclass
+class Timings:
+    encode_seconds: float = 0.0
+    transport_seconds: float = 0.0
+    write_seconds: float = 0.0
+    requests: int = 0
+
+
+class LocalRpc:
+    """In-process stand-in for the `server.rpc` stubs, with the same wire encoding as wwwpy."""
+
+    def __init__(self, module, timings: Timings):
+        self._module = module
+        self.timings = timings
+
+    def __getattr__(self, name: str):
+        func = getattr(self._module, name)
+        hints = typing.get_type_hints(func)
+        arg_types = [hints[p] for p in func.__code__.co_varnames[:func.__code__.co_argcount]]
+        timings = self.timings
+
+        async def call(*args):
+            started = time.thread_time()
+            request = '\n'.join(json.dumps(_to_json(a)) for a in [self._module.__name__, name, *args])
+            encoded = time.thread_time()
+            values = [json.loads(line) for line in request.split('\n')][2:]
+            values = [_from_json(t, v) for t, v in zip(arg_types, values)]
+            timings.transport_seconds += time.thread_time() - encoded
+            timings.encode_seconds += encoded - started
+
+            write_started = time.perf_counter()
+            result = await func(*values)
+            timings.write_seconds += time.perf_counter() - write_started
+
+            started = time.thread_time()
+            result = _from_json(hints.get('return'), json.loads(json.dumps(_to_json(result))))
+            timings.transport_seconds += time.thread_time() - started
+            timings.requests += 1
+            return result
+
+        return call
+
+
+def _to_json(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    if dataclasses.is_dataclass(value):
+        return asdict(value)
+    return value
+
+
+def _from_json(cls, value):
+    if cls is bytes:
+        return base64.b64decode(value)
+    if dataclasses.is_dataclass(cls):
+        return cls(**value)
+    return value
+
+
+@dataclass
+class BenchmarkCase:
+    size: int
+    chunk_size: int  # ADAPTIVE for an AdaptiveChunkSize
+    concurrency: int  # files uploaded at the same time
+    window: int = 4
+    content: str = 'random'
+    compress: bool = False
+
+
+@dataclass
+class BenchmarkResult:
+    case: BenchmarkCase
+    error: str | None = None
+    seconds: float = 0.0
+    mb_per_second: float = 0.0
+    cpu_user_seconds: float = 0.0
+    cpu_system_seconds: float = 0.0
+    encode_seconds: float = 0.0
+    transport_seconds: float = 0.0
+    write_seconds: float = 0.0
+    requests: int = 0
+    chunks: int = 0
+    bytes_sent: int = 0
+    peak_rss_bytes: int = 0
+    read_syscalls: int | None = None
+    write_syscalls: int | None = None
+    syscalls_per_chunk: float | None = None
+
+
+def run_case(case: BenchmarkCase, folder: Path | None = None) -> BenchmarkResult:
+    """Run one case in the current process; the uploads go to a temporary folder inside `folder`."""
+    from server import rpc
+    from server.upload_sessions import UploadSessions
+
+    result = BenchmarkResult(case)
+    saved = rpc._uploads_folder, rpc._store_folder, rpc._sessions
+    with tempfile.TemporaryDirectory(dir=folder, prefix='upload-benchmark-') as tmp:
+        tmp = Path(tmp)
+        rpc._uploads_folder = lambda: tmp / 'uploads'
+        rpc._store_folder = lambda: tmp / 'store'
+        rpc._sessions = UploadSessions()
+        timings = Timings()
+        local_rpc = LocalRpc(rpc, timings)
+        progresses: list[UploadProgress] = []
+
+        async def upload(index: int):
+            file = SyntheticFile(f'benchmark-{index}.bin', case.size, case.content)
+            chunk_size = AdaptiveChunkSize() if case.chunk_size == ADAPTIVE else case.chunk_size
+            last: list[UploadProgress] = []
+            await upload_file(file, local_rpc, last.append, chunk_size, case.window, compress=case.compress)
+            progresses.append(last[-1])
+
+        async def upload_all():
+            await asyncio.gather(*[upload(index) for index in range(case.concurrency)])
+
+        io_before = _proc_io()
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        try:
+            asyncio.run(upload_all())
+        finally:
+            rpc._uploads_folder, rpc._store_folder, rpc._sessions = saved
+        result.seconds = time.perf_counter() - started
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = _proc_io()
+
+    failures = [str(p.failure) for p in progresses if p.failure or not p.completed]
+    if failures:
+        result.error = failures[0]
+        return result
+    total = case.size * case.concurrency
+    result.mb_per_second = total / pow(2, 20) / result.seconds if result.seconds else 0.0
+    result.cpu_user_seconds = usage.ru_utime - usage_before.ru_utime
+    result.cpu_system_seconds = usage.ru_stime - usage_before.ru_stime
+    result.encode_seconds = timings.encode_seconds
+    result.transport_seconds = timings.transport_seconds
+    result.write_seconds = timings.write_seconds
+    result.requests = timings.requests
+    result.chunks = sum(len(p.chunk_sizes) for p in progresses)
+    result.bytes_sent = sum(p.bytes_sent for p in progresses)
+    result.peak_rss_bytes = usage.ru_maxrss * 1024  # KiB on Linux
+    if io_before and io:
+        result.read_syscalls = io['syscr'] - io_before['syscr']
+        result.write_syscalls = io['syscw'] - io_before['syscw']
+        if result.chunks:
+            result.syscalls_per_chunk = (result.read_syscalls + result.write_syscalls) / result.chunks
+    return result
+
+
+def _run_case_safely(case: BenchmarkCase, folder: Path | None) -> BenchmarkResult:
+    try:
+        return run_case(case, folder)
+    except Exception as e:
+        logger.exception(f'benchmark case failed: {case}')
+        return BenchmarkResult(case, error=f'{type(e).__name__}: {e}')
+
+
+def run_suite(cases: list[BenchmarkCase], folder: Path | None = None) -> list[BenchmarkResult]:
+    """Run every case in a fresh process, one at a time."""
+    results = []
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+            result = executor.submit(_run_case_safely, case, folder).result()
+        logger.info(f'{case} -> {result.error or f"{result.mb_per_second:.1f} MB/s"}')
+        results.append(result)
+    return results
+
+
+def report(results: list[BenchmarkResult]) -> dict:
+    return {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [asdict(r) for r in results],
+    }
+
+
+def _proc_io() -> dict[str, int] | None:
+    """Counters of /proc/self/io (Linux only): syscr/syscw are the read/write syscalls of the process."""
+    try:
+        text = Path('/proc/self/io').read_text()
+    except OSError:
+        return None
+    return {key: int(value) for key, value in (line.split(': ') for line in text.splitlines())}
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_size(text: str) -> int:
+    """'256K', '64M', '2G' or a plain number of bytes; 'adaptive' is ADAPTIVE."""
+    if text == 'adaptive':
+        return ADAPTIVE
+    units = {'K': 10, 'M': 20, 'G': 30}
+    unit = text[-1].upper()
+    if unit in units:
+        return int(float(text[:-1]) * pow(2, units[unit]))
+    return int(text)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Upload throughput benchmark.')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[parse_size(s) for s in ('1K', '1M', '64M', '2G')])
+    parser.add_argument('--chunk-sizes', nargs='+', type=parse_size,
+                        default=[parse_size(s) for s in ('64K', '256K', '1M', 'adaptive')])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--window', type=int, default=4)
+    parser.add_argument('--content', choices=['random', 'text'], default='random')
+    parser.add_argument('--compress', action='store_true')
+    parser.add_argument('--folder', type=Path, help='where the uploaded files are written (default: system temp)')
+    parser.add_argument('--output', type=Path, help='JSON report file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger('server').setLevel(logging.WARNING)
+    logging.getLogger('common').setLevel(logging.WARNING)
+
+    cases = [BenchmarkCase(size, chunk_size, concurrency, args.window, args.content, args.compress)
+             for size in args.sizes for chunk_size in args.chunk_sizes for concurrency in args.concurrency]
+    text = json.dumps(report(run_suite(cases, args.folder)), indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
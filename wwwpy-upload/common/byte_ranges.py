@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import heapq
+
+
+class ContiguousRanges:
+    """Collects byte ranges that complete in any order and tracks
+    the end of the contiguous prefix that starts at `start`."""
+
+    def __init__(self, start: int = 0):
+        self.end = start
+        self._pending: list[tuple[int, int]] = []
+
+    def add(self, start: int, end: int) -> int:
+        """Mark [start, end) as done and return the new contiguous end."""
+        heapq.heappush(self._pending, (start, end))
+        while self._pending and self._pending[0][0] <= self.end:
+            _, pending_end = heapq.heappop(self._pending)
+            self.end = max(self.end, pending_end)
+        return self.end
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+
+class AdaptiveChunkSize:
+    """Chooses the size of the next chunk from the measured throughput,
+    so that every request takes about `target_seconds`.
+
+    The size changes by at most a factor of two per measurement, is a multiple of `granularity`
+    and stays within [minimum, maximum].
+    """
+
+    def __init__(self, initial: int = pow(2, 18), minimum: int = pow(2, 16), maximum: int = pow(2, 23),
+                 target_seconds: float = 1.0, smoothing: float = 0.5, granularity: int = pow(2, 16)):
+        if not 0 < minimum <= maximum:
+            raise ValueError(f'Invalid bounds: minimum={minimum} maximum={maximum}')
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.granularity = granularity
+        self.bytes_per_second: float | None = None
+        self.size = self._clamp(initial)
+
+    @classmethod
+    def fixed(cls, size: int) -> AdaptiveChunkSize:
+        return cls(initial=size, minimum=size, maximum=size, granularity=1)
+
+    def record(self, nbytes: int, seconds: float) -> int:
+        """Account for a request that sent `nbytes` in `seconds` and return the next chunk size."""
+        if seconds <= 0 or nbytes <= 0:
+            return self.size
+        sample = nbytes / seconds
+        previous = self.bytes_per_second
+        self.bytes_per_second = sample if previous is None else \
+            self.smoothing * sample + (1 - self.smoothing) * previous
+
+        wanted = self.bytes_per_second * self.target_seconds
+        if seconds > self.target_seconds:
+            # the smoothed rate may still be high after a single slow request: never grow right after one
+            wanted = min(wanted, self.size)
+        wanted = min(max(wanted, self.size / 2), self.size * 2)
+        self.size = self._clamp(int(wanted))
+        return self.size
+
+    def _clamp(self, size: int) -> int:
+        size = max(self.granularity, size - size % self.granularity)
+        return min(max(size, self.minimum), self.maximum)
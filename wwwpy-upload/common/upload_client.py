@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Protocol
+
+from common.byte_ranges import ContiguousRanges
+from common.chunk_sizing import AdaptiveChunkSize
+from common.upload_protocol import DEFLATE, deflate, entropy, compressible_type
+
+logger = logging.getLogger(__name__)
+
+
+class UploadSource(Protocol):
+    """The file to upload: remote.blob_source.BlobSource in the browser, an in-memory stand-in elsewhere."""
+    name: str  # path on the server, relative to the uploads folder
+    size: int
+    type: str  # MIME type, '' when unknown
+    last_modified: float  # milliseconds since the epoch, as File.lastModified
+
+    async def read(self, start: int, end: int) -> bytes: ...
+
+
+class ChunkSender(Protocol):
+    """Reads, hashes and sends the chunks of an upload; RpcSender from this event loop,
+    remote.upload_worker.UploadWorker from a Web Worker."""
+
+    async def hash(self, size: int) -> str: ...
+
+    async def send(self, session_id: str, offset: int, sizing: AdaptiveChunkSize, window: int, hash_content: bool,
+                   progress: UploadProgress, progress_callback: Callable[[UploadProgress], None]) -> str | None: ...
+
+
+@dataclass
+class UploadProgress:
+    file: UploadSource
+    bytes_uploaded: int
+    total_bytes: int
+    abort: bool = False  # Flag that can be set to stop the upload
+    failure: Exception | None = None
+    resumed_from: int = 0  # Bytes already on the server when the upload started
+    chunk_sizes: list[int] = field(default_factory=list)  # Size of every chunk sent, in sending order
+    bytes_per_second: float | None = None  # Smoothed throughput measured per request
+    verified: bool = False  # Set when the server confirmed the content hash of the whole file
+    bytes_saved: int = 0  # Bytes not transferred because the server already held the content
+    compression: str = ''  # Compression negotiated with the server, '' for none
+    bytes_read: int = 0  # Bytes of file content sent in this upload, before compression
+    bytes_sent: int = 0  # Bytes actually put on the wire for them
+
+    @property
+    def compression_ratio(self) -> float:
+        """Content bytes per transferred byte; 1.0 when uncompressed or before the first chunk."""
+        return self.bytes_read / self.bytes_sent if self.bytes_sent else 1.0
+
+    @property
+    def percentage(self) -> float:
+        """Calculate the upload percentage."""
+        if self.total_bytes == 0:
+            return 0.0
+        if self.completed:
+            return 100.0
+        return round((self.bytes_uploaded / self.total_bytes) * 100, 2)
+
+    @property
+    def completed(self) -> bool:
+        """Check if the upload is complete and its content verified by the server."""
+        return self.verified and self.bytes_uploaded >= self.total_bytes
+
+    @property
+    def still_uploading(self) -> bool:
+        return not self.abort and not self.completed and self.failure is None
+
+
+async def upload_file(
+        file: UploadSource,
+        rpc,
+        progress_callback: Callable[[UploadProgress], None] = None,
+        chunk_size: int | AdaptiveChunkSize = pow(2, 18),
+        window: int = 4,
+        dedup: bool = False,
+        compress: bool = False,
+        sender: ChunkSender | None = None,
+) -> None:
+    """
+    Upload a file in chunks to the server.
+
+    If the server already holds part of the same file (same name, size and fingerprint),
+    e.g. after a reload or a dropped connection, the upload resumes from there.
+    The next chunk is read while up to `window` chunks are in flight; every chunk carries
+    its offset, so they can complete out of order. The progress reports the contiguous
+    bytes acknowledged by the server, which always increases monotonically.
+    The SHA-256 of the content is computed while reading and checked by the server at the end.
+
+    Args:
+        file: The file to upload; `file.name` is its path on the server, relative to the uploads folder
+        rpc: The server functions to call: the `server.rpc` stubs in the browser, an in-process
+             stand-in in the benchmarks and tests
+        progress_callback: Optional callback function that receives an UploadProgress object
+                          to report progress to the UI
+        chunk_size: Size of chunks to upload (default: 2^18 bytes), or an AdaptiveChunkSize
+                    that tunes the size from the throughput measured on each request
+        window: Maximum number of chunks in flight at the same time (default: 4)
+        dedup: Hash the whole file first and skip the transfer if the server already holds
+               the same content; the server then keeps this upload for later ones (default: False)
+        compress: Propose per-chunk deflate compression to the server when the file looks
+                  compressible; the accepted mode and the achieved ratio are reported in
+                  the progress (default: False)
+        sender: What reads, hashes and sends the chunks (default: an RpcSender on this event
+                loop); a remote.upload_worker.UploadWorker runs them in a Web Worker, so the main
+                thread only receives coalesced progress updates. The caller owns it.
+
+    Returns:
+        None
+    """
+    name = file.name
+    logger.info(f'upload file: {name} {file.size} {file.type}')
+    if not progress_callback:
+        progress_callback = lambda _: None
+
+    total_size = file.size
+    progress = UploadProgress(file=file, bytes_uploaded=0, total_bytes=total_size)
+    sender = sender or RpcSender(file, rpc)
+    try:
+        digest = None
+        if dedup:
+            digest = await sender.hash(total_size)
+            if await rpc.upload_dedup(name, total_size, digest):
+                logger.info(f'upload skipped, content already on the server: {name}')
+                progress.bytes_uploaded = progress.bytes_saved = total_size
+                progress.verified = True
+                progress_callback(progress)
+                return
+
+        fingerprint = _fingerprint(file)
+        offset = await rpc.upload_offset(name, total_size, fingerprint)
+        if offset:
+            logger.info(f'resuming upload of {name} at offset={offset}')
+        proposed = DEFLATE if compress and await _compressible(file) else ''
+        info = await rpc.upload_init(name, total_size, fingerprint, offset > 0, proposed, dedup)
+        session_id = info.session_id
+        progress.compression = info.compression
+        progress.bytes_uploaded = progress.resumed_from = offset
+
+        sizing = chunk_size if isinstance(chunk_size, AdaptiveChunkSize) else AdaptiveChunkSize.fixed(chunk_size)
+
+        progress_callback(progress)  # Initial progress report
+
+        sent_digest = await sender.send(session_id, offset, sizing, window, digest is None, progress, progress_callback)
+
+        if progress.abort:
+            await rpc.upload_abort(session_id)
+        else:
+            digest = digest or sent_digest
+            server_digest = await rpc.upload_complete(session_id, digest)
+            if server_digest != digest:
+                raise UploadIntegrityError(f'Content mismatch: sent sha256 {digest}, server has {server_digest}')
+            progress.verified = True
+        # Final progress report
+        progress_callback(progress)
+
+        logger.info(f'Upload completed: {name}')
+
+    except Exception as e:
+        logger.exception(e)
+        progress.failure = e
+        progress_callback(progress)
+
+
+class RpcSender:
+    """Reads, hashes and sends the chunks from the calling event loop."""
+
+    def __init__(self, file: UploadSource, rpc):
+        self.file = file
+        self.rpc = rpc
+
+    async def hash(self, size: int) -> str:
+        """SHA-256 of the first `size` bytes of the file."""
+        hasher = hashlib.sha256()
+        await _hash_prefix(self.file, size, hasher)
+        return hasher.hexdigest()
+
+    async def send(self, session_id: str, offset: int, sizing: AdaptiveChunkSize, window: int, hash_content: bool,
+                   progress: UploadProgress, progress_callback: Callable[[UploadProgress], None]) -> str | None:
+        """Send the file from `offset` to the end; returns its SHA-256 if `hash_content`."""
+        return await _send(self.rpc, self.file, session_id, offset, sizing, window, hash_content,
+                           progress, progress_callback)
+
+
+async def _send(rpc, file: UploadSource, session_id: str, offset: int, sizing: AdaptiveChunkSize,
+                window: int, hash_content: bool,
+                progress: UploadProgress, progress_callback: Callable[[UploadProgress], None]) -> str | None:
+    total_size = progress.total_bytes
+    acknowledged = ContiguousRanges(offset)
+    in_flight: set[asyncio.Task] = set()
+
+    hasher = None
+    if hash_content:
+        hasher = hashlib.sha256()
+        await _hash_prefix(file, offset, hasher)
+
+    async def send_chunk(start: int, data: bytes):
+        end = start + len(data)
+        started = time.perf_counter()
+        if progress.compression == DEFLATE:
+            data = deflate(data)
+        # the wwwpy RPC is JSON only: a raw binary body would need a route of our own, which it cannot register
+        b64str = base64.b64encode(data).decode()
+        await rpc.upload_write(session_id, start, b64str)
+        # the chunk size is tuned on content bytes: compression only makes them cheaper to send
+        sizing.record(end - start, time.perf_counter() - started)
+        progress.bytes_per_second = sizing.bytes_per_second
+        progress.bytes_read += end - start
+        progress.bytes_sent += len(data)
+        progress.bytes_uploaded = acknowledged.add(start, end)
+        progress_callback(progress)
+
+    try:
+        while offset < total_size:
+            if len(in_flight) >= window:
+                await _wait_first_completed(in_flight)
+            if progress.abort:  # possibly set by the progress reports of the chunks just acknowledged
+                break
+
+            data = await file.read(offset, offset + sizing.size)
+            # chunks are read in file order, so the digest is computed in the same pass
+            if hasher:
+                hasher.update(data)
+
+            logger.info(f'offset={offset} chunk_size={len(data)}')
+            progress.chunk_sizes.append(len(data))
+            in_flight.add(asyncio.create_task(send_chunk(offset, data)))
+            offset += len(data)
+
+        while in_flight:
+            await _wait_first_completed(in_flight)
+    except Exception:
+        for task in in_flight:
+            task.cancel()
+        raise
+
+    return hasher.hexdigest() if hasher else None
+
+
+class UploadIntegrityError(Exception):
+    pass
+
+
+async def _hash_prefix(file: UploadSource, size: int, hasher, block_size: int = pow(2, 20)):
+    """Hash the first `size` bytes: the whole file for dedup, or the part a resumed upload does not send."""
+    offset = 0
+    while offset < size:
+        data = await file.read(offset, min(offset + block_size, size))
+        hasher.update(data)
+        offset += len(data)
+
+
+async def _compressible(file: UploadSource, sample_size: int = pow(2, 16), max_entropy: float = 7.0) -> bool:
+    """Decided on the MIME type when it tells, otherwise on the entropy of a sample taken from the middle of the file."""
+    compressible = compressible_type(file.type)
+    if compressible is not None:
+        return compressible
+    start = max(0, (file.size - sample_size) // 2)
+    return entropy(await file.read(start, start + sample_size)) < max_entropy
+
+
+def _fingerprint(file: UploadSource) -> str:
+    """Cheap identity of the file content, used to decide whether a partial upload can be resumed."""
+    return f'{file.size}:{file.last_modified}'
+
+
+async def _wait_first_completed(tasks: set[asyncio.Task]) -> None:
+    """Wait until at least one task completes, remove the completed ones and re-raise their failures."""
+    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    tasks.difference_update(done)
+    for task in done:
+        task.result()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import math
+import re
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+
+DEFLATE = 'deflate'
+"""Every chunk is an independent raw deflate stream (no zlib header), as produced by CompressionStream('deflate-raw')."""
+
+SUPPORTED_COMPRESSIONS = (DEFLATE,)
+
+
+@dataclass
+class UploadSessionInfo:
+    session_id: str
+    compression: str
+    """The compression accepted by the server for this upload, '' for none."""
+
+
+def negotiate_compression(proposed: str) -> str:
+    return proposed if proposed in SUPPORTED_COMPRESSIONS else ''
+
+
+def deflate(data: bytes, level: int = 6) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def inflate(data: bytes, max_size: int, piece_size: int = pow(2, 20)) -> bytes:
+    """Decompress a chunk in bounded pieces; raises ValueError if it expands beyond `max_size`."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    result = bytearray()
+    while data:
+        result += decompressor.decompress(data, piece_size)
+        if len(result) > max_size:
+            raise ValueError(f'Compressed chunk expands beyond {max_size} bytes')
+        data = decompressor.unconsumed_tail
+    result += decompressor.flush()
+    if len(result) > max_size:
+        raise ValueError(f'Compressed chunk expands beyond {max_size} bytes')
+    return bytes(result)
+
+
+def entropy(data: bytes) -> float:
+    """Shannon entropy in bits per byte: close to 8 for compressed or encrypted data, much lower for text."""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+
+
+_TEXT_TOKENS = {'json', 'xml', 'javascript', 'css', 'html', 'csv', 'svg', 'sql', 'yaml'}
+_MEDIA_TYPES = {'image', 'video', 'audio'}
+_ARCHIVE_TOKENS = {'zip', 'gzip', 'rar', '7z', 'bzip2', 'xz', 'zstd', 'compressed'}
+
+
+def compressible_type(file_type: str) -> bool | None:
+    """Whether a MIME type tells the content is compressible: True for text-like types, False for media
+    and archives (already compressed), None when the type says nothing and the content has to decide."""
+    main_type, _, subtype = file_type.lower().partition('/')
+    tokens = set(re.split(r'[.+-]', subtype))  # 'svg+xml', 'x-yaml', 'vnd.openxmlformats-officedocument...'
+    if main_type == 'text' or tokens & _TEXT_TOKENS:
+        return True
+    if main_type in _MEDIA_TYPES or tokens & _ARCHIVE_TOKENS:
+        return False
+    return None
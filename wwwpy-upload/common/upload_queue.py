@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+Report = Callable[[int], None]
+"""Called by a job with the bytes it has transferred so far."""
+Job = Callable[[Report], Awaitable[bool]]
+"""Returns True if its bytes were uploaded, False if it was canceled or failed; raising counts as a failure."""
+
+
+class QueueOrder(str, Enum):
+    fifo = 'fifo'
+    smallest_first = 'smallest_first'
+
+
+@dataclass
+class QueueProgress:
+    files_total: int = 0
+    files_done: int = 0
+    bytes_total: int = 0
+    bytes_done: int = 0
+
+    @property
+    def files_waiting(self) -> int:
+        return self.files_total - self.files_done
+
+    @property
+    def idle(self) -> bool:
+        return self.files_done == self.files_total
+
+
+class UploadQueue:
+    """Runs the queued jobs with at most `concurrency` of them at the same time.
+
+    Only the running jobs hold their resources (readers, buffers); the waiting ones are just
+    an entry in the queue. The aggregate progress restarts when jobs are added to an idle queue.
+    """
+
+    def __init__(self, concurrency: int = 3, order: QueueOrder = QueueOrder.fifo,
+                 progress_callback: Callable[[QueueProgress], None] = None):
+        self.concurrency = concurrency
+        self.order = order
+        self.progress = QueueProgress()
+        self.progress_callback = progress_callback or (lambda _: None)
+        self._waiting: list[tuple[int, int, int, Job]] = []
+        self._sequence = itertools.count()
+        self._workers: set[asyncio.Task] = set()
+        self._done_bytes = 0  # bytes of the finished jobs
+        self._running: dict[int, int] = {}  # bytes reported by the running jobs
+        self._dequeued = asyncio.Event()
+
+    def add(self, size: int, job: Job) -> None:
+        if self.progress.idle:
+            self.progress = QueueProgress()
+            self._done_bytes = 0
+        seq = next(self._sequence)
+        key = size if self.order == QueueOrder.smallest_first else seq
+        heapq.heappush(self._waiting, (key, seq, size, job))
+        self.progress.files_total += 1
+        self.progress.bytes_total += size
+        self.progress_callback(self.progress)
+
+        while len(self._workers) < self.concurrency and len(self._workers) < len(self._waiting):
+            worker = asyncio.create_task(self._work())
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
+    async def put(self, size: int, job: Job, max_waiting: int = 100) -> None:
+        """Like `add`, but first wait until fewer than `max_waiting` jobs are waiting:
+        a producer that discovers files lazily stays just ahead of the uploads."""
+        while len(self._waiting) >= max_waiting:
+            self._dequeued.clear()
+            await self._dequeued.wait()
+        self.add(size, job)
+
+    async def join(self) -> None:
+        while self._workers:
+            await asyncio.wait(set(self._workers))
+
+    async def _work(self):
+        while self._waiting:
+            _, seq, size, job = heapq.heappop(self._waiting)
+            self._dequeued.set()
+
+            def report(bytes_done: int, seq=seq):
+                self._running[seq] = bytes_done
+                self._report_bytes()
+
+            self._running[seq] = 0
+            uploaded = False
+            try:
+                uploaded = await job(report)
+            except Exception:
+                logger.exception('upload job failed')
+            finally:
+                del self._running[seq]
+                # the bytes of a canceled or failed job were never uploaded: they leave the total instead
+                if uploaded:
+                    self._done_bytes += size
+                else:
+                    self.progress.bytes_total -= size
+                self.progress.files_done += 1
+                self._report_bytes()
+
+    def _report_bytes(self):
+        self.progress.bytes_done = self._done_bytes + sum(self._running.values())
+        self.progress_callback(self.progress)
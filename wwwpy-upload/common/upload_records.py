@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import heapq
+import time
+from array import array
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable
+
+
+class RecordState(IntEnum):
+    waiting = 0
+    uploading = 1
+    completed = 2
+    failed = 3
+    canceled = 4
+
+    @property
+    def finished(self) -> bool:
+        return self >= RecordState.completed
+
+
+@dataclass
+class RecordsSummary:
+    counts: dict[RecordState, int]
+    bytes_total: int
+    bytes_done: int
+
+    @property
+    def files_total(self) -> int:
+        return sum(self.counts.values())
+
+
+class UploadRecords:
+    """
+    Progress of every file of the upload list, kept in parallel arrays instead of one object
+    (or one DOM subtree) per file, so tens of thousands of files stay cheap.
+
+    Finished records can be dismissed after a delay: they leave `shown`, the rows displayed by the
+    list, but still count in the `summary`.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.names: list[str] = []
+        self.types: list[str] = []
+        self.sizes = array('q')
+        self.uploaded = array('q')
+        self.states = bytearray()
+        self.messages: dict[int, str] = {}  # only the records with a status text of their own
+        self._dismissed = bytearray()
+        self._expiring: list[tuple[float, int]] = []  # heap of (dismiss time, index)
+        self._shown: list[int] | None = []
+        self._counts = [0] * len(RecordState)
+        self._bytes_total = 0
+        self._bytes_done = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def add(self, name: str, size: int, file_type: str) -> int:
+        index = len(self.states)
+        self.names.append(name)
+        self.types.append(file_type)
+        self.sizes.append(size)
+        self.uploaded.append(0)
+        self.states.append(RecordState.waiting)
+        self._dismissed.append(0)
+        self._counts[RecordState.waiting] += 1
+        self._bytes_total += size
+        if self._shown is not None:
+            self._shown.append(index)
+        return index
+
+    def state(self, index: int) -> RecordState:
+        return RecordState(self.states[index])
+
+    def update(self, index: int, uploaded: int):
+        """Record the bytes uploaded so far; ignored once the record is finished."""
+        if self.state(index).finished:
+            return
+        self._set_state(index, RecordState.uploading)
+        self._set_uploaded(index, uploaded)
+
+    def finish(self, index: int, state: RecordState, message: str | None = None,
+               dismiss_after: float | None = None):
+        """Move the record to a final `state`; the first final state wins."""
+        if self.state(index).finished:
+            return
+        self._set_state(index, state)
+        if state == RecordState.completed:
+            self._set_uploaded(index, self.sizes[index])
+        if message:
+            self.messages[index] = message
+        if dismiss_after is not None:
+            heapq.heappush(self._expiring, (self._clock() + dismiss_after, index))
+
+    def dismiss_expired(self) -> bool:
+        """Dismiss the finished records whose delay elapsed; returns True if `shown` changed."""
+        now = self._clock()
+        changed = False
+        while self._expiring and self._expiring[0][0] <= now:
+            _, index = heapq.heappop(self._expiring)
+            self._dismissed[index] = 1
+            changed = True
+        if changed:
+            self._shown = None
+        return changed
+
+    @property
+    def dismissing(self) -> bool:
+        """True while some finished records are waiting for their dismissal."""
+        return bool(self._expiring)
+
+    @property
+    def shown(self) -> list[int]:
+        """Indexes of the records not dismissed, in the order they were added."""
+        if self._shown is None:
+            self._shown = [i for i, dismissed in enumerate(self._dismissed) if not dismissed]
+        return self._shown
+
+    def summary(self) -> RecordsSummary:
+        return RecordsSummary({state: self._counts[state] for state in RecordState},
+                              self._bytes_total, self._bytes_done)
+
+    def _set_state(self, index: int, state: RecordState):
+        self._counts[self.states[index]] -= 1
+        self._counts[state] += 1
+        self.states[index] = state
+
+    def _set_uploaded(self, index: int, uploaded: int):
+        self._bytes_done += uploaded - self.uploaded[index]
+        self.uploaded[index] = uploaded
+
+
+def visible_range(count: int, scroll_top: float, viewport_height: float, row_height: float,
+                  overscan: int = 4) -> range:
+    """Positions of the rows intersecting the viewport, plus `overscan` rows on both sides."""
+    if count == 0 or row_height <= 0:
+        return range(0)
+    first = min(count, max(0, int(scroll_top // row_height) - overscan))
+    last = min(count, int((scroll_top + viewport_height) // row_height) + 1 + overscan)
+    return range(first, max(first, last))
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import js
+
+
+class BlobSource:
+    """
+    The UploadSource of a JavaScript File: reads slices of it straight into Python bytes.
+
+    Blob.arrayBuffer() returns a promise that is awaited directly, so no FileReader and no
+    callback proxies are created per chunk, and to_bytes() copies the buffer once without an
+    intermediate Python list.
+    """
+
+    def __init__(self, file: js.File, name: str | None = None):
+        self.file = file
+        self.name = name or file.name
+        """Path on the server; folder uploads pass the path inside the dropped folder."""
+        self.size = file.size
+        self.type = file.type
+        self.last_modified = file.lastModified
+
+    async def read(self, start: int, end: int) -> bytes:
+        array_buffer: js.ArrayBuffer = await self.file.slice(start, end).arrayBuffer()
+        return array_buffer.to_bytes()
@@ -11,6 +11,8 @@ logger = logging.getLogger(__name__)
 class Component1(wpc.Component, tag_name='component-1'):
     multiple_checkbox: js.HTMLInputElement = wpc.element()
     show_gallery: js.HTMLInputElement = wpc.element()
+    worker_checkbox: js.HTMLInputElement = wpc.element()
+    summary_checkbox: js.HTMLInputElement = wpc.element()
     icon_gallery: js.HTMLElement = wpc.element()
     upload1: UploadComponent = wpc.element()
 
@@ -24,9 +26,15 @@ class Component1(wpc.Component, tag_name='component-1'):
     <label style="display: inline; margin-right: 2em">
         <input data-name="multiple_checkbox" type="checkbox"> Multiple files upload
     </label>
-    <label style="display: inline">
+    <label style="display: inline; margin-right: 2em">
         <input data-name="show_gallery" type="checkbox"> Show icon gallery
     </label>
+    <label style="display: inline; margin-right: 2em">
+        <input data-name="worker_checkbox" type="checkbox"> Upload in a Web Worker
+    </label>
+    <label style="display: inline">
+        <input data-name="summary_checkbox" type="checkbox"> Summary only
+    </label>
     <hr>
     <wwwpy-icon-gallery data-name="icon_gallery" style="display: none"></wwwpy-icon-gallery>
     <p>The component below the line is defined in upload_component.py</p>
@@ -39,6 +47,12 @@ class Component1(wpc.Component, tag_name='component-1'):
     async def multiple_checkbox__input(self, event):
         self.upload1.multiple = self.multiple_checkbox.checked
 
+    async def worker_checkbox__input(self, event):
+        self.upload1.use_worker = self.worker_checkbox.checked
+
+    async def summary_checkbox__input(self, event):
+        self.upload1.summary_mode = self.summary_checkbox.checked
+
     async def show_gallery__input(self, event):
         self.icon_gallery.element.style.display = 'block' if self.show_gallery.checked else 'none'
 
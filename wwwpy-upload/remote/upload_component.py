@@ -1,26 +1,45 @@
 from __future__ import annotations
 
 import asyncio
-import base64
+import functools
 import logging
-from dataclasses import dataclass
-from typing import Callable
+from typing import Callable, AsyncIterator
 
 import js
 import wwwpy.remote.component as wpc
-from pyodide.ffi import create_proxy, JsException
+from pyodide.ffi import create_proxy
 from wwwpy.remote import dict_to_js
 
+from common.chunk_sizing import AdaptiveChunkSize
+from common.upload_client import UploadProgress, upload_file
+from common.upload_queue import UploadQueue, QueueProgress
+from common.upload_records import UploadRecords, RecordState, visible_range
+from .blob_source import BlobSource
+from .upload_entries import dropped_entries, walk_entries
+from .upload_worker import UploadWorker
+
 logger = logging.getLogger(__name__)
 
 
 class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
     file_input: js.HTMLInputElement = wpc.element()
     uploads: js.HTMLElement = wpc.element()
+    uploads_sizer: js.HTMLElement = wpc.element()
+    summary: js.HTMLElement = wpc.element()
+    queue_status: js.HTMLElement = wpc.element()
     dropzone: js.HTMLElement = wpc.element()
     upload_icon: js.HTMLElement = wpc.element()
     button: js.HTMLElement = wpc.element()
 
+    dedup: bool = False
+    """Hash each file before sending it and skip the transfer if the server already holds the content."""
+    use_worker: bool = False
+    """Run the read/hash/send loop of the uploads in a Web Worker, keeping the main thread for the UI."""
+    compress: bool = False
+    """Opt-in: compress the chunks of files that look compressible (text-like MIME type or low entropy sample)."""
+    max_discovered_ahead: int = 100
+    """Files of a dropped folder queued ahead of the uploads; the enumeration pauses beyond that."""
+
     @property
     def multiple(self) -> bool:
         return self.file_input.hasAttribute('multiple')
@@ -30,6 +49,12 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
         self.file_input.toggleAttribute('multiple', value)
 
     def init_component(self):
+        # set queue.concurrency and queue.order to change how many files are uploaded at once and which first
+        self.queue = UploadQueue(concurrency=3, progress_callback=self._update_queue_status)
+        self.records = UploadRecords()
+        self._active: dict[int, UploadProgress] = {}  # progress of the uploads running, by record index
+        self._rows: list[_Row] = []
+        self._enumerations: set[asyncio.Task] = set()
         self.element.attachShadow(dict_to_js({'mode': 'open'}))
         # language=html
         self.element.shadowRoot.innerHTML = """
@@ -114,17 +139,82 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
         display: none;
     }
     
+    .upload-list {
+        position: relative;
+        max-height: 432px;
+        overflow-y: auto;
+    }
+    
+    .upload-list-sizer {
+        position: relative;
+    }
+    
     .upload-item {
-        margin: 10px 0;
-        padding: 12px;
+        position: absolute;
+        top: 0;
+        left: 0;
+        right: 0;
+        height: 64px;
+        box-sizing: border-box;
+        padding: 8px 12px;
         border-radius: 6px;
         background-color: #f9f9f9;
         box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);
-        transition: all 0.3s ease;
         display: flex;
         align-items: center;
     }
     
+    .file-name {
+        font-weight: 500;
+        font-size: 14px;
+        overflow: hidden;
+        text-overflow: ellipsis;
+        white-space: nowrap;
+    }
+    
+    .file-size, .status {
+        color: #666;
+        font-size: 12px;
+    }
+    
+    .status[data-state="completed"] {
+        color: #4CAF50;
+    }
+    
+    .status[data-state="failed"], .status[data-state="canceled"] {
+        color: #f44336;
+    }
+    
+    .cancel-button {
+        background-color: #f44336;
+        color: white;
+        border: none;
+        border-radius: 50%;
+        width: 24px;
+        height: 24px;
+        display: flex;
+        align-items: center;
+        justify-content: center;
+        cursor: pointer;
+        transition: background-color 0.2s ease;
+        margin-left: 10px;
+        box-shadow: 0 1px 3px rgba(0, 0, 0, 0.2);
+    }
+    
+    .cancel-button:hover {
+        background-color: #d32f2f;
+    }
+    
+    .cancel-button svg {
+        width: 16px;
+        height: 16px;
+        fill: white;
+    }
+    
+    .hidden {
+        display: none !important;
+    }
+    
     .file-icon {
         margin-right: 10px;
         width: 24px;
@@ -160,11 +250,6 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
         animation: none;
     }
     
-    .fade-out {
-        opacity: 0;
-        transform: translateY(-10px);
-    }
-    
     .upload-controls {
         display: flex;
         flex-direction: column;
@@ -177,6 +262,12 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
     .drag-label {
         font-size: 20px;
     }
+    
+    .queue-status {
+        font-size: 12px;
+        color: #666;
+        margin-bottom: 8px;
+    }
 </style>
 
 <div data-name="dropzone" class="dropzone">
@@ -187,11 +278,15 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
     </div>
     <div class="upload-controls">
         <button data-name="button" class="file-button">Browse</button>
-        <span class="drag-label">or drag files here</span>
+        <span class="drag-label">or drag files and folders here</span>
     </div>
     <input data-name="file_input" type="file" multiple class="hidden-input">
 </div>
-<div data-name="uploads"></div>
+<div data-name="queue_status" class="queue-status"></div>
+<div data-name="summary" class="queue-status hidden"></div>
+<div data-name="uploads" class="upload-list">
+    <div data-name="uploads_sizer" class="upload-list-sizer"></div>
+</div>
         """
 
     def button__click(self, event):
@@ -220,21 +315,163 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
         self.dropzone.classList.remove('dropzone-active')
         self.upload_icon.classList.remove('upload-icon-animation')
 
-        # Get files from the drop event
-        files = event.dataTransfer.files
-        self._process_files(files)
+        # Folders are walked lazily; the entries must be taken now, while the drop event is handled
+        entries = dropped_entries(event.dataTransfer)
+        if entries is None:
+            self._process_files(event.dataTransfer.files)
+        else:
+            task = asyncio.create_task(self._enqueue(walk_entries(entries)))
+            self._enumerations.add(task)
+            task.add_done_callback(self._enumerations.discard)
 
     def dropzone__click(self, event):
         # If they click the drop zone but not on the button or input, trigger the file input
         if event.target != self.file_input and event.target != self.button:
             self.file_input.click()
 
+    @property
+    def summary_mode(self) -> bool:
+        """Show only the aggregate counts and bytes instead of one row per file."""
+        return self.uploads.classList.contains('hidden')
+
+    @summary_mode.setter
+    def summary_mode(self, value: bool):
+        self.uploads.classList.toggle('hidden', value)
+        self.summary.classList.toggle('hidden', not value)
+        self._schedule_render()
+
     def _process_files(self, files):
         # Process the files just like in the change event
         for file in files:
-            progress = UploadProgressComponent()
-            self.uploads.appendChild(progress.element)
-            asyncio.create_task(upload_file(file, progress.update_progress))
+            name = getattr(file, 'webkitRelativePath', '') or file.name
+            index = self.records.add(name, file.size, file.type)
+            self.queue.add(file.size, self._upload_job(file, index))
+        self._schedule_render()
+
+    async def _enqueue(self, files: AsyncIterator[tuple[str, js.File]]):
+        """Queue the files as they are discovered, waiting whenever enough of them are already waiting."""
+        try:
+            async for name, file in files:
+                index = self.records.add(name, file.size, file.type)
+                self._schedule_render()
+                await self.queue.put(file.size, self._upload_job(file, index), self.max_discovered_ahead)
+        except Exception:
+            logger.exception('folder enumeration failed')
+
+    def _upload_job(self, file: js.File, index: int):
+        async def job(report) -> bool:
+            if self.records.state(index) == RecordState.canceled:
+                return False
+
+            def progress_callback(progress: UploadProgress):
+                self._active[index] = progress
+                self._update_record(index, progress)
+                report(progress.bytes_uploaded)
+
+            from server import rpc
+            worker = UploadWorker(file) if self.use_worker else None
+            try:
+                await upload_file(BlobSource(file, self.records.names[index]), rpc, progress_callback,
+                                  AdaptiveChunkSize(), dedup=self.dedup, compress=self.compress, sender=worker)
+            finally:
+                if worker:
+                    worker.terminate()
+                self._active.pop(index, None)
+            return self.records.state(index) == RecordState.completed
+
+        return job
+
+    def _update_record(self, index: int, progress: UploadProgress):
+        if progress.failure:
+            self.records.finish(index, RecordState.failed, f"Error: {progress.failure}")
+        elif progress.completed:
+            message = "Already on the server" if progress.bytes_saved else None
+            self.records.finish(index, RecordState.completed, message, dismiss_after=4)
+        elif progress.abort:
+            self.records.finish(index, RecordState.canceled, dismiss_after=3)
+        else:
+            self.records.update(index, progress.bytes_uploaded)
+        self._schedule_render()
+
+    def _cancel(self, index: int):
+        state = self.records.state(index)
+        if state == RecordState.waiting:
+            self.records.finish(index, RecordState.canceled, dismiss_after=3)
+        elif state == RecordState.uploading:
+            progress = self._active.get(index)
+            if progress and progress.still_uploading:
+                progress.abort = True
+                self.records.finish(index, RecordState.canceled, dismiss_after=3)
+        self._schedule_render()
+
+    def uploads__click(self, event):
+        # one listener for the cancel buttons of every row
+        button = event.target.closest('.cancel-button')
+        if button:
+            self._cancel(int(button.closest('.upload-item').dataset.index))
+
+    def uploads__scroll(self, event):
+        self._schedule_render()
+
+    def _update_queue_status(self, progress: QueueProgress):
+        progress_renderer.schedule(self.queue, lambda: self._render_queue_status(progress))
+
+    def _render_queue_status(self, progress: QueueProgress):
+        if progress.idle:
+            self.queue_status.textContent = ''
+            return
+        self.queue_status.textContent = (
+            f'{progress.files_done} of {progress.files_total} files, '
+            f'{_format_size(progress.bytes_done)} of {_format_size(progress.bytes_total)}'
+        )
+
+    def _schedule_render(self):
+        progress_renderer.schedule(self.records, self._render)
+
+    def _render(self):
+        self.records.dismiss_expired()
+        if self.records.dismissing:
+            self._schedule_render()  # keep rendering until the finished rows are dismissed
+        if self.summary_mode:
+            self._render_summary()
+        else:
+            self._render_rows()
+
+    def _render_summary(self):
+        summary = self.records.summary()
+        counts = ', '.join(f'{count} {state.name}' for state, count in summary.counts.items() if count)
+        self.summary.textContent = (
+            f'{summary.files_total} files: {counts or "none"}; '
+            f'{_format_size(summary.bytes_done)} of {_format_size(summary.bytes_total)}'
+        )
+
+    def _render_rows(self):
+        """Materialize only the rows in the viewport: a pool of row elements is reused while scrolling."""
+        shown = self.records.shown
+        self.uploads_sizer.style.height = f'{len(shown) * ROW_HEIGHT}px'
+        positions = visible_range(len(shown), self.uploads.scrollTop, self.uploads.clientHeight, ROW_HEIGHT)
+        while len(self._rows) < len(positions):
+            row = _Row()
+            self._rows.append(row)
+            self.uploads_sizer.appendChild(row.element)
+        for row, position in zip(self._rows, positions):
+            index = shown[position]
+            row.render(self.records, index, position, self._status_text(index))
+        for row in self._rows[len(positions):]:
+            row.hide()
+
+    def _status_text(self, index: int) -> str:
+        records = self.records
+        state = records.state(index)
+        if index in records.messages:
+            return records.messages[index]
+        if state == RecordState.uploading:
+            size = records.sizes[index]
+            percentage = round(records.uploaded[index] / size * 100, 2) if size else 0.0
+            progress = self._active.get(index)
+            ratio = f" (compressed {progress.compression_ratio:.1f}x)" if progress and progress.compression else ""
+            return f"Uploading: {percentage}%{ratio}"
+        return _status_texts[state]
 
     async def file_input__change(self, event):
         files = self.file_input.files
@@ -242,263 +479,142 @@ class UploadComponent(wpc.Component, tag_name='wwwpy-quickstart-upload'):
         self.file_input.value = ''
 
 
-class UploadProgressComponent(wpc.Component):
-    progress_container: js.HTMLElement = wpc.element()
-    progress_bar: js.HTMLElement = wpc.element()
-    file_name: js.HTMLElement = wpc.element()
-    file_size: js.HTMLElement = wpc.element()
-    file_icon: js.HTMLElement = wpc.element()
-    status: js.HTMLElement = wpc.element()
-    cancel_button: js.HTMLElement = wpc.element()
-
-    # Reference to the progress object to allow cancellation
-    _progress: UploadProgress = None
-
-    def init_component(self):
-        # language=html
-        self.element.innerHTML = """
-<style>
-    .cancel-button {
-        background-color: #f44336;
-        color: white;
-        border: none;
-        border-radius: 50%;
-        width: 24px;
-        height: 24px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        cursor: pointer;
-        transition: background-color 0.2s ease;
-        margin-left: 10px;
-        box-shadow: 0 1px 3px rgba(0, 0, 0, 0.2);
-    }
-    
-    .cancel-button:hover {
-        background-color: #d32f2f;
-    }
-    
-    .cancel-button svg {
-        width: 16px;
-        height: 16px;
-        fill: white;
-    }
-    
-    .cancel-button.hidden {
-        display: none;
-    }
-</style>
-
+ROW_HEIGHT = 72
+"""Height in pixels of every row of the upload list; rows are positioned at `position * ROW_HEIGHT`."""
+
+_status_texts = {
+    RecordState.waiting: "Waiting",
+    RecordState.completed: "Upload completed",
+    RecordState.canceled: "Upload canceled",
+}
+
+
+class _Row:
+    """A pooled row of the upload list, showing whichever record scrolls into its position."""
+
+    def __init__(self):
+        self.element: js.HTMLElement = _row_template().content.firstElementChild.cloneNode(True)
+        self.file_icon = self.element.querySelector('.file-icon')
+        self.file_name = self.element.querySelector('.file-name')
+        self.file_size = self.element.querySelector('.file-size')
+        self.cancel_button = self.element.querySelector('.cancel-button')
+        self.progress_bar = self.element.querySelector('.progress-bar')
+        self.status = self.element.querySelector('.status')
+        self._index: int | None = None
+        self._position: int | None = None
+        self._rendered: tuple | None = None
+
+    def render(self, records: UploadRecords, index: int, position: int, status: str):
+        if position != self._position:
+            self._position = position
+            self.element.style.transform = f'translateY({position * ROW_HEIGHT}px)'
+            self.element.classList.remove('hidden')
+        if index != self._index:
+            self._index = index
+            self.element.dataset.index = str(index)
+            self.file_name.textContent = records.names[index]
+            self.file_size.textContent = _format_size(records.sizes[index])
+            self.file_icon.replaceChildren(_icon_for(records.types[index]))
+        state = records.state(index)
+        size = records.sizes[index]
+        percentage = 100.0 if state == RecordState.completed else (
+            round(records.uploaded[index] / size * 100, 2) if size else 0.0)
+        rendered = (index, state, percentage, status)
+        if rendered == self._rendered:
+            return
+        self._rendered = rendered
+        self.progress_bar.style.width = f"{percentage}%"
+        self.progress_bar.classList.toggle("completed", state == RecordState.completed)
+        self.progress_bar.classList.toggle("error", state in (RecordState.failed, RecordState.canceled))
+        self.cancel_button.classList.toggle("hidden", state.finished)
+        self.status.textContent = status
+        self.status.dataset.state = state.name
+
+    def hide(self):
+        if self._position is not None:
+            self._position = None
+            self.element.classList.add('hidden')
+
+
+@functools.cache
+def _row_template() -> js.HTMLTemplateElement:
+    template = js.document.createElement('template')
+    # language=html
+    template.innerHTML = """
 <div class="upload-item">
-    <div data-name="file_icon" class="file-icon">
-        <!-- Default icon, will be replaced -->
-        <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">
-            <path d="M14 2H6c-1.1 0-2 .9-2 2v16c0 1.1.9 2 2 2h12c1.1 0 2-.9 2-2V8l-6-6zm2 16H8v-2h8v2zm0-4H8v-2h8v2zm-3-5V3.5L18.5 9H13z"/>
-        </svg>
-    </div>
-    <div style="flex-grow: 1;">
+    <div class="file-icon"></div>
+    <div style="flex-grow: 1; min-width: 0;">
         <div style="display: flex; justify-content: space-between; align-items: center;">
-            <div data-name="file_name" style="font-weight: 500; font-size: 14px;"></div>
+            <div class="file-name"></div>
             <div style="display: flex; align-items: center;">
-                <div data-name="file_size" style="color: #666; font-size: 12px;"></div>
-                <button data-name="cancel_button" class="cancel-button" title="Cancel upload">
+                <div class="file-size"></div>
+                <button class="cancel-button" title="Cancel upload">
                     <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">
                         <path d="M19 6.41L17.59 5 12 10.59 6.41 5 5 6.41 10.59 12 5 17.59 6.41 19 12 13.41 17.59 19 19 17.59 13.41 12z"/>
                     </svg>
                 </button>
             </div>
         </div>
-        <div data-name="progress_container" class="modern-progress">
-            <div data-name="progress_bar" class="progress-bar" style="width: 0%;"></div>
+        <div class="modern-progress">
+            <div class="progress-bar" style="width: 0%;"></div>
         </div>
-        <div data-name="status" style="font-size: 12px; color: #666;"></div>
+        <div class="status"></div>
     </div>
 </div>"""
+    return template
 
-    def _set_file_info(self, file: js.File):
-        """Set the initial file information in the UI."""
-        self.file_name.textContent = file.name
-
-        # Format file size
-        size_kb = file.size / 1024
-        size_display = f"{size_kb:.1f} KB" if size_kb < 1024 else f"{size_kb / 1024:.1f} MB"
-        self.file_size.textContent = size_display
-
-        # Set file icon based on file type using the refactored function
-        self.file_icon.innerHTML = _get_icon_html_for(file.type)
-
-    def cancel_button__click(self, event):
-        """Handle cancel button click event."""
-        if self._progress and self._progress.still_uploading:
-            self._progress.abort = True
-            # Hide cancel button when aborted
-            self.cancel_button.classList.add("hidden")
-
-    def update_progress(self, progress: UploadProgress):
-        """Callback function to update the UI with upload progress."""
-        # Store reference to the progress object to enable cancellation
-        self._progress = progress
-
-        percentage = progress.percentage
-        self.progress_bar.style.width = f"{percentage}%"
-
-        if progress.starting:
-            self._set_file_info(progress.file)
-
-        if progress.completed:
-            self.progress_bar.classList.add("completed")
-            self.status.textContent = "Upload completed"
-            self.status.style.color = "#4CAF50"
-            # Hide cancel button when complete
-            self.cancel_button.classList.add("hidden")
-            self._fade_out()
-        elif progress.failure:
-            self.progress_bar.classList.add("error")
-            self.status.textContent = f"Error: {progress.failure}"
-            self.status.style.color = "#f44336"
-            # Hide cancel button on failure
-            self.cancel_button.classList.add("hidden")
-        elif progress.abort:
-            self.progress_bar.classList.add("error")
-            self.status.textContent = "Upload canceled"
-            self.status.style.color = "#f44336"
-            self._fade_out(2)
-        else:
-            self.status.textContent = f"Uploading: {percentage}%"
-            # Ensure cancel button is visible during upload
-            self.cancel_button.classList.remove("hidden")
-
-    def _fade_out(self, fade_delay_secs=3):
-        """Fade out and remove the progress element after completion."""
-
-        async def _remove():
-            await asyncio.sleep(1)  # Short delay before starting fade
-            self.element.classList.add("fade-out")
-            self.element.style.transition = f"all {fade_delay_secs}s ease"
-
-            await asyncio.sleep(fade_delay_secs)
-            self.element.remove()
-
-        asyncio.create_task(_remove())
-
-
-@dataclass
-class UploadProgress:
-    file: js.File
-    bytes_uploaded: int
-    total_bytes: int
-    abort: bool = False  # Flag that can be set to stop the upload
-    failure: Exception | None = None
-
-    @property
-    def starting(self) -> bool:
-        return self.bytes_uploaded == 0
 
-    @property
-    def percentage(self) -> float:
-        """Calculate the upload percentage."""
-        if self.total_bytes == 0:
-            return 0.0
-        if self.completed:
-            return 100.0
-        return round((self.bytes_uploaded / self.total_bytes) * 100, 2)
-
-    @property
-    def completed(self) -> bool:
-        """Check if the upload is complete."""
-        return self.bytes_uploaded >= self.total_bytes
-
-    @property
-    def still_uploading(self) -> bool:
-        return not self.abort and not self.completed and self.failure is None
-
-
-async def _read_chunk(blob: js.Blob) -> js.ArrayBuffer:
+class ProgressRenderer:
     """
-    Read a chunk of a file as an ArrayBuffer.
+    Coalesces progress updates into batched DOM writes.
 
-    Args:
-        blob: JavaScript Blob object to read
-
-    Returns:
-        ArrayBuffer containing the blob data
+    Every scheduled target keeps only its latest render function; all of them run in a single pass
+    on an animation frame, at most `max_fps` times per second. With many parallel uploads this
+    replaces one burst of layout-invalidating writes per chunk with one pass per frame.
     """
-    future: asyncio.Future = asyncio.Future()
 
-    def onload(event):
-        future.set_result(reader.result)
+    def __init__(self, max_fps: float = 10):
+        self.max_fps = max_fps
+        self._pending: dict[int, Callable[[], None]] = {}
+        self._frame_requested = False
+        self._last_render = 0.0
+        self._on_frame_proxy = None  # a single proxy, reused for every frame
 
-    def onerror(event):
-        future.set_exception(Exception(f"Error reading file: {reader.error}"))
+    def schedule(self, target: object, render: Callable[[], None]):
+        self._pending[id(target)] = render
+        if not self._frame_requested:
+            self._frame_requested = True
+            self._request_frame()
 
-    reader: js.FileReader = js.FileReader.new()
-    reader.onload = create_proxy(onload)
-    reader.onerror = create_proxy(onerror)
-    reader.readAsArrayBuffer(blob)
+    def _request_frame(self):
+        if self._on_frame_proxy is None:
+            self._on_frame_proxy = create_proxy(self._on_frame)
+        js.requestAnimationFrame(self._on_frame_proxy)
 
-    return await future
+    def _on_frame(self, timestamp: float):
+        if timestamp - self._last_render < 1000 / self.max_fps:
+            self._request_frame()
+            return
+        self._frame_requested = False
+        self._last_render = timestamp
+        pending, self._pending = self._pending, {}
+        for render in pending.values():
+            try:
+                render()
+            except Exception:
+                logger.exception('progress render failed')
 
 
-async def upload_file(
-        file: js.File,
-        progress_callback: Callable[[UploadProgress], None] = None,
-        chunk_size: int = pow(2, 18)
-) -> None:
-    """
-    Upload a file in chunks to the server.
+progress_renderer = ProgressRenderer()
+"""Shared by all the upload components; set `progress_renderer.max_fps` to change the update rate."""
 
-    Args:
-        file: JavaScript File object to upload
-        progress_callback: Optional callback function that receives an UploadProgress object
-                          to report progress to the UI
-        chunk_size: Size of chunks to upload (default: 2^18 bytes)
 
-    Returns:
-        None
-    """
-    logger.info(f'upload file: {file.name} {file.size} {file.type}')
-    if not progress_callback:
-        progress_callback = lambda _: None
-
-    total_size = file.size
-    progress = UploadProgress(file=file, bytes_uploaded=0, total_bytes=total_size)
-    try:
-        from server import rpc
-        await rpc.upload_init(file.name, file.size)
-
-        offset = 0
-
-        progress_callback(progress)  # Initial progress report
-
-        while offset < total_size and not progress.abort:
-            chunk: js.Blob = file.slice(offset, offset + chunk_size)
-            array_buffer = await _read_chunk(chunk)
-
-            logger.info(f'offset={offset}')
-            b64str = base64.b64encode(array_buffer.to_py()).decode()
-            await rpc.upload_append(file.name, b64str)
-
-            # Update progress
-            chunk_size_actual = min(chunk_size, total_size - offset)
-            offset += chunk_size_actual
-            progress.bytes_uploaded = offset
-
-            # Report progress
-            progress_callback(progress)
-
-        if progress.abort:
-            await rpc.upload_abort(file.name)
-        # Final progress report
-        progress_callback(progress)
-
-        logger.info(f'Upload completed: {file.name}')
-
-    except Exception as e:
-        logger.exception(e)
-        progress.failure = e
-        progress_callback(progress)
+def _format_size(size: int) -> str:
+    size_kb = size / 1024
+    return f"{size_kb:.1f} KB" if size_kb < 1024 else f"{size_kb / 1024:.1f} MB"
 
 
+@functools.cache
 def _get_icon_html_dict() -> dict[str, str]:
     icon_paths = {
         'image': 'M21 19V5c0-1.1-.9-2-2-2H5c-1.1 0-2 .9-2 2v14c0 1.1.9 2 2 2h14c1.1 0 2-.9 2-2zM8.5 13.5l2.5 3.01L14.5 12l4.5 6H5l3.5-4.5z',
@@ -527,17 +643,22 @@ def _get_icon_html_dict() -> dict[str, str]:
     }
 
 
-def _get_icon_html_for(file_type):
-    """
-    Returns SVG HTML markup for a given file type.
+@functools.cache
+def _icon_template(kind: str) -> js.HTMLTemplateElement:
+    """The icon of `kind` parsed once into a <template>, shared by every row that shows it."""
+    template = js.document.createElement('template')
+    template.innerHTML = _get_icon_html_dict()[kind]
+    return template
 
-    Args:
-        file_type: String representing the MIME type of the file
 
-    Returns:
-        String containing SVG HTML markup
-    """
-    type_identifiers = {
+def _icon_for(file_type: str) -> js.DocumentFragment:
+    """A fresh copy of the icon for a MIME type, cloned instead of re-parsed from HTML."""
+    return _icon_template(_file_kind(file_type)).content.cloneNode(True)
+
+
+_KIND_IDENTIFIERS: tuple[tuple[str, str], ...] = tuple(
+    (identifier, kind)
+    for kind, identifiers in {
         'image': ['image/'],
         'video': ['video/'],
         'pdf': ['pdf'],
@@ -552,25 +673,25 @@ def _get_icon_html_for(file_type):
         'cad': ['cad', 'dwg', 'dxf'],
         'vector': ['svg', 'vector', 'ai', 'eps'],
         'database': ['database', 'db', 'sqlite', 'sql']
-    }
-    icon_key = 'default'
+    }.items()
+    for identifier in identifiers
+)
+"""(substring, kind) pairs in priority order: the first substring found in the MIME type decides its kind."""
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_kind(file_type: str) -> str:
+    """Classify a MIME type into one of the icon keys of the upload UI, 'default' when unknown.
+    Memoized: a list of thousands of files usually has only a handful of distinct types."""
     if file_type.startswith('image/'):
-        icon_key = 'image'
-    elif file_type.startswith('video/'):
-        icon_key = 'video'
-    elif 'pdf' in file_type:
-        icon_key = 'pdf'
-    elif file_type.startswith('audio/'):
-        icon_key = 'audio'
-    else:
-        for key, identifiers in type_identifiers.items():
-            if any(identifier in file_type for identifier in identifiers):
-                icon_key = key
-                break
-
-    icon_dict = _get_icon_html_dict()
-    svg = icon_dict[icon_key]
-    return svg
+        return 'image'
+    if file_type.startswith('video/'):
+        return 'video'
+    if 'pdf' in file_type:
+        return 'pdf'
+    if file_type.startswith('audio/'):
+        return 'audio'
+    return next((kind for identifier, kind in _KIND_IDENTIFIERS if identifier in file_type), 'default')
 
 
 class IconGalleryComponent(wpc.Component, tag_name='wwwpy-icon-gallery'):
@@ -638,7 +759,7 @@ class IconGalleryComponent(wpc.Component, tag_name='wwwpy-icon-gallery'):
         fragment = js.document.createDocumentFragment()
 
         # Create an item for each icon
-        for icon_name, icon_svg in icon_dict.items():
+        for icon_name in icon_dict:
             # Create the icon item container
             icon_item = js.document.createElement('div')
             icon_item.className = 'icon-item'
@@ -646,7 +767,7 @@ class IconGalleryComponent(wpc.Component, tag_name='wwwpy-icon-gallery'):
             # Create the icon container
             icon_container = js.document.createElement('div')
             icon_container.className = 'icon-container'
-            icon_container.innerHTML = icon_svg
+            icon_container.appendChild(_icon_template(icon_name).content.cloneNode(True))
 
             # Create the icon label
             icon_label = js.document.createElement('div')
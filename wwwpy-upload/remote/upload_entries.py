@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from typing import AsyncIterator
+
+import js
+from pyodide.ffi import create_once_callable
+
+
+def dropped_entries(data_transfer: js.DataTransfer) -> list | None:
+    """The FileSystemEntry of every item dropped, folders included; None if the browser has no
+    webkitGetAsEntry. Must be called while handling the drop event: the items are cleared afterwards."""
+    items = js.Array.from_(data_transfer.items or [])
+    if not items.length or not hasattr(items[0], 'webkitGetAsEntry'):
+        return None
+    entries = [item.webkitGetAsEntry() for item in items if item.kind == 'file']
+    return [entry for entry in entries if entry]
+
+
+async def walk_entries(entries: list) -> AsyncIterator[tuple[str, js.File]]:
+    """
+    Yield (relative path, File) for every file below `entries`, depth first, as they are discovered.
+
+    Directories are read one readEntries() batch at a time, so memory holds at most one batch
+    per directory level, not the whole tree: the first file can be uploaded while the rest of a
+    large tree is still unexplored. The path is the entry fullPath without the leading '/',
+    e.g. 'photos/2024/a.jpg'.
+    """
+    batches = [iter(entries)]  # stack: the batch being walked at each directory level
+    readers = [None]  # the reader that refills the batch at the same level; None for the dropped entries
+    while batches:
+        entry = next(batches[-1], None)
+        if entry is None:
+            reader = readers[-1]
+            batch = await _read_entries(reader) if reader else None
+            if batch:
+                batches[-1] = iter(batch)
+            else:
+                batches.pop()
+                readers.pop()
+        elif entry.isFile:
+            yield entry.fullPath.lstrip('/'), await _file(entry)
+        elif entry.isDirectory:
+            batches.append(iter(()))
+            readers.append(entry.createReader())
+
+
+async def _read_entries(reader) -> list:
+    """The next batch of a directory; empty once the directory is exhausted."""
+    return await _promise(lambda resolve, reject: reader.readEntries(resolve, reject))
+
+
+async def _file(entry) -> js.File:
+    return await _promise(lambda resolve, reject: entry.file(resolve, reject))
+
+
+def _promise(executor) -> js.Promise:
+    # the executor runs synchronously, once: resolve/reject are JavaScript functions passed straight
+    # to the callback API, so no Python proxy outlives the call
+    return js.Promise.new(create_once_callable(executor))
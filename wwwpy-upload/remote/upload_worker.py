@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Callable
+
+import js
+from pyodide.ffi import create_proxy
+from wwwpy.remote import dict_to_js
+
+from common.chunk_sizing import AdaptiveChunkSize
+from common.upload_client import UploadProgress
+
+logger = logging.getLogger(__name__)
+
+
+class UploadWorkerError(Exception):
+    pass
+
+
+class UploadWorker:
+    """
+    Runs the read/hash/send loop of one upload in a Web Worker, so the Pyodide main thread
+    only has to render the progress.
+
+    The worker is plain JavaScript: it reads the File with Blob.arrayBuffer(), hashes it with an
+    incremental SHA-256, and calls the server RPC functions itself with the same wire format as the
+    wwwpy stubs. Progress messages are coalesced to one every `progress_interval_ms`.
+    It is a common.upload_client.ChunkSender: pass it to `upload_file`, then `terminate` it.
+    """
+
+    def __init__(self, file: js.File, progress_interval_ms: int = 100):
+        self.file = file
+        self.progress_interval_ms = progress_interval_ms
+        self._worker = js.Worker.new(_worker_url())
+        self._on_message_proxy = create_proxy(self._on_message)
+        self._worker.onmessage = self._on_message_proxy
+        self._future: asyncio.Future | None = None
+        self._on_progress: Callable[[js.Object], None] = lambda _: None
+
+    async def hash(self, size: int) -> str:
+        """SHA-256 of the first `size` bytes of the file."""
+        return await self._request({'type': 'hash', 'file': self.file, 'size': size})
+
+    async def send(self, session_id: str, offset: int, sizing: AdaptiveChunkSize, window: int, hash_content: bool,
+                   progress: UploadProgress, progress_callback: Callable[[UploadProgress], None]) -> str | None:
+        """Send the file from `offset` to the end and return its SHA-256, or None when `hash_content` is False.
+        With `progress.compression` set to DEFLATE every chunk is compressed with a CompressionStream('deflate-raw').
+        `progress` is updated from the coalesced progress messages; setting `progress.abort` stops the upload."""
+
+        def on_progress(message):
+            if progress.abort:
+                self.abort()
+            progress.bytes_uploaded = message.bytesUploaded
+            progress.bytes_per_second = message.bytesPerSecond
+            progress.bytes_read = message.bytesRead
+            progress.bytes_sent = message.bytesSent
+            progress.chunk_sizes.extend(message.chunkSizes.to_py())
+            progress_callback(progress)
+
+        self._on_progress = on_progress
+        return await self._request({
+            'type': 'upload', 'file': self.file, 'sessionId': session_id, 'offset': offset,
+            'window': window, 'hash': hash_content, 'progressInterval': self.progress_interval_ms,
+            'rpcUrl': js.URL.new('/wwwpy/rpc', js.location.href).href, 'rpcModule': 'server.rpc',
+            'compression': progress.compression,
+            'chunkSize': {
+                'initial': sizing.size, 'minimum': sizing.minimum, 'maximum': sizing.maximum,
+                'targetSeconds': sizing.target_seconds, 'smoothing': sizing.smoothing,
+                'granularity': sizing.granularity,
+            },
+        })
+
+    def abort(self):
+        """Stop sending new chunks; the pending `upload` returns once the chunks in flight are acknowledged."""
+        self._worker.postMessage(dict_to_js({'type': 'abort'}))
+
+    def terminate(self):
+        self._worker.terminate()
+        self._on_message_proxy.destroy()
+
+    async def _request(self, message: dict) -> str | None:
+        self._future = asyncio.get_running_loop().create_future()
+        self._worker.postMessage(dict_to_js(message))
+        return await self._future
+
+    def _on_message(self, event):
+        data = event.data
+        if data.type == 'progress':
+            self._on_progress(data)
+        elif self._future.done():
+            logger.warning(f'unexpected upload worker message: {data.type}')
+        elif data.type == 'done':
+            self._future.set_result(data.sha256)
+        elif data.type == 'error':
+            self._future.set_exception(UploadWorkerError(data.message))
+
+
+_url: str | None = None
+
+
+def _worker_url() -> str:
+    global _url
+    if _url is None:
+        blob = js.Blob.new([_worker_source], dict_to_js({'type': 'text/javascript'}))
+        _url = js.URL.createObjectURL(blob)
+    return _url
+
+
+# language=javascript
+_worker_source = r"""
+'use strict';
+
+const K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]);
+
+const rotr = (x, n) => (x >>> n) | (x << (32 - n));
+
+/** Incremental SHA-256: crypto.subtle.digest can only hash a whole buffer at once. */
+class Sha256 {
+    constructor() {
+        this.h = new Uint32Array([
+            0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.w = new Uint32Array(64);
+        this.pending = new Uint8Array(64);
+        this.pendingLength = 0;
+        this.length = 0;
+    }
+
+    update(bytes) {
+        this.length += bytes.length;
+        let i = 0;
+        if (this.pendingLength > 0) {
+            i = Math.min(64 - this.pendingLength, bytes.length);
+            this.pending.set(bytes.subarray(0, i), this.pendingLength);
+            this.pendingLength += i;
+            if (this.pendingLength < 64) return;
+            this.block(this.pending, 0);
+            this.pendingLength = 0;
+        }
+        for (; i + 64 <= bytes.length; i += 64) this.block(bytes, i);
+        if (i < bytes.length) {
+            this.pending.set(bytes.subarray(i), 0);
+            this.pendingLength = bytes.length - i;
+        }
+    }
+
+    block(bytes, o) {
+        const w = this.w;
+        for (let t = 0; t < 16; t++, o += 4)
+            w[t] = (bytes[o] << 24) | (bytes[o + 1] << 16) | (bytes[o + 2] << 8) | bytes[o + 3];
+        for (let t = 16; t < 64; t++) {
+            const x = w[t - 15], y = w[t - 2];
+            const s0 = rotr(x, 7) ^ rotr(x, 18) ^ (x >>> 3);
+            const s1 = rotr(y, 17) ^ rotr(y, 19) ^ (y >>> 10);
+            w[t] = (w[t - 16] + s0 + w[t - 7] + s1) | 0;
+        }
+        let [a, b, c, d, e, f, g, h] = this.h;
+        for (let t = 0; t < 64; t++) {
+            const t1 = (h + (rotr(e, 6) ^ rotr(e, 11) ^ rotr(e, 25)) + ((e & f) ^ (~e & g)) + K[t] + w[t]) | 0;
+            const t2 = ((rotr(a, 2) ^ rotr(a, 13) ^ rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            h = g; g = f; f = e; e = (d + t1) | 0;
+            d = c; c = b; b = a; a = (t1 + t2) | 0;
+        }
+        const s = this.h;
+        s[0] += a; s[1] += b; s[2] += c; s[3] += d; s[4] += e; s[5] += f; s[6] += g; s[7] += h;
+    }
+
+    hexdigest() {
+        const bits = this.length * 8;
+        const padding = (this.pendingLength < 56 ? 56 : 120) - this.pendingLength;
+        const tail = new Uint8Array(padding + 8);
+        tail[0] = 0x80;
+        const view = new DataView(tail.buffer);
+        view.setUint32(padding, Math.floor(bits / 0x100000000));
+        view.setUint32(padding + 4, bits >>> 0);
+        this.update(tail);
+        return Array.from(this.h, x => x.toString(16).padStart(8, '0')).join('');
+    }
+}
+
+/** Same policy as common/chunk_sizing.py AdaptiveChunkSize. */
+class ChunkSize {
+    constructor(o) {
+        Object.assign(this, o);
+        this.size = o.initial;
+        this.bytesPerSecond = null;
+    }
+
+    record(nbytes, seconds) {
+        if (seconds <= 0 || nbytes <= 0) return;
+        const sample = nbytes / seconds;
+        this.bytesPerSecond = this.bytesPerSecond === null ? sample :
+            this.smoothing * sample + (1 - this.smoothing) * this.bytesPerSecond;
+        let wanted = this.bytesPerSecond * this.targetSeconds;
+        if (seconds > this.targetSeconds) wanted = Math.min(wanted, this.size);
+        wanted = Math.floor(Math.min(Math.max(wanted, this.size / 2), this.size * 2));
+        wanted = Math.max(this.granularity, wanted - wanted % this.granularity);
+        this.size = Math.min(Math.max(wanted, this.minimum), this.maximum);
+    }
+}
+
+function toBase64(bytes) {
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000)
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    return btoa(binary);
+}
+
+/**
+ * Calls a server function like the wwwpy stubs do, with their JsonEncoderDecoder wire format
+ * (pinned by tests/remote/upload_worker_test.py):
+ * - request body: the module name, the function name, then every argument; one JSON value per line;
+ * - response body: "ok" then the JSON result, or "ex" then the server traceback; one JSON value per line.
+ * Only strings and integers are sent, which JSON.stringify writes exactly as json.dumps does;
+ * bytes travel as base64 strings, as wwwpy serializes them.
+ */
+async function rpc(m, func, ...args) {
+    const body = [m.rpcModule, func, ...args].map(a => JSON.stringify(a)).join('\n');
+    const response = await fetch(m.rpcUrl, {method: 'POST', body});
+    if (!response.ok) throw new Error(`${func}: HTTP ${response.status}`);
+    const lines = (await response.text()).split('\n');
+    if (JSON.parse(lines[0]) !== 'ok') throw new Error(JSON.parse(lines[1]));
+}
+
+/** Raw deflate, the same format produced by common.upload_protocol.deflate. */
+async function deflateRaw(bytes) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new CompressionStream('deflate-raw'));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+async function read(file, start, end) {
+    return new Uint8Array(await file.slice(start, end).arrayBuffer());
+}
+
+async function hashRange(file, size, hasher) {
+    for (let offset = 0; offset < size;) {
+        const bytes = await read(file, offset, Math.min(offset + (1 << 20), size));
+        hasher.update(bytes);
+        offset += bytes.length;
+    }
+}
+
+let aborted = false;
+
+async function upload(m) {
+    const hasher = m.hash ? new Sha256() : null;
+    if (hasher) await hashRange(m.file, m.offset, hasher);
+    const sizing = new ChunkSize(m.chunkSize);
+    const total = m.file.size;
+    const done = new Map();  // start -> end of the chunks acknowledged out of order
+    let acknowledged = m.offset;
+    let bytesRead = 0, bytesSent = 0;
+    let chunkSizes = [];
+    let lastPost = 0;
+
+    const post = (force) => {
+        const now = performance.now();
+        if (!force && now - lastPost < m.progressInterval) return;
+        lastPost = now;
+        postMessage({type: 'progress', bytesUploaded: acknowledged, bytesPerSecond: sizing.bytesPerSecond,
+                     bytesRead, bytesSent, chunkSizes});
+        chunkSizes = [];
+    };
+
+    const send = async (start, bytes) => {
+        const started = performance.now();
+        const payload = m.compression ? await deflateRaw(bytes) : bytes;
+        await rpc(m, 'upload_write', m.sessionId, start, toBase64(payload));
+        sizing.record(bytes.length, (performance.now() - started) / 1000);
+        bytesRead += bytes.length;
+        bytesSent += payload.length;
+        done.set(start, start + bytes.length);
+        while (done.has(acknowledged)) {
+            const end = done.get(acknowledged);
+            done.delete(acknowledged);
+            acknowledged = end;
+        }
+        post(false);
+    };
+
+    const inFlight = new Set();
+    let failure = null;
+    for (let offset = m.offset; offset < total && !aborted && !failure;) {
+        while (inFlight.size >= m.window && !failure) await Promise.race(inFlight);
+        if (failure || aborted) break;
+        const bytes = await read(m.file, offset, Math.min(offset + sizing.size, total));
+        if (hasher) hasher.update(bytes);
+        chunkSizes.push(bytes.length);
+        const p = send(offset, bytes)
+            .catch(e => { failure = failure || e; })
+            .finally(() => inFlight.delete(p));
+        inFlight.add(p);
+        offset += bytes.length;
+    }
+    await Promise.all(inFlight);
+    if (failure) throw failure;
+    post(true);
+    return hasher ? hasher.hexdigest() : null;
+}
+
+async function hash(m) {
+    const hasher = new Sha256();
+    await hashRange(m.file, m.size, hasher);
+    return hasher.hexdigest();
+}
+
+self.onmessage = async (event) => {
+    const m = event.data;
+    if (m.type === 'abort') {
+        aborted = true;
+        return;
+    }
+    try {
+        const sha256 = m.type === 'hash' ? await hash(m) : await upload(m);
+        postMessage({type: 'done', sha256});
+    } catch (e) {
+        postMessage({type: 'error', message: String(e && e.message || e)});
+    }
+};
+"""
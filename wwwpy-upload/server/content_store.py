@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sys
+import uuid
+from functools import partial
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+_sha256_re = re.compile(r'[0-9a-f]{64}')
+
+_FICLONE = 0x40049409
+"""Linux ioctl making a file a copy-on-write clone of another one (btrfs, xfs, ...): no data is copied."""
+
+
+class ContentStore:
+    """Content-addressed store of the uploaded files: one blob per SHA-256, named after the digest.
+    Blobs share the disk blocks of the uploads: copy-on-write clones where the filesystem supports them,
+    hard links otherwise. A hard-linked blob changes if its upload is edited in place, so `materialize`
+    checks the digest of what it serves. Beyond `max_bytes` the least recently modified blobs are evicted."""
+
+    def __init__(self, folder: Path, tmp_folder: Path | None = None, max_bytes: int | None = None):
+        self.folder = folder
+        self.tmp_folder = tmp_folder
+        """Where `materialize` writes its temporary copies, out of sight of the readers of the target folder."""
+        self.max_bytes = max_bytes
+
+    def path_for(self, sha256: str) -> Path:
+        if not _sha256_re.fullmatch(sha256):
+            raise ValueError(f'Invalid sha256: {sha256}')
+        return self.folder / sha256[:2] / sha256
+
+    def add(self, file: Path, sha256: str) -> bool:
+        """Keep the content of `file` under its digest, without copying it. Returns False when the file
+        can be neither cloned nor linked (e.g. it is on another filesystem): the store is only a shortcut."""
+        blob = self.path_for(sha256)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                _clone_or_link(file, blob)
+            except OSError as e:
+                logger.info(f'content store skips {file}: {e}')
+                return False
+        self.evict()
+        return True
+
+    def materialize(self, sha256: str, size: int, target: Path) -> bool:
+        """Place a copy of the blob at `target` and return True, or return False if the store does not hold it.
+        A blob that no longer matches its digest is removed instead of served."""
+        blob = self.path_for(sha256)
+        try:
+            if blob.stat().st_size != size:
+                return False
+            copy_into_place(blob, target, self.tmp_folder, partial(_copy_verified, sha256=sha256))
+        except FileNotFoundError:  # evicted meanwhile
+            return False
+        except _ContentChanged:
+            logger.info(f'content store drops {blob}: the content changed')
+            blob.unlink(missing_ok=True)
+            return False
+        return True
+
+    def evict(self) -> list[Path]:
+        """Remove the least recently modified blobs until the rest fits in `max_bytes`; returns the removed ones."""
+        if self.max_bytes is None:
+            return []
+        blobs = []
+        for blob in self.folder.glob('*/*'):
+            if not _sha256_re.fullmatch(blob.name):
+                continue  # a temporary file of a concurrent `add`
+            try:
+                stat = blob.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, blob))
+        blobs.sort()  # oldest first
+
+        total = sum(size for _, size, _ in blobs)
+        removed = []
+        for _, size, blob in blobs:
+            if total <= self.max_bytes:
+                break
+            blob.unlink(missing_ok=True)
+            total -= size
+            removed.append(blob)
+        return removed
+
+
+def copy_into_place(source: Path, target: Path, tmp_folder: Path | None = None,
+                    copy: Callable[[Path, Path], None] = shutil.copyfile):
+    """Copy `source` to `target` under a temporary name first, so the target appears complete or not at all.
+    The temporary file is made in `tmp_folder`; next to the target if it is None or on another filesystem,
+    since a rename cannot cross filesystems."""
+    tmp = (tmp_folder or target.parent) / f'.{target.name}.{uuid.uuid4().hex}.tmp'
+    try:
+        copy(source, tmp)
+        try:
+            os.replace(tmp, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV or tmp_folder is None:
+                raise
+            copy_into_place(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class _ContentChanged(Exception):
+    pass
+
+
+def _copy_verified(source: Path, target: Path, sha256: str, block_size: int = pow(2, 20)):
+    """Copy `source` to `target`, hashing the bytes copied; raises _ContentChanged if they do not match `sha256`."""
+    hasher = hashlib.sha256()
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        while data := src.read(block_size):
+            hasher.update(data)
+            dst.write(data)
+    if hasher.hexdigest() != sha256:
+        raise _ContentChanged(f'{source} does not match its digest')
+
+
+def _clone_or_link(source: Path, target: Path):
+    tmp = target.with_name(f'.{target.name}.{uuid.uuid4().hex}.tmp')
+    try:
+        try:
+            _clone(source, tmp)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            os.link(source, tmp)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _clone(source: Path, target: Path):
+    """Make `target` a copy-on-write clone of `source`; OSError where the platform or filesystem cannot."""
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'copy-on-write clones are only attempted on Linux')
+    import fcntl
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
@@ -1,34 +1,200 @@
+import asyncio
 import base64
+import hashlib
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from common.upload_protocol import UploadSessionInfo, negotiate_compression
+from server.content_store import ContentStore
+from server.upload_sessions import UploadSession, UploadSessions, UploadState
+
 logger = logging.getLogger(__name__)
 
 
-async def upload_init(name: str, size: int):
+async def upload_dedup(name: str, size: int, sha256: str) -> bool:
+    """If the server already holds a file with this content, place it at `name` and return True:
+    the client can skip the transfer. Returns False otherwise."""
     file = _resolve_file(name)
-    file.unlink(missing_ok=True)
-    file.touch()
-    logger.info(f'upload_init name={name} size={size}')
+    found = await _disk_io(_content_store().materialize, sha256, size, file)
+    if found:
+        # a partial upload of the same name is now obsolete, unless a client is still sending it
+        await _disk_io(_sessions.discard, _staging_file(file))
+    logger.info(f'upload_dedup name={name} size={size} sha256={sha256} found={found}')
+    return found
+
+
+async def upload_offset(name: str, size: int, fingerprint: str) -> int:
+    """Return how many bytes of `name` the server already holds, so the client can resume from there.
+    Returns 0 when there is no partial upload matching `size` and `fingerprint`."""
+    offset = await _disk_io(_resumable_offset, _staging_file(_resolve_file(name)), size, fingerprint)
+    logger.info(f'upload_offset name={name} size={size} offset={offset}')
+    return offset
+
+
+async def upload_init(name: str, size: int, fingerprint: str, resume: bool, compression: str,
+                      dedup: bool = False) -> UploadSessionInfo:
+    """Open an upload session; with `resume` a matching partial upload is kept.
+    The content is written in the staging folder and appears under `name` only when complete.
+    The file is preallocated to `size`: this fails fast when the disk cannot hold it.
+    `compression` is the one proposed by the client, the returned info holds the accepted one.
+    With `dedup` the completed file is kept in the content store, for the `upload_dedup` of later uploads."""
+    target = _resolve_file(name)
+    compression = negotiate_compression(compression)
+    session = await _disk_io(_sessions.open, _staging_file(target), size, fingerprint, resume, compression, target,
+                             dedup)
+    _schedule_staging_sweep()
+    logger.info(f'upload_init name={name} size={size} resume={resume} compression={compression} dedup={dedup} '
+                f'session_id={session.session_id}')
+    return UploadSessionInfo(session.session_id, compression)
+
+
+async def upload_write(session_id: str, offset: int, b64str: str):
+    _schedule_session_sweep()
+    session = _sessions.get(session_id)
+    await _disk_io(_decode_and_write, session, offset, b64str)
+    _log_chunk(session, offset)
     return None
 
 
-async def upload_append(name: str, b64str: str):
-    logger.info(f'upload_append name={name} len(b64str)={len(b64str)}')
-    file = _resolve_file(name)
-    bytes_append = base64.b64decode(b64str)
-    with file.open('ab') as f:
-        f.write(bytes_append)
+async def upload_complete(session_id: str, sha256: str) -> str:
+    """Close the session and check the received content against the client `sha256`.
+    On match the file is renamed from the staging folder to its name, atomically.
+    Returns the server digest; on mismatch the upload is discarded."""
+    _schedule_session_sweep()
+    session = _sessions.get(session_id)
+    # may hash part of the file back from disk
+    digest = await _disk_io(session.hexdigest)
+    completed = session.written == session.state.size and digest == sha256
+    await _disk_io(_sessions.close, session_id, 'completed' if completed else 'failed', completed)
+    if session.written != session.state.size:
+        await _disk_io(_discard_staging, session.file)
+        raise ValueError(f'Upload incomplete: {session.written} of {session.state.size} bytes received')
+    logger.info(f'upload_complete session_id={session_id} sha256={digest} match={digest == sha256}')
+    if not completed:
+        await _disk_io(_discard_staging, session.file)
+    elif session.dedup:
+        await _disk_io(_content_store().add, session.target, digest)
+    return digest
+
+
+async def upload_abort(session_id: str):
+    logger.info(f'upload_abort session_id={session_id}')
+    session = await _disk_io(_sessions.close, session_id, 'aborted')
+    if session:
+        await _disk_io(_discard_staging, session.file)
     return None
 
-async def upload_abort(name: str):
-    logger.info(f'upload_abort name={name}')
-    file = _resolve_file(name)
+
+async def upload_metrics() -> str:
+    """Upload metrics in the Prometheus text format: sessions open and closed by outcome, bytes, chunks,
+    decode time and the chunk write latency histogram, plus bytes and chunks of each open session."""
+    _schedule_session_sweep()
+    return _sessions.render_metrics()
+
+
+_sessions = UploadSessions()
+
+_chunk_log_every = 100
+"""The per-chunk log is sampled: one line every `_chunk_log_every` chunks of a session."""
+
+_staging_max_age = 24 * 3600.0
+"""Partial uploads untouched for longer than this (seconds) are reclaimed by the staging sweep."""
+_staging_sweep_interval = 60.0
+
+_content_store_max_bytes = 10 * pow(2, 30)
+"""Above this total size, the least recently modified blobs of the content store are evicted."""
+_last_staging_sweep: float | None = None
+
+_disk_io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='upload-disk-io')
+"""Bounded pool for the blocking file operations, so disk writes never stall the event loop."""
+
+
+async def _disk_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_disk_io_executor, func, *args)
+
+
+def _resumable_offset(file: Path, size: int, fingerprint: str) -> int:
+    session = _sessions.find(file)
+    state = session.state if session else UploadState.load(file)
+    if not (state and state.matches(size, fingerprint) and file.exists()):
+        return 0
+    return session.written if session else min(state.written, file.stat().st_size)
+
+
+def _decode_and_write(session: UploadSession, offset: int, b64str: str):
+    started = time.perf_counter()
+    data = base64.b64decode(b64str)
+    session.write(offset, data, time.perf_counter() - started)
+
+
+def _log_chunk(session: UploadSession, offset: int):
+    chunks = session.metrics.chunks
+    if (chunks - 1) % _chunk_log_every == 0 and logger.isEnabledFor(logging.INFO):
+        # formatted by the logging module, only when the line is emitted
+        logger.info('upload chunk session_id=%s offset=%d chunks=%d bytes=%d',
+                    session.session_id, offset, chunks, session.metrics.bytes)
+
+
+def _uploads_folder() -> Path:
+    return Path(__file__).parent.parent / 'uploads'
+
+
+def _store_folder() -> Path:
+    """Server side bookkeeping of the uploads, kept outside of the uploads folder."""
+    return Path(__file__).parent.parent / '.upload-store'
+
+
+def _content_store() -> ContentStore:
+    return ContentStore(_store_folder() / 'cas', _staging_folder(), _content_store_max_bytes)
+
+
+def _staging_file(target: Path) -> Path:
+    """Where `target` is written while it is uploaded: a flat folder, one file per uploads-relative path."""
+    relative = target.relative_to(_uploads_folder()).as_posix()
+    return _staging_folder() / f'{hashlib.sha256(relative.encode()).hexdigest()[:32]}.part'
+
+
+def _staging_folder() -> Path:
+    folder = _store_folder() / 'staging'
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+def _discard_staging(file: Path):
     file.unlink(missing_ok=True)
-    return None
+    UploadState.remove(file)
+
+
+def _schedule_session_sweep():
+    """Close the idle sessions in the background, so an abandoned upload releases its file
+    even when no other upload starts; throttled by `UploadSessions.sweep_interval`."""
+    if _sessions.sweep_due():
+        _disk_io_executor.submit(_sessions.sweep)
+
+
+def _schedule_staging_sweep():
+    """Start a staging sweep in the background, at most once every `_staging_sweep_interval` seconds."""
+    global _last_staging_sweep
+    now = time.monotonic()
+    if _last_staging_sweep is not None and now - _last_staging_sweep < _staging_sweep_interval:
+        return
+    _last_staging_sweep = now
+    _disk_io_executor.submit(_sweep_staging, _staging_folder())
+
+
+def _sweep_staging(folder: Path):
+    try:
+        removed = _sessions.sweep_staging(folder, _staging_max_age)
+        if removed:
+            logger.info(f'staging sweep removed {len(removed)} partial uploads')
+    except Exception:
+        logger.exception('staging sweep failed')
+
 
 def _resolve_file(name: str) -> Path:
-    folder = Path(__file__).parent.parent / 'uploads'
+    folder = _uploads_folder()
     candidate = folder / name
     # security check: candidate is inside the folder?
     if not candidate.resolve().is_relative_to(folder.resolve()):
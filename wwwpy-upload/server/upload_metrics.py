@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import threading
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import dataclass, field
+
+_LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+"""Upper bounds in seconds of the write latency buckets; slower writes fall in the +Inf bucket."""
+
+
+class LatencyHistogram:
+    def __init__(self, bounds: tuple[float, ...] = _LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+
+    def merge(self, other: LatencyHistogram):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(upper bound label, observations up to it), ending with '+Inf', as in the Prometheus format."""
+        total = 0
+        result = []
+        for bound, count in zip([*map(str, self.bounds), '+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+@dataclass
+class SessionMetrics:
+    bytes: int = 0  # content bytes written to the file
+    received_bytes: int = 0  # bytes of the chunks as received, before decompression
+    chunks: int = 0
+    decode_seconds: float = 0.0  # base64 decoding and decompression
+    write_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    def record_chunk(self, received_bytes: int, written_bytes: int, decode_seconds: float, write_seconds: float):
+        self.bytes += written_bytes
+        self.received_bytes += received_bytes
+        self.chunks += 1
+        self.decode_seconds += decode_seconds
+        self.write_latency.observe(write_seconds)
+
+    def merge(self, other: SessionMetrics):
+        self.bytes += other.bytes
+        self.received_bytes += other.received_bytes
+        self.chunks += other.chunks
+        self.decode_seconds += other.decode_seconds
+        self.write_latency.merge(other.write_latency)
+
+
+class UploadMetrics:
+    """
+    Server-wide upload counters: the metrics of the closed sessions are folded into a total,
+    the open ones are added at render time. Sessions are closed with an outcome:
+    'completed', 'failed' (incomplete or digest mismatch), 'aborted', 'expired' (idle) or
+    'replaced' (the same file was opened again).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._closed = SessionMetrics()
+        self.sessions_opened = 0
+        self.outcomes: Counter[str] = Counter()
+
+    def session_opened(self):
+        with self._lock:
+            self.sessions_opened += 1
+
+    def session_closed(self, metrics: SessionMetrics, outcome: str):
+        with self._lock:
+            self._closed.merge(metrics)
+            self.outcomes[outcome] += 1
+
+    def render(self, open_sessions: dict[int, SessionMetrics]) -> str:
+        """The metrics in the Prometheus text exposition format, with per session gauges for the open ones.
+        Sessions are labelled with their number, never with their id: the id is the only credential
+        of the upload RPCs, and the metrics are readable by anyone."""
+        with self._lock:
+            total = SessionMetrics()
+            total.merge(self._closed)
+            outcomes = dict(self.outcomes)
+            opened = self.sessions_opened
+        for metrics in open_sessions.values():
+            total.merge(metrics)
+
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list[tuple[str, float]]):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{labels} {_number(value)}' for labels, value in samples)
+
+        metric('upload_sessions_open', 'gauge', 'Upload sessions currently open.', [('', len(open_sessions))])
+        metric('upload_sessions_opened_total', 'counter', 'Upload sessions opened.', [('', opened)])
+        metric('upload_sessions_closed_total', 'counter', 'Upload sessions closed, by outcome.',
+               [(f'{{outcome={_label(outcome)}}}', count) for outcome, count in sorted(outcomes.items())])
+        metric('upload_bytes_total', 'counter', 'Content bytes written.', [('', total.bytes)])
+        metric('upload_received_bytes_total', 'counter', 'Chunk bytes received, before decompression.',
+               [('', total.received_bytes)])
+        metric('upload_chunks_total', 'counter', 'Chunks written.', [('', total.chunks)])
+        metric('upload_decode_seconds_total', 'counter', 'Time spent decoding and decompressing chunks.',
+               [('', total.decode_seconds)])
+        # histogram samples are suffixed: upload_chunk_write_seconds_bucket{le="..."}, _sum and _count
+        metric('upload_chunk_write_seconds', 'histogram', 'Latency of the write of one chunk.',
+               [(f'_bucket{{le={_label(bound)}}}', count) for bound, count in total.write_latency.cumulative()]
+               + [('_sum', total.write_latency.sum), ('_count', total.write_latency.count)])
+        metric('upload_session_bytes', 'gauge', 'Content bytes written by each open session.',
+               [(f'{{session={_label(str(number))}}}', m.bytes) for number, m in open_sessions.items()])
+        metric('upload_session_chunks', 'gauge', 'Chunks written by each open session.',
+               [(f'{{session={_label(str(number))}}}', m.chunks) for number, m in open_sessions.items()])
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value: str) -> str:
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+
+def _number(value: float) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
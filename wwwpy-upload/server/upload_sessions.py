@@ -0,0 +1,403 @@
+from __future__ import annotations
+
+import errno
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable
+
+from common.byte_ranges import ContiguousRanges
+from common.upload_protocol import inflate
+from server.content_store import copy_into_place
+from server.upload_metrics import SessionMetrics, UploadMetrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UploadState:
+    """Persisted next to a partial upload; `written` is the contiguous prefix already on disk."""
+    size: int
+    fingerprint: str
+    written: int
+
+    suffix = '.upload.json'
+
+    @classmethod
+    def path_for(cls, file: Path) -> Path:
+        return file.with_name(file.name + cls.suffix)
+
+    @classmethod
+    def load(cls, file: Path) -> UploadState | None:
+        path = cls.path_for(file)
+        if not path.exists():
+            return None
+        return cls(**json.loads(path.read_text()))
+
+    def save(self, file: Path):
+        path = self.path_for(file)
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text(json.dumps(asdict(self)))
+        os.replace(tmp, path)  # a reader never sees a half-written state
+
+    @classmethod
+    def remove(cls, file: Path):
+        cls.path_for(file).unlink(missing_ok=True)
+
+    def matches(self, size: int, fingerprint: str) -> bool:
+        return self.size == size and self.fingerprint == fingerprint
+
+
+class UploadSession:
+    """One active upload: the staging `file` is opened once, then every chunk is a single pwrite.
+    Once complete, `finalize` moves it to its `target` in one atomic rename.
+    Chunks can be written from several threads: decompression runs concurrently, the write and the
+    bookkeeping are serialized by a per-session lock."""
+
+    def __init__(self, session_id: str, file: Path, state: UploadState, clock: Callable[[], float],
+                 state_save_interval: float, compression: str = '', target: Path | None = None,
+                 max_unhashed: int = pow(2, 26), dedup: bool = False):
+        self.session_id = session_id
+        self.number = 0
+        """Sequence number given by `UploadSessions`: unlike `session_id`, it is not a secret."""
+        self.file = file
+        self.target = target or file
+        self.state = state
+        self.compression = compression
+        self.dedup = dedup
+        """The client asked for deduplication: once complete, the content goes in the content store."""
+        self.metrics = SessionMetrics()
+        self._clock = clock
+        self._state_save_interval = state_save_interval
+        self._lock = threading.Lock()
+        self._received = ContiguousRanges(state.written)
+        self._fd = os.open(file, os.O_RDWR | os.O_CREAT, 0o644)
+        self.last_used = self._state_saved_at = clock()
+        # the content is hashed in file order while the chunks arrive; out of order chunks wait in memory,
+        # up to `max_unhashed` bytes: beyond that they are dropped and the gap is hashed from disk when needed
+        self._hasher = hashlib.sha256()
+        self._hashed = 0
+        self._unhashed: dict[int, bytes] = {}
+        self._unhashed_bytes = 0
+        self._max_unhashed = max_unhashed
+        self._hash_prefix(state.written)
+
+    @property
+    def written(self) -> int:
+        return self._received.end
+
+    def hexdigest(self) -> str:
+        """SHA-256 of the contiguous prefix received so far."""
+        with self._lock:
+            if self._hashed < self.written:
+                # out of order chunks were dropped from memory: read the gap back
+                self._hash_prefix(self.written)
+                self._unhashed = {offset: data for offset, data in self._unhashed.items() if offset >= self._hashed}
+                self._unhashed_bytes = sum(map(len, self._unhashed.values()))
+            return self._hasher.hexdigest()
+
+    def write(self, offset: int, data: bytes, decode_seconds: float = 0.0):
+        """Write a chunk at `offset`; a compressed chunk is decompressed first, `offset` refers to the file content.
+        `decode_seconds` is the time already spent decoding the chunk (e.g. from base64), for the metrics."""
+        received = len(data)
+        remaining = self.state.size - offset
+        if self.compression:
+            started = time.perf_counter()
+            data = inflate(data, remaining)
+            decode_seconds += time.perf_counter() - started
+        if len(data) > remaining:
+            raise ValueError(f'Chunk at offset {offset} goes beyond the declared size {self.state.size}')
+        with self._lock:
+            if self._fd < 0:
+                raise ValueError(f'Upload session closed: {self.session_id}')
+            # chunks can arrive out of order, so every chunk is written at its own offset
+            started = time.perf_counter()
+            os.pwrite(self._fd, data, offset)
+            self.metrics.record_chunk(received, len(data), decode_seconds, time.perf_counter() - started)
+            self._received.add(offset, offset + len(data))
+            self._hash_in_order(offset, data)
+            self.last_used = now = self._clock()
+            # the persisted state may lag behind: resuming from an older offset only re-sends some bytes
+            if now - self._state_saved_at >= self._state_save_interval:
+                self._save_state()
+
+    def _hash_in_order(self, offset: int, data: bytes):
+        if offset < self._hashed:  # re-sent bytes, already hashed
+            data = data[self._hashed - offset:]
+            offset = self._hashed
+        if not data:
+            return
+        if offset > self._hashed:
+            if self._unhashed_bytes + len(data) > self._max_unhashed:
+                # too far ahead (e.g. chunks sent in reverse order): memory stays bounded, `hexdigest` reads from disk
+                self._unhashed.clear()
+                self._unhashed_bytes = 0
+            else:
+                self._unhashed[offset] = data
+                self._unhashed_bytes += len(data)
+            return
+        self._hasher.update(data)
+        self._hashed += len(data)
+        while self._hashed in self._unhashed:
+            data = self._unhashed.pop(self._hashed)
+            self._unhashed_bytes -= len(data)
+            self._hasher.update(data)
+            self._hashed += len(data)
+
+    def _hash_prefix(self, size: int, block_size: int = pow(2, 20)):
+        """Hash the file from the current position up to `size`: the bytes written by the previous session
+        of a resumed upload, or the chunks dropped from memory."""
+        fd = self._fd if self._fd >= 0 else os.open(self.file, os.O_RDONLY)
+        try:
+            while self._hashed < size:
+                data = os.pread(fd, min(block_size, size - self._hashed), self._hashed)
+                if not data:
+                    raise ValueError(f'Partial upload shorter than expected: {self.file}')
+                self._hasher.update(data)
+                self._hashed += len(data)
+        finally:
+            if fd != self._fd:
+                os.close(fd)
+
+    def preallocate(self):
+        """Reserve the declared size up front, so the file does not grow (and fragment) chunk by chunk.
+        Raises OSError(ENOSPC) before any byte is transferred if the disk cannot hold the file."""
+        size = self.state.size
+        if size == 0:
+            return
+        missing = size - os.fstat(self._fd).st_size
+        free = shutil.disk_usage(self.file.parent).free
+        if missing > free:
+            raise _no_space(self.file, size, free)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(self._fd, 0, size)
+                return
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise _no_space(self.file, size, free) from e
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+        os.ftruncate(self._fd, max(size, os.fstat(self._fd).st_size))
+
+    def close(self):
+        with self._lock:
+            if self._fd < 0:
+                return
+            os.close(self._fd)
+            self._fd = -1
+            self._save_state()
+
+    def finalize(self):
+        """Move the closed, complete upload to `target`: readers of the target folder never see a partial file."""
+        UploadState.remove(self.file)
+        if self.target == self.file:
+            return
+        try:
+            os.replace(self.file, self.target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # staging on another filesystem: the copy can only be renamed into place from the target's one
+            copy_into_place(self.file, self.target)
+            self.file.unlink()
+
+    def _save_state(self):
+        self._state_saved_at = self._clock()
+        if self.state.written != self.written:
+            self.state.written = self.written
+            self.state.save(self.file)
+
+
+def _no_space(file: Path, size: int, free: int) -> OSError:
+    return OSError(errno.ENOSPC, f'Not enough disk space to upload {file.name}: '
+                                 f'{size} bytes declared, {free} bytes free')
+
+
+def _reclaimable(file: Path, now: float, max_age: float) -> bool:
+    try:
+        touched = file.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    try:
+        touched = max(touched, UploadState.path_for(file).stat().st_mtime)
+        UploadState.load(file)
+    except (OSError, ValueError, TypeError):
+        return True  # no valid state: the upload cannot be resumed
+    return now - touched > max_age
+
+
+class UploadSessions:
+    """Registry of the active uploads, keyed by session id; safe to use from several threads.
+    Sessions idle for longer than `idle_timeout` seconds are closed by `sweep`; their partial upload stays
+    resumable. Callers sweep on every `open` and whenever `sweep_due` says so."""
+
+    def __init__(self, idle_timeout: float = 300.0, state_save_interval: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic, max_unhashed: int = pow(2, 26),
+                 sweep_interval: float = 10.0):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._swept_at: float | None = None
+        self.state_save_interval = state_save_interval
+        self.max_unhashed = max_unhashed
+        """Bytes of out of order chunks each session keeps in memory for hashing."""
+        self._clock = clock
+        self._sessions: dict[str, UploadSession] = {}
+        self._numbers = itertools.count(1)
+        self._busy: Counter[Path] = Counter()  # files `open` and `close` are working on, out of `_sessions`
+        self._lock = threading.Lock()
+        self.metrics = UploadMetrics()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def open(self, file: Path, size: int, fingerprint: str, resume: bool, compression: str = '',
+             target: Path | None = None, dedup: bool = False) -> UploadSession:
+        """Open a session writing `file`; `target` is where `finalize` moves it, `file` itself by default."""
+        self.sweep()
+        with self._lock:
+            self._busy[file] += 1  # from now on `sweep_staging` leaves the file and its state alone
+            stale = [s.session_id for s in self._sessions.values() if s.file == file]
+        try:
+            for session_id in stale:
+                self.close(session_id, 'replaced')
+            session = self._open(file, size, fingerprint, resume, compression, target, dedup)
+            with self._lock:
+                session.number = next(self._numbers)
+                self._sessions[session.session_id] = session
+        finally:
+            with self._lock:
+                self._busy -= Counter([file])
+        self.metrics.session_opened()
+        return session
+
+    def _open(self, file: Path, size: int, fingerprint: str, resume: bool, compression: str,
+              target: Path | None, dedup: bool) -> UploadSession:
+        state = UploadState.load(file)
+        if not (resume and state and state.matches(size, fingerprint) and file.exists()):
+            file.unlink(missing_ok=True)
+            state = UploadState(size, fingerprint, 0)
+            state.save(file)
+        else:
+            state.written = min(state.written, file.stat().st_size)
+
+        session = UploadSession(uuid.uuid4().hex, file, state, self._clock, self.state_save_interval, compression,
+                                target, self.max_unhashed, dedup)
+        try:
+            session.preallocate()
+        except OSError:
+            session.close()
+            file.unlink(missing_ok=True)
+            UploadState.remove(file)
+            raise
+        return session
+
+    def get(self, session_id: str) -> UploadSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            raise ValueError(f'Unknown upload session: {session_id}')
+        return session
+
+    def find(self, file: Path) -> UploadSession | None:
+        with self._lock:
+            return next((s for s in self._sessions.values() if s.file == file), None)
+
+    def close(self, session_id: str, outcome: str = 'closed', finalize: bool = False) -> UploadSession | None:
+        """Close the session, counting it in the metrics under `outcome`; None if it is not open.
+        With `finalize` the upload is then moved to its target, before `sweep_staging` may consider the file."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return None
+            self._busy[session.file] += 1
+        try:
+            session.close()
+            self.metrics.session_closed(session.metrics, outcome)
+            if finalize:
+                session.finalize()
+        finally:
+            with self._lock:
+                self._busy -= Counter([session.file])
+        return session
+
+    def sweep_staging(self, folder: Path, max_age: float) -> list[Path]:
+        """Reclaim the partial uploads in `folder` that no session has open and that will not be resumed:
+        untouched for `max_age` seconds (the file and its state alike), or without a valid state. A paused
+        upload younger than that stays, whatever its size. Also reclaims the state files left without their
+        partial upload and the temporary files older than `max_age`. Returns the removed files."""
+        with self._lock:
+            in_use = set(self._busy) | {s.file for s in self._sessions.values()}
+        now = time.time()
+        removed = []
+        for file in folder.glob('*.part'):
+            if file in in_use or not _reclaimable(file, now, max_age):
+                continue
+            # checked again and removed under the lock: `open` registers the file under it before touching it,
+            # so a partial upload is never removed while it is being resumed
+            with self._lock:
+                if self._in_use(file) or not _reclaimable(file, now, max_age):
+                    continue
+                file.unlink(missing_ok=True)
+                UploadState.remove(file)
+            removed.append(file)
+
+        for state_file in folder.glob('*.part' + UploadState.suffix):
+            file = state_file.with_name(state_file.name[:-len(UploadState.suffix)])
+            with self._lock:
+                if not self._in_use(file) and not file.exists():
+                    state_file.unlink(missing_ok=True)
+                    removed.append(state_file)
+        for tmp in folder.glob('*.tmp'):
+            try:
+                if now - tmp.stat().st_mtime > max_age:
+                    tmp.unlink()
+                    removed.append(tmp)
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def discard(self, file: Path) -> bool:
+        """Remove the partial upload `file` and its state, unless a session has it open or is opening it.
+        Returns whether it was removed."""
+        with self._lock:
+            if self._in_use(file):
+                return False
+            file.unlink(missing_ok=True)
+            UploadState.remove(file)
+        return True
+
+    def _in_use(self, file: Path) -> bool:
+        return file in self._busy or any(s.file == file for s in self._sessions.values())
+
+    def render_metrics(self) -> str:
+        with self._lock:
+            open_sessions = {s.number: s.metrics for s in self._sessions.values()}
+        return self.metrics.render(open_sessions)
+
+    def sweep_due(self) -> bool:
+        """True at most once every `sweep_interval` seconds; the caller is then expected to `sweep`."""
+        now = self._clock()
+        with self._lock:
+            if self._swept_at is not None and now - self._swept_at < self.sweep_interval:
+                return False
+            self._swept_at = now
+            return True
+
+    def sweep(self):
+        now = self._clock()
+        with self._lock:
+            self._swept_at = now
+            idle = [s for s in self._sessions.values() if now - s.last_used > self.idle_timeout]
+        for session in idle:
+            logger.info(f'closing idle upload session {session.session_id} file={session.file}')
+            self.close(session.session_id, 'expired')
@@ -0,0 +1,38 @@
+import asyncio
+
+from benchmarks.upload_benchmark import BenchmarkCase, SyntheticFile, run_case, parse_size, ADAPTIVE
+
+
+def test_synthetic_file_reads_are_consistent():
+    file = SyntheticFile('f.bin', 3 * pow(2, 20))
+    whole = asyncio.run(file.read(0, file.size))
+
+    assert len(whole) == file.size
+    assert asyncio.run(file.read(pow(2, 20) - 3, pow(2, 20) + 5)) == whole[pow(2, 20) - 3:pow(2, 20) + 5]
+    assert asyncio.run(file.read(file.size - 2, file.size + 10)) == whole[-2:]
+
+
+def test_parse_size():
+    assert parse_size('1K') == 1024
+    assert parse_size('2G') == pow(2, 31)
+    assert parse_size('100') == 100
+    assert parse_size('adaptive') == ADAPTIVE
+
+
+def test_run_case(tmp_path):
+    result = run_case(BenchmarkCase(size=pow(2, 20) + 1, chunk_size=pow(2, 18), concurrency=2), tmp_path)
+
+    assert result.error is None
+    assert result.chunks == 2 * 5
+    assert result.bytes_sent == 2 * (pow(2, 20) + 1)
+    assert result.mb_per_second > 0
+    assert result.write_seconds > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_run_case_with_compression(tmp_path):
+    result = run_case(BenchmarkCase(size=pow(2, 20), chunk_size=pow(2, 18), concurrency=1,
+                                    content='text', compress=True), tmp_path)
+
+    assert result.error is None
+    assert result.bytes_sent < pow(2, 20) / 2
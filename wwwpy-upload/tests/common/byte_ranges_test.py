@@ -0,0 +1,22 @@
+from common.byte_ranges import ContiguousRanges
+
+
+def test_in_order():
+    target = ContiguousRanges()
+    assert target.add(0, 10) == 10
+    assert target.add(10, 20) == 20
+
+
+def test_out_of_order_waits_for_the_gap():
+    target = ContiguousRanges()
+    assert target.add(10, 20) == 0
+    assert target.add(20, 30) == 0
+    assert target.pending_count == 2
+    assert target.add(0, 10) == 30
+    assert target.pending_count == 0
+
+
+def test_start_offset():
+    target = ContiguousRanges(100)
+    assert target.add(110, 120) == 100
+    assert target.add(100, 110) == 120
@@ -0,0 +1,51 @@
+from common.chunk_sizing import AdaptiveChunkSize
+
+_KiB = 1024
+_MiB = 1024 * _KiB
+
+
+def test_grows_on_a_fast_link():
+    target = AdaptiveChunkSize(initial=256 * _KiB, maximum=8 * _MiB)
+    for _ in range(10):
+        target.record(target.size, target.size / (100 * _MiB))
+
+    assert target.size == 8 * _MiB
+
+
+def test_shrinks_on_a_slow_link():
+    target = AdaptiveChunkSize(initial=256 * _KiB, minimum=64 * _KiB)
+    for _ in range(10):
+        target.record(target.size, target.size / (10 * _KiB))
+
+    assert target.size == 64 * _KiB
+
+
+def test_changes_at_most_twofold_per_measurement():
+    target = AdaptiveChunkSize(initial=256 * _KiB)
+
+    assert target.record(256 * _KiB, 0.001) == 512 * _KiB
+
+
+def test_does_not_grow_after_a_slow_request():
+    target = AdaptiveChunkSize(initial=256 * _KiB)
+    target.record(256 * _KiB, 0.01)
+    size = target.size
+
+    # the smoothed rate is still above the target after one 5 s request
+    assert target.record(size, 5) <= size
+
+
+def test_converges_to_the_target_duration():
+    target = AdaptiveChunkSize(initial=256 * _KiB, target_seconds=0.5)
+    for _ in range(20):
+        target.record(target.size, target.size / (2 * _MiB))
+
+    assert target.size == 1 * _MiB
+
+
+def test_fixed_never_changes():
+    target = AdaptiveChunkSize.fixed(1000)
+    target.record(1000, 100)
+    target.record(1000, 0.0001)
+
+    assert target.size == 1000
@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import hashlib
+
+from common.upload_client import upload_file, UploadProgress, UploadIntegrityError
+from common.upload_protocol import UploadSessionInfo
+
+_content = bytes(range(256)) * 40  # 10240 bytes: 10 chunks of 1024
+
+
+class _File:
+    name = 'folder/file.bin'
+    type = 'application/octet-stream'
+    last_modified = 1700000000000
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.size = len(content)
+
+    async def read(self, start: int, end: int) -> bytes:
+        return self.content[start:end]
+
+
+class _Rpc:
+    """The server functions, in memory: every chunk lands in `received`, `delays` maps a chunk offset to its latency."""
+
+    def __init__(self, offset: int = 0, dedup_hit: bool = False, delays: dict[int, float] | None = None,
+                 fail_at: int | None = None):
+        self.received = bytearray(_content[:offset])
+        self.offset = offset
+        self.dedup_hit = dedup_hit
+        self.delays = delays or {}
+        self.fail_at = fail_at
+        self.calls: list[str] = []
+        self.completed_offsets: list[int] = []
+
+    async def upload_dedup(self, name, size, sha256):
+        self.calls.append('upload_dedup')
+        return self.dedup_hit
+
+    async def upload_offset(self, name, size, fingerprint):
+        self.calls.append('upload_offset')
+        return self.offset
+
+    async def upload_init(self, name, size, fingerprint, resume, compression, dedup=False):
+        self.calls.append('upload_init')
+        return UploadSessionInfo('session-1', '')
+
+    async def upload_write(self, session_id, offset, b64str):
+        await asyncio.sleep(self.delays.get(offset, 0))
+        if offset == self.fail_at:
+            raise ConnectionError(f'chunk at {offset} failed')
+        data = base64.b64decode(b64str)
+        if len(self.received) < offset + len(data):
+            self.received.extend(bytes(offset + len(data) - len(self.received)))
+        self.received[offset:offset + len(data)] = data
+        self.completed_offsets.append(offset)
+
+    async def upload_complete(self, session_id, sha256):
+        self.calls.append('upload_complete')
+        return hashlib.sha256(self.received).hexdigest()
+
+    async def upload_abort(self, session_id):
+        self.calls.append('upload_abort')
+
+
+def _upload(rpc: _Rpc, on_progress=None, **kwargs) -> tuple[list[int], UploadProgress]:
+    """Upload `_content` in chunks of 1024 bytes; returns the bytes uploaded at every report, and the final progress."""
+    reports = []
+    last = []
+
+    def callback(progress: UploadProgress):
+        reports.append(progress.bytes_uploaded)
+        last[:] = [progress]
+        if on_progress:
+            on_progress(progress)
+
+    asyncio.run(upload_file(_File(_content), rpc, callback, chunk_size=1024, **kwargs))
+    return reports, last[0]
+
+
+def test_chunks_completing_out_of_order():
+    rpc = _Rpc(delays={0: 0.04, 1024: 0.03, 2048: 0.02, 3072: 0.01})
+
+    reports, progress = _upload(rpc, window=4)
+
+    assert [offset for offset in rpc.completed_offsets if offset < 4096] == [3072, 2048, 1024, 0]
+    assert reports == sorted(reports)
+    assert reports[1:4] == [0, 0, 0]  # nothing contiguous before the first chunk is acknowledged
+    assert bytes(rpc.received) == _content
+    assert progress.completed and progress.failure is None
+
+
+def test_a_failed_chunk_fails_the_upload():
+    rpc = _Rpc(fail_at=3072)
+
+    _, progress = _upload(rpc, window=2)
+
+    assert isinstance(progress.failure, ConnectionError)
+    assert not progress.completed
+    assert progress.bytes_uploaded == 3072
+    assert 'upload_complete' not in rpc.calls
+
+
+def test_resume_from_a_non_zero_offset():
+    rpc = _Rpc(offset=4096)
+
+    reports, progress = _upload(rpc)
+
+    assert rpc.completed_offsets[0] == 4096
+    assert progress.resumed_from == 4096
+    assert reports[0] == 4096
+    assert bytes(rpc.received) == _content
+    assert progress.completed
+
+
+def test_content_mismatch():
+    rpc = _Rpc(offset=4096)
+    rpc.received[0] ^= 0xff  # the server kept a different prefix
+
+    _, progress = _upload(rpc)
+
+    assert isinstance(progress.failure, UploadIntegrityError)
+    assert not progress.completed
+
+
+def test_abort():
+    rpc = _Rpc()
+
+    def abort_after_two_chunks(progress: UploadProgress):
+        if progress.bytes_uploaded >= 2048:
+            progress.abort = True
+
+    _, progress = _upload(rpc, abort_after_two_chunks, window=1)
+
+    assert rpc.calls[-1] == 'upload_abort'
+    assert 'upload_complete' not in rpc.calls
+    assert len(rpc.completed_offsets) == 2
+    assert not progress.completed
+
+
+def test_dedup_short_circuit():
+    rpc = _Rpc(dedup_hit=True)
+
+    reports, progress = _upload(rpc, dedup=True)
+
+    assert rpc.calls == ['upload_dedup']
+    assert rpc.completed_offsets == []
+    assert progress.bytes_saved == len(_content)
+    assert progress.completed
+    assert reports == [len(_content)]
+
+
+def test_dedup_miss_uploads_the_content():
+    rpc = _Rpc()
+
+    _, progress = _upload(rpc, dedup=True)
+
+    assert rpc.calls == ['upload_dedup', 'upload_offset', 'upload_init', 'upload_complete']
+    assert bytes(rpc.received) == _content
+    assert progress.bytes_saved == 0
+    assert progress.completed
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from common.upload_protocol import deflate, inflate, negotiate_compression, DEFLATE, entropy, compressible_type
+
+
+def test_round_trip():
+    data = b'timestamp,value\n' + b'2024-01-01,42\n' * 1000
+    compressed = deflate(data)
+
+    assert len(compressed) < len(data) / 10
+    assert inflate(compressed, len(data)) == data
+
+
+def test_inflate_rejects_chunks_expanding_beyond_the_limit():
+    compressed = deflate(b'\x00' * 100_000)
+
+    with pytest.raises(ValueError):
+        inflate(compressed, 1000, piece_size=512)
+
+
+def test_negotiate_compression():
+    assert negotiate_compression(DEFLATE) == DEFLATE
+    assert negotiate_compression('zstd') == ''
+    assert negotiate_compression('') == ''
+
+
+def test_entropy_tells_text_from_random_data():
+    assert entropy(b'') == 0.0
+    assert entropy(b'aaaa') == 0.0
+    assert entropy(b'timestamp,value\n2024-01-01,42\n' * 100) < 5
+    assert entropy(os.urandom(65536)) > 7.9
+
+
+@pytest.mark.parametrize('file_type, compressible', [
+    ('text/plain', True),
+    ('text/csv', True),
+    ('application/json', True),
+    ('application/ld+json', True),
+    ('image/svg+xml', True),
+    ('application/x-yaml', True),
+    ('image/png', False),
+    ('video/mp4', False),
+    ('application/zip', False),
+    ('application/x-7z-compressed', False),
+    ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', None),
+    ('application/octet-stream', None),
+    ('', None),
+])
+def test_compressible_type(file_type, compressible):
+    assert compressible_type(file_type) == compressible
@@ -0,0 +1,130 @@
+import asyncio
+
+from common.upload_queue import UploadQueue, QueueOrder
+
+
+def test_concurrency_is_limited():
+    running = 0
+    max_running = 0
+
+    async def job(report):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return True
+
+    async def main():
+        target = UploadQueue(concurrency=3)
+        for _ in range(20):
+            target.add(10, job)
+        await target.join()
+        return target
+
+    target = asyncio.run(main())
+    assert max_running == 3
+    assert target.progress.files_done == 20
+    assert target.progress.bytes_done == 200
+
+
+def test_smallest_first():
+    started = []
+
+    def job_for(size):
+        async def job(report):
+            started.append(size)
+            await asyncio.sleep(0)
+
+        return job
+
+    async def main():
+        target = UploadQueue(concurrency=1, order=QueueOrder.smallest_first)
+        for size in [30, 10, 20]:
+            target.add(size, job_for(size))
+        await target.join()
+
+    asyncio.run(main())
+    assert started == [10, 20, 30]
+
+
+def test_aggregate_progress_includes_running_jobs():
+    reports = []
+
+    async def job(report):
+        report(5)
+        await asyncio.sleep(0)
+        report(10)
+        return True
+
+    async def main():
+        target = UploadQueue(concurrency=2, progress_callback=lambda p: reports.append((p.files_done, p.bytes_done)))
+        target.add(10, job)
+        target.add(10, job)
+        await target.join()
+
+    asyncio.run(main())
+    assert (0, 10) in reports
+    assert reports[-1] == (2, 20)
+
+
+def test_a_failing_job_does_not_stop_the_queue():
+    async def failing(report):
+        raise ValueError('boom')
+
+    async def ok(report):
+        pass
+
+    async def main():
+        target = UploadQueue(concurrency=1)
+        target.add(1, failing)
+        target.add(1, ok)
+        await target.join()
+        return target
+
+    assert asyncio.run(main()).progress.idle
+
+
+def test_canceled_and_failed_jobs_leave_the_total():
+    async def uploaded(report):
+        report(10)
+        return True
+
+    async def canceled(report):
+        report(3)
+        return False
+
+    async def failing(report):
+        report(4)
+        raise ValueError('boom')
+
+    async def main():
+        target = UploadQueue(concurrency=1)
+        target.add(10, uploaded)
+        target.add(20, canceled)
+        target.add(30, failing)
+        await target.join()
+        return target
+
+    progress = asyncio.run(main()).progress
+    assert (progress.files_done, progress.bytes_done, progress.bytes_total) == (3, 10, 10)
+
+
+def test_put_waits_for_room_in_the_queue():
+    max_waiting = 0
+
+    async def job(report):
+        await asyncio.sleep(0.001)
+
+    async def main():
+        nonlocal max_waiting
+        target = UploadQueue(concurrency=2)
+        for _ in range(30):
+            await target.put(10, job, max_waiting=5)
+            max_waiting = max(max_waiting, len(target._waiting))
+        await target.join()
+        return target
+
+    target = asyncio.run(main())
+    assert max_waiting == 5
+    assert target.progress.files_done == 30
@@ -0,0 +1,84 @@
+from common.upload_records import UploadRecords, RecordState, visible_range
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_summary_is_kept_incrementally():
+    target = UploadRecords()
+    a = target.add('a.csv', 100, 'text/csv')
+    b = target.add('b.bin', 50, '')
+    target.add('c.bin', 10, '')
+
+    target.update(a, 40)
+    target.update(b, 20)
+    target.finish(b, RecordState.failed, 'Error: disk full')
+
+    summary = target.summary()
+    assert summary.counts == {RecordState.waiting: 1, RecordState.uploading: 1, RecordState.completed: 0,
+                              RecordState.failed: 1, RecordState.canceled: 0}
+    assert summary.files_total == 3
+    assert summary.bytes_total == 160
+    assert summary.bytes_done == 60
+    assert target.messages == {b: 'Error: disk full'}
+
+
+def test_completed_counts_the_whole_size():
+    target = UploadRecords()
+    a = target.add('a.csv', 100, 'text/csv')
+
+    target.finish(a, RecordState.completed)
+
+    assert target.summary().bytes_done == 100
+    assert target.uploaded[a] == 100
+
+
+def test_the_first_final_state_wins():
+    target = UploadRecords()
+    a = target.add('a.csv', 100, 'text/csv')
+
+    target.finish(a, RecordState.canceled)
+    target.update(a, 60)
+    target.finish(a, RecordState.failed, 'Error: aborted')
+
+    assert target.state(a) == RecordState.canceled
+    assert target.uploaded[a] == 0
+    assert target.messages == {}
+    assert target.summary().counts[RecordState.canceled] == 1
+
+
+def test_finished_records_are_dismissed_after_their_delay():
+    clock = FakeClock()
+    target = UploadRecords(clock)
+    a, b, c = [target.add(name, 1, '') for name in 'abc']
+    target.finish(a, RecordState.completed, dismiss_after=4)
+    target.finish(b, RecordState.canceled, dismiss_after=3)
+    target.finish(c, RecordState.failed)
+
+    clock.now = 3
+    assert target.dismiss_expired()
+    assert target.shown == [a, c]
+
+    clock.now = 3.5
+    assert not target.dismiss_expired()
+
+    clock.now = 4
+    assert target.dismiss_expired()
+    assert target.shown == [c]
+    assert target.summary().files_total == 3
+
+    d = target.add('d', 1, '')
+    assert target.shown == [c, d]
+
+
+def test_visible_range():
+    assert visible_range(0, 0, 400, 72) == range(0)
+    assert visible_range(10_000, 0, 400, 72, overscan=2) == range(0, 8)
+    assert visible_range(10_000, 7200, 400, 72, overscan=2) == range(98, 108)
+    assert visible_range(10, 7200, 400, 72, overscan=2) == range(10, 10)
+    assert visible_range(10_000, 72 * 9_999, 72, 72, overscan=0) == range(9_999, 10_000)
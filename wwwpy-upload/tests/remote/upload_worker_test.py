@@ -0,0 +1,119 @@
+import ast
+import hashlib
+import json
+import random
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from common.chunk_sizing import AdaptiveChunkSize
+
+_node = shutil.which('node')
+pytestmark = pytest.mark.skipif(_node is None, reason='node is not available')
+
+
+def _worker_source() -> str:
+    """The JavaScript of the worker, read without importing remote.upload_worker, which needs Pyodide."""
+    module = ast.parse((Path(__file__).parents[2] / 'remote' / 'upload_worker.py').read_text())
+    for node in module.body:
+        if isinstance(node, ast.Assign) and any(t.id == '_worker_source' for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise AssertionError('_worker_source not found')
+
+
+def _run(script: str):
+    """Run `script` after the worker source in node; it reports its result with `output(value)`."""
+    prelude = "'use strict';\nglobalThis.self = globalThis;\n"
+    harness = '\nconst output = (value) => process.stdout.write(JSON.stringify(value));\n'
+    result = subprocess.run([_node, '-'], input=prelude + _worker_source() + harness + script,
+                            capture_output=True, text=True, timeout=60, check=True)
+    return json.loads(result.stdout)
+
+
+def _rpc_script(response: str) -> str:
+    """Calls upload_write through the worker `rpc`, answered with `response`; outputs the request and the outcome."""
+    return f"""
+        let request = null;
+        globalThis.fetch = async (url, init) => {{
+            request = {{url, method: init.method, body: init.body}};
+            return new Response({json.dumps(response)});
+        }};
+        const m = {{rpcUrl: 'http://localhost/wwwpy/rpc', rpcModule: 'server.rpc'}};
+        rpc(m, 'upload_write', 'session-1', 1048576, 'AAEC/w==').then(
+            () => output({{request, error: null}}),
+            (e) => output({{request, error: e.message}}));
+    """
+
+
+@pytest.mark.parametrize('sizes', [[0], [3], [55], [56], [63], [64], [65], [119], [120], [1000],
+                                   [1, 63, 64, 200], [100, 0, 28, 1 << 16]])
+def test_sha256_matches_hashlib(sizes):
+    rnd = random.Random(sum(sizes))
+    parts = [rnd.randbytes(size) for size in sizes]
+
+    digest = _run(f"""
+        const hasher = new Sha256();
+        for (const hex of {json.dumps([p.hex() for p in parts])})
+            hasher.update(Uint8Array.from(hex.match(/../g) || [], b => parseInt(b, 16)));
+        output(hasher.hexdigest());
+    """)
+
+    assert digest == hashlib.sha256(b''.join(parts)).hexdigest()
+
+
+def test_chunk_size_matches_adaptive_chunk_size():
+    options = dict(initial=256 * 1024, minimum=64 * 1024, maximum=8 * 1024 * 1024,
+                   target_seconds=1.0, smoothing=0.5, granularity=64 * 1024)
+    samples = [(256 * 1024, 0.01), (512 * 1024, 0.02), (1 << 20, 3.0), (1 << 19, 0.5), (0, 1.0),
+               (123_456, 0.7), (1 << 20, 0.0), (65_536, 2.5), (300_000, 0.3)]
+    sizing = AdaptiveChunkSize(**options)
+    expected = [sizing.record(nbytes, seconds) for nbytes, seconds in samples]
+
+    sizes = _run(f"""
+        const sizing = new ChunkSize({{initial: {options['initial']}, minimum: {options['minimum']},
+            maximum: {options['maximum']}, targetSeconds: {options['target_seconds']},
+            smoothing: {options['smoothing']}, granularity: {options['granularity']}}});
+        output({json.dumps(samples)}.map(([nbytes, seconds]) => {{ sizing.record(nbytes, seconds); return sizing.size; }}));
+    """)
+
+    assert sizes == expected
+
+
+def test_rpc_wire_format():
+    outcome = _run(_rpc_script('"ok"\nnull'))
+
+    assert outcome == {
+        'request': {
+            'url': 'http://localhost/wwwpy/rpc', 'method': 'POST',
+            'body': '"server.rpc"\n"upload_write"\n"session-1"\n1048576\n"AAEC/w=="',
+        },
+        'error': None,
+    }
+
+
+def test_rpc_raises_the_server_traceback():
+    outcome = _run(_rpc_script('"ex"\n"Traceback (most recent call last):\\nValueError: gap"'))
+
+    assert outcome['error'] == 'Traceback (most recent call last):\nValueError: gap'
+
+
+def test_rpc_wire_format_matches_wwwpy():
+    encoder_decoder = pytest.importorskip('wwwpy.common.rpc2.encoder_decoder')
+    encoder = encoder_decoder.JsonEncoderDecoder().encoder()
+    for value, cls in [('server.rpc', str), ('upload_write', str), ('session-1', str), (1048576, int),
+                       ('AAEC/w==', str)]:
+        encoder.encode(value, cls)
+    failure = encoder_decoder.JsonEncoderDecoder().encoder()
+    failure.encode('ex', str)
+    failure.encode('Traceback (most recent call last):\nValueError: gap', str)
+    success = encoder_decoder.JsonEncoderDecoder().encoder()
+    success.encode('ok', str)
+    success.encode(None, type(None))
+
+    assert _run(_rpc_script(success.buffer)) == {
+        'request': {'url': 'http://localhost/wwwpy/rpc', 'method': 'POST', 'body': encoder.buffer},
+        'error': None,
+    }
+    assert _run(_rpc_script(failure.buffer))['error'] == 'Traceback (most recent call last):\nValueError: gap'
@@ -0,0 +1,72 @@
+import errno
+import hashlib
+import os
+
+import pytest
+
+from server import content_store
+from server.content_store import ContentStore
+
+
+@pytest.fixture(autouse=True)
+def no_clone(monkeypatch):
+    """Hard links on every filesystem, so the tests behave the same with or without copy-on-write clones."""
+
+    def clone(source, target):
+        raise OSError(errno.EOPNOTSUPP, 'no copy-on-write clones')
+
+    monkeypatch.setattr(content_store, '_clone', clone)
+
+
+def _file(folder, name: str, content: bytes, mtime: float):
+    file = folder / name
+    file.write_bytes(content)
+    os.utime(file, (mtime, mtime))
+    return file
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_add_links_the_file_without_copying_it(tmp_path):
+    target = ContentStore(tmp_path / 'cas')
+    file = _file(tmp_path, 'a.bin', b'abc', 1000)
+
+    assert target.add(file, _sha256(b'abc'))
+    assert target.path_for(_sha256(b'abc')).stat().st_ino == file.stat().st_ino
+
+
+def test_add_is_skipped_when_the_file_cannot_be_linked(tmp_path, monkeypatch):
+    def link(source, target):
+        raise OSError(errno.EXDEV, 'cross-device link')
+
+    monkeypatch.setattr(os, 'link', link)
+    target = ContentStore(tmp_path / 'cas')
+
+    assert not target.add(_file(tmp_path, 'a.bin', b'abc', 1000), _sha256(b'abc'))
+    assert not target.path_for(_sha256(b'abc')).exists()
+
+
+def test_materialize_drops_a_blob_that_changed(tmp_path):
+    target = ContentStore(tmp_path / 'cas')
+    file = _file(tmp_path, 'a.bin', b'abc', 1000)
+    target.add(file, _sha256(b'abc'))
+    file.write_bytes(b'xyz')
+
+    assert not target.materialize(_sha256(b'abc'), 3, tmp_path / 'b.bin')
+    assert not (tmp_path / 'b.bin').exists()
+    assert not target.path_for(_sha256(b'abc')).exists()
+    assert [p.name for p in tmp_path.iterdir() if p.is_file()] == ['a.bin']
+
+
+def test_the_least_recently_modified_blobs_are_evicted_beyond_max_bytes(tmp_path):
+    target = ContentStore(tmp_path / 'cas', max_bytes=7)
+    old = _file(tmp_path, 'old.bin', b'1234', 1000)
+    new = _file(tmp_path, 'new.bin', b'5678', 2000)
+    target.add(new, _sha256(b'5678'))
+    target.add(old, _sha256(b'1234'))
+
+    assert not target.path_for(_sha256(b'1234')).exists()
+    assert target.path_for(_sha256(b'5678')).exists()
+    assert old.read_bytes() == b'1234'
@@ -0,0 +1,377 @@
+import asyncio
+import base64
+import errno
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+from common.upload_protocol import DEFLATE, deflate
+from server import content_store, rpc
+from server.upload_sessions import UploadSessions, UploadState
+
+
+@pytest.fixture(autouse=True)
+def uploads_folder(tmp_path, monkeypatch):
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    monkeypatch.setattr(rpc, '_uploads_folder', lambda: folder)
+    monkeypatch.setattr(rpc, '_store_folder', lambda: tmp_path / 'store')
+    monkeypatch.setattr(rpc, '_sessions', UploadSessions())
+    return folder
+
+
+def _init(name='file1.bin', size=6, fingerprint='fp1', resume=False, compression='', dedup=False) -> str:
+    return asyncio.run(rpc.upload_init(name, size, fingerprint, resume, compression, dedup)).session_id
+
+
+async def _write(session_id: str, offset: int, data: bytes):
+    await rpc.upload_write(session_id, offset, base64.b64encode(data).decode())
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _offset(name='file1.bin', size=6, fingerprint='fp1') -> int:
+    return asyncio.run(rpc.upload_offset(name, size, fingerprint))
+
+
+def test_chunks_written_out_of_order(uploads_folder):
+    session_id = _init()
+    asyncio.run(_write(session_id, 4, b'ef'))
+    asyncio.run(rpc.upload_write(session_id, 2, 'Y2Q='))  # b'cd'
+    asyncio.run(_write(session_id, 0, b'ab'))
+    digest = asyncio.run(rpc.upload_complete(session_id, _sha256(b'abcdef')))
+
+    assert digest == _sha256(b'abcdef')
+    assert (uploads_folder / 'file1.bin').read_bytes() == b'abcdef'
+
+
+def test_offset_is_the_contiguous_prefix_written():
+    session_id = _init()
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(_write(session_id, 4, b'ef'))
+
+    assert _offset() == 2
+
+
+def test_offset_survives_a_server_restart(uploads_folder, monkeypatch):
+    session_id = _init()
+    asyncio.run(_write(session_id, 0, b'ab'))
+    rpc._sessions.close(session_id)
+    monkeypatch.setattr(rpc, '_sessions', UploadSessions())
+
+    assert _offset() == 2
+    session_id = _init(resume=True)
+    asyncio.run(_write(session_id, 2, b'cdef'))
+    assert asyncio.run(rpc.upload_complete(session_id, _sha256(b'abcdef'))) == _sha256(b'abcdef')
+    assert (uploads_folder / 'file1.bin').read_bytes() == b'abcdef'
+
+
+def test_init_without_resume_starts_over():
+    session_id = _init()
+    asyncio.run(_write(session_id, 0, b'ab'))
+    _init()
+
+    assert _offset() == 0
+
+
+def test_offset_is_zero_for_a_different_fingerprint():
+    session_id = _init()
+    asyncio.run(_write(session_id, 0, b'ab'))
+
+    assert _offset(fingerprint='fp2') == 0
+    assert _offset(size=7) == 0
+
+
+def test_offset_is_zero_after_complete():
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+
+    assert _offset(size=2) == 0
+
+
+def test_complete_with_a_different_digest_discards_the_upload(uploads_folder):
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 0, b'ab'))
+
+    assert asyncio.run(rpc.upload_complete(session_id, _sha256(b'xy'))) == _sha256(b'ab')
+    assert list(uploads_folder.iterdir()) == []
+
+
+def test_complete_before_all_bytes_arrived_is_rejected(uploads_folder):
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 1, b'b'))
+
+    with pytest.raises(ValueError):
+        asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+    assert list(uploads_folder.iterdir()) == []
+
+
+def test_write_after_complete_is_rejected():
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+
+    with pytest.raises(ValueError):
+        asyncio.run(_write(session_id, 0, b'ab'))
+
+
+def test_compressed_chunks_are_decompressed(uploads_folder):
+    info = asyncio.run(rpc.upload_init('file1.csv', 6, 'fp1', False, DEFLATE))
+    assert info.compression == DEFLATE
+
+    asyncio.run(_write(info.session_id, 3, deflate(b'def')))
+    asyncio.run(_write(info.session_id, 0, deflate(b'abc')))
+    asyncio.run(rpc.upload_complete(info.session_id, _sha256(b'abcdef')))
+
+    assert (uploads_folder / 'file1.csv').read_bytes() == b'abcdef'
+
+
+def test_unsupported_compression_is_declined():
+    info = asyncio.run(rpc.upload_init('file1.csv', 6, 'fp1', False, 'zstd'))
+
+    assert info.compression == ''
+
+
+def test_chunk_beyond_the_declared_size_is_rejected():
+    session_id = _init(size=2)
+
+    with pytest.raises(ValueError):
+        asyncio.run(_write(session_id, 1, b'bc'))
+
+
+def test_concurrent_writes_to_one_session(uploads_folder):
+    content = os.urandom(64 * 1024)
+    session_id = _init(size=len(content))
+    chunks = [(offset, content[offset:offset + 1024]) for offset in range(0, len(content), 1024)]
+
+    async def send_all():
+        await asyncio.gather(*[_write(session_id, offset, data) for offset, data in reversed(chunks)])
+
+    asyncio.run(send_all())
+
+    assert asyncio.run(rpc.upload_complete(session_id, _sha256(content))) == _sha256(content)
+    assert (uploads_folder / 'file1.bin').read_bytes() == content
+
+
+def test_disk_writes_do_not_block_the_event_loop(monkeypatch):
+    session_id = _init()
+    session = rpc._sessions.get(session_id)
+    release = threading.Event()
+    original_write = session.write
+
+    def slow_write(offset, data, decode_seconds):
+        release.wait(5)
+        original_write(offset, data, decode_seconds)
+
+    monkeypatch.setattr(session, 'write', slow_write)
+
+    async def main():
+        write = asyncio.create_task(_write(session_id, 0, b'abcdef'))
+        await asyncio.sleep(0.01)
+        # the event loop is still serving other work while the write is stuck on the disk
+        assert not write.done()
+        release.set()
+        await write
+
+    asyncio.run(main())
+    assert asyncio.run(rpc.upload_offset('file1.bin', 6, 'fp1')) == 6
+
+
+def test_digest_and_offset_are_computed_off_the_event_loop(monkeypatch):
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    session = rpc._sessions.get(session_id)
+    threads = []
+    hexdigest, load = session.hexdigest, UploadState.load
+    monkeypatch.setattr(session, 'hexdigest', lambda: threads.append(threading.current_thread()) or hexdigest())
+    monkeypatch.setattr(UploadState, 'load', lambda file: threads.append(threading.current_thread()) or load(file))
+
+    assert _offset(name='other.bin') == 0
+    assert asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab'))) == _sha256(b'ab')
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+def test_dedup_misses_unknown_content():
+    assert not asyncio.run(rpc.upload_dedup('file1.bin', 2, _sha256(b'ab')))
+
+
+def test_dedup_places_known_content_under_the_new_name(uploads_folder):
+    session_id = _init(size=2, dedup=True)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+
+    assert asyncio.run(rpc.upload_dedup('sub/file2.bin', 2, _sha256(b'ab')))
+    assert (uploads_folder / 'sub/file2.bin').read_bytes() == b'ab'
+
+
+def test_uploads_without_dedup_stay_out_of_the_content_store(uploads_folder, tmp_path):
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+
+    assert not (tmp_path / 'store' / 'cas').exists()
+    assert not asyncio.run(rpc.upload_dedup('file2.bin', 2, _sha256(b'ab')))
+
+
+def test_stored_content_shares_the_disk_blocks_of_the_upload(uploads_folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(content_store, '_clone', _no_clone)
+    session_id = _init(size=2, dedup=True)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+
+    blob = rpc._content_store().path_for(_sha256(b'ab'))
+    assert blob.stat().st_ino == (uploads_folder / 'file1.bin').stat().st_ino
+
+
+def test_an_upload_edited_in_place_is_not_served_by_dedup(uploads_folder, monkeypatch):
+    monkeypatch.setattr(content_store, '_clone', _no_clone)
+    session_id = _init(size=2, dedup=True)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+    with open(uploads_folder / 'file1.bin', 'r+b') as f:
+        f.write(b'XY')
+
+    assert not asyncio.run(rpc.upload_dedup('file2.bin', 2, _sha256(b'ab')))
+    assert not (uploads_folder / 'file2.bin').exists()
+    assert not rpc._content_store().path_for(_sha256(b'ab')).exists()
+
+
+def test_dedup_copies_through_the_staging_folder(uploads_folder, tmp_path, monkeypatch):
+    session_id = _init(size=2, dedup=True)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'ab')))
+    renames = []
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda source, target: renames.append(source) or replace(source, target))
+
+    assert asyncio.run(rpc.upload_dedup('file2.bin', 2, _sha256(b'ab')))
+    assert [path.parent for path in renames] == [tmp_path / 'store' / 'staging']
+
+
+def _no_clone(source, target):
+    raise OSError(errno.EOPNOTSUPP, 'no copy-on-write clones')
+
+
+def test_dedup_keeps_the_partial_upload_of_an_open_session(uploads_folder):
+    stored = _init(name='stored.bin', size=2, dedup=True)
+    asyncio.run(_write(stored, 0, b'ab'))
+    asyncio.run(rpc.upload_complete(stored, _sha256(b'ab')))
+    session_id = _init(size=4)
+    asyncio.run(_write(session_id, 0, b'cd'))
+
+    assert asyncio.run(rpc.upload_dedup('file1.bin', 2, _sha256(b'ab')))
+    asyncio.run(_write(session_id, 2, b'ef'))
+    assert asyncio.run(rpc.upload_complete(session_id, _sha256(b'cdef'))) == _sha256(b'cdef')
+    assert (uploads_folder / 'file1.bin').read_bytes() == b'cdef'
+
+
+def test_dedup_rejects_an_invalid_digest():
+    with pytest.raises(ValueError):
+        asyncio.run(rpc.upload_dedup('file1.bin', 2, '../../etc/passwd'))
+
+
+def test_abort_removes_the_file(uploads_folder):
+    session_id = _init(size=2)
+    asyncio.run(_write(session_id, 0, b'ab'))
+    asyncio.run(rpc.upload_abort(session_id))
+
+    assert list(uploads_folder.iterdir()) == []
+
+
+def test_path_outside_the_uploads_folder_is_rejected():
+    with pytest.raises(ValueError):
+        _init(name='../escape.bin')
+
+
+def test_relative_paths_of_folder_uploads_are_preserved(uploads_folder):
+    session_id = _init(name='photos/2024/a.bin')
+    asyncio.run(_write(session_id, 0, b'abcdef'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'abcdef')))
+
+    assert (uploads_folder / 'photos' / '2024' / 'a.bin').read_bytes() == b'abcdef'
+
+
+def test_relative_path_escaping_the_uploads_folder_is_rejected():
+    with pytest.raises(ValueError):
+        _init(name='photos/../../escape.bin')
+
+
+def test_metrics():
+    completed = _init(name='a.bin')
+    asyncio.run(rpc.upload_write(completed, 0, base64.b64encode(b'abcdef').decode()))
+    asyncio.run(rpc.upload_complete(completed, _sha256(b'abcdef')))
+    aborted = _init(name='b.bin')
+    asyncio.run(_write(aborted, 0, b'abc'))
+    asyncio.run(rpc.upload_abort(aborted))
+    _init(name='c.bin')
+
+    text = asyncio.run(rpc.upload_metrics())
+
+    assert 'upload_sessions_open 1\n' in text
+    assert 'upload_sessions_closed_total{outcome="aborted"} 1\n' in text
+    assert 'upload_sessions_closed_total{outcome="completed"} 1\n' in text
+    assert 'upload_bytes_total 9\n' in text
+    assert 'upload_chunks_total 2\n' in text
+    assert 'upload_chunk_write_seconds_count 2\n' in text
+
+
+def test_metrics_never_expose_a_session_id():
+    session_ids = [_init(name='a.bin'), _init(name='b.bin')]
+    asyncio.run(rpc.upload_write(session_ids[0], 0, base64.b64encode(b'abc').decode()))
+
+    text = rpc._sessions.render_metrics()
+
+    assert 'upload_session_bytes{session="1"} 3\n' in text
+    assert 'upload_session_bytes{session="2"} 0\n' in text
+    assert not [session_id for session_id in session_ids if session_id in text]
+
+
+def test_per_chunk_log_is_sampled(monkeypatch, caplog):
+    monkeypatch.setattr(rpc, '_chunk_log_every', 3)
+    session_id = _init(size=6)
+    with caplog.at_level(logging.INFO, logger=rpc.logger.name):
+        for offset in range(6):
+            asyncio.run(_write(session_id, offset, b'x'))
+
+    chunk_lines = [r for r in caplog.records if r.msg.startswith('upload chunk')]
+    assert [r.args[2] for r in chunk_lines] == [1, 4]
+
+
+def test_partial_uploads_stay_out_of_the_uploads_folder(uploads_folder):
+    session_id = _init(name='data/file1.bin')
+    asyncio.run(_write(session_id, 0, b'abc'))
+
+    assert not (uploads_folder / 'data' / 'file1.bin').exists()
+    assert _offset(name='data/file1.bin') == 3
+
+    asyncio.run(_write(session_id, 3, b'def'))
+    asyncio.run(rpc.upload_complete(session_id, _sha256(b'abcdef')))
+
+    assert (uploads_folder / 'data' / 'file1.bin').read_bytes() == b'abcdef'
+    assert list((uploads_folder.parent / 'store' / 'staging').iterdir()) == []
+
+
+def test_requests_close_idle_sessions(monkeypatch):
+    clock_now = [0.0]
+    monkeypatch.setattr(rpc, '_sessions', UploadSessions(idle_timeout=10, sweep_interval=1, clock=lambda: clock_now[0]))
+    idle = _init('idle.bin')
+    clock_now[0] = 5
+    active = _init('active.bin')
+
+    clock_now[0] = 12
+    asyncio.run(rpc.upload_metrics())
+
+    deadline = time.monotonic() + 5
+    while len(rpc._sessions) > 1 and time.monotonic() < deadline:  # the sweep runs in the background
+        time.sleep(0.01)
+    with pytest.raises(ValueError, match='Unknown upload session'):
+        rpc._sessions.get(idle)
+    assert rpc._sessions.get(active)
@@ -0,0 +1,36 @@
+from server.upload_metrics import LatencyHistogram, SessionMetrics, UploadMetrics
+
+
+def test_histogram_buckets_are_cumulative():
+    target = LatencyHistogram(bounds=(0.001, 0.01))
+    for seconds in [0.0005, 0.001, 0.005, 2.0]:
+        target.observe(seconds)
+
+    assert target.cumulative() == [('0.001', 2), ('0.01', 3), ('+Inf', 4)]
+    assert target.count == 4
+    assert target.sum == 2.0065
+
+
+def test_render_adds_the_open_sessions_to_the_closed_ones():
+    target = UploadMetrics()
+    closed = SessionMetrics()
+    closed.record_chunk(received_bytes=10, written_bytes=40, decode_seconds=0.5, write_seconds=0.002)
+    target.session_opened()
+    target.session_closed(closed, 'aborted')
+    target.session_opened()
+    open_session = SessionMetrics()
+    open_session.record_chunk(received_bytes=20, written_bytes=20, decode_seconds=0.0, write_seconds=0.0001)
+
+    text = target.render({2: open_session})
+
+    assert 'upload_sessions_open 1\n' in text
+    assert 'upload_sessions_opened_total 2\n' in text
+    assert 'upload_sessions_closed_total{outcome="aborted"} 1\n' in text
+    assert 'upload_bytes_total 60\n' in text
+    assert 'upload_received_bytes_total 30\n' in text
+    assert 'upload_chunks_total 2\n' in text
+    assert 'upload_decode_seconds_total 0.5\n' in text
+    assert 'upload_chunk_write_seconds_bucket{le="0.0001"} 1\n' in text
+    assert 'upload_chunk_write_seconds_bucket{le="+Inf"} 2\n' in text
+    assert 'upload_chunk_write_seconds_count 2\n' in text
+    assert 'upload_session_bytes{session="2"} 20\n' in text
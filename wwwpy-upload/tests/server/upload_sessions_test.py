@@ -0,0 +1,189 @@
+import errno
+import hashlib
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import pytest
+
+from server.upload_sessions import UploadSession, UploadSessions, UploadState
+
+
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_idle_sessions_are_closed_and_stay_resumable(tmp_path):
+    clock = FakeClock()
+    target = UploadSessions(idle_timeout=10, clock=clock)
+    file = tmp_path / 'file1.bin'
+    session = target.open(file, 4, 'fp1', resume=False)
+    session.write(0, b'ab')
+
+    clock.now = 11
+    target.sweep()
+
+    assert len(target) == 0
+    assert UploadState.load(file).written == 2
+
+
+def test_sweeps_are_due_once_per_interval(tmp_path):
+    clock = FakeClock()
+    target = UploadSessions(sweep_interval=5, clock=clock)
+
+    assert target.sweep_due()
+    assert not target.sweep_due()
+    clock.now = 5
+    assert target.sweep_due()
+    clock.now = 6
+    target.sweep()
+    clock.now = 10
+    assert not target.sweep_due()
+
+
+def test_state_save_is_throttled(tmp_path):
+    clock = FakeClock()
+    target = UploadSessions(state_save_interval=1, clock=clock)
+    file = tmp_path / 'file1.bin'
+    session = target.open(file, 4, 'fp1', resume=False)
+
+    session.write(0, b'a')
+    assert UploadState.load(file).written == 0
+
+    clock.now = 1
+    session.write(1, b'b')
+    assert UploadState.load(file).written == 2
+
+
+def test_out_of_order_chunks_are_buffered_up_to_a_limit(tmp_path):
+    target = UploadSessions(max_unhashed=3000)
+    content = bytes(range(256)) * 40
+    session = target.open(tmp_path / 'file1.bin', len(content), 'fp1', resume=False)
+    chunks = [(offset, content[offset:offset + 1000]) for offset in range(0, len(content), 1000)]
+
+    for offset, data in reversed(chunks):
+        session.write(offset, data)
+        assert session._unhashed_bytes <= 3000
+
+    assert session.hexdigest() == hashlib.sha256(content).hexdigest()
+    target.close(session.session_id)
+    assert session.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_open_preallocates_the_declared_size(tmp_path):
+    target = UploadSessions()
+    file = tmp_path / 'file1.bin'
+    target.open(file, 1000, 'fp1', resume=False)
+
+    assert file.stat().st_size == 1000
+
+
+def test_open_fails_fast_when_the_disk_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, 'disk_usage', lambda path: DiskUsage(total=100, used=90, free=10))
+    target = UploadSessions()
+    file = tmp_path / 'file1.bin'
+
+    with pytest.raises(OSError) as exc_info:
+        target.open(file, 1000, 'fp1', resume=False)
+
+    assert exc_info.value.errno == errno.ENOSPC
+    assert len(target) == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_staging_sweep_by_last_touched_time(tmp_path):
+    target = UploadSessions()
+    now = time.time()
+
+    def partial(name: str, size: int, age: float, state_age: float | None = None):
+        file = tmp_path / f'{name}.part'
+        file.write_bytes(b'x' * size)
+        UploadState(size, 'fp', size).save(file)
+        state_age = age if state_age is None else state_age
+        os.utime(file, (now - age, now - age))
+        os.utime(UploadState.path_for(file), (now - state_age, now - state_age))
+        return file
+
+    expired = partial('expired', 10, age=100)
+    paused = partial('paused', pow(2, 20), age=50)
+    state_touched = partial('state_touched', 10, age=100, state_age=10)
+    stateless = partial('stateless', 10, age=10)
+    UploadState.remove(stateless)
+    in_use = target.open(tmp_path / 'in_use.part', 100, 'fp', resume=False).file
+    os.utime(in_use, (now - 1000, now - 1000))
+
+    removed = target.sweep_staging(tmp_path, max_age=60)
+
+    assert sorted(removed) == sorted([expired, stateless])
+    assert not UploadState.path_for(expired).exists()
+    assert paused.exists()
+    assert state_touched.exists()
+    assert in_use.exists()
+
+
+def test_staging_sweep_spares_files_being_opened(tmp_path, monkeypatch):
+    target = UploadSessions()
+    old = time.time() - 1000
+    file = tmp_path / 'resumed.part'
+    file.write_bytes(b'ab')
+    UploadState(4, 'fp', 2).save(file)
+    os.utime(file, (old, old))
+    swept = []
+    open_session = UploadSessions._open
+
+    def sweep_while_opening(self, *args):
+        # the sweep runs while `open` resumes the file
+        swept.extend(target.sweep_staging(tmp_path, max_age=60))
+        return open_session(self, *args)
+
+    monkeypatch.setattr(UploadSessions, '_open', sweep_while_opening)
+    session = target.open(file, 4, 'fp', resume=True)
+
+    assert swept == []
+    assert session.written == 2
+
+
+def test_staging_sweep_spares_files_being_finalized(tmp_path, monkeypatch):
+    target = UploadSessions()
+    session = target.open(tmp_path / 'file1.bin.part', 2, 'fp', resume=False, target=tmp_path / 'file1.bin')
+    session.write(0, b'ab')
+    old = time.time() - 1000
+    os.utime(session.file, (old, old))
+    swept = []
+    finalize = UploadSession.finalize
+
+    def sweep_then_finalize(self):
+        # the sweep runs after the session is closed, before its file is moved into place
+        swept.extend(target.sweep_staging(tmp_path, max_age=60))
+        finalize(self)
+
+    monkeypatch.setattr(UploadSession, 'finalize', sweep_then_finalize)
+    target.close(session.session_id, 'completed', finalize=True)
+
+    assert swept == []
+    assert (tmp_path / 'file1.bin').read_bytes() == b'ab'
+
+
+def test_staging_sweep_removes_orphaned_state_and_stale_temporary_files(tmp_path):
+    target = UploadSessions()
+    old = time.time() - 1000
+    orphan = tmp_path / 'gone.part'
+    UploadState(4, 'fp', 2).save(orphan)
+    stale_tmp = tmp_path / '.file1.bin.0123.tmp'
+    stale_tmp.write_bytes(b'x')
+    os.utime(stale_tmp, (old, old))
+    recent_tmp = tmp_path / '.file2.bin.4567.tmp'
+    recent_tmp.write_bytes(b'x')
+
+    removed = target.sweep_staging(tmp_path, max_age=60)
+
+    assert sorted(removed) == sorted([UploadState.path_for(orphan), stale_tmp])
+    assert recent_tmp.exists()